@@ -0,0 +1,68 @@
+# Measures nsdump's text output rate in lines per second, for a given file
+# or a synthetic stream of register writes.
+#
+#   python benchmarks/bench_dump.py [FILE]
+import argparse
+import os
+import random
+import time
+
+from notesaladtools import nsdump
+from notesaladtools.events import EndEvent, OPLWriteEvent, OPMWriteEvent
+from notesaladtools.parser import open_parser
+
+
+class SyntheticParser:
+    def __init__(self, count, seed=0):
+        self.count = count
+        self.seed = seed
+        self.time_base = 44100
+
+    def read_events(self):
+        rng = random.Random(self.seed)
+        for i in range(self.count):
+            if i % 4 == 0:
+                yield OPMWriteEvent(i, rng.randrange(0x100), rng.randrange(0x100))
+            else:
+                yield OPLWriteEvent(i, rng.randrange(0x200), rng.randrange(0x100))
+        yield EndEvent(self.count)
+
+
+def bench(parser_factory, repeat):
+    best = None
+    lines = 0
+    for _ in range(repeat):
+        nsdump.format_opl_write.cache_clear()
+        nsdump.format_opm_write.cache_clear()
+        input_parser = parser_factory()
+        with open(os.devnull, 'w', encoding='utf-8') as output:
+            start_time = time.perf_counter()
+            nsdump.print_events(input_parser.read_events(), output)
+            elapsed = time.perf_counter() - start_time
+        lines = sum(1 for _ in parser_factory().read_events())
+        best = elapsed if best is None else min(best, elapsed)
+    return (lines, best)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nsdump text output.')
+    parser.add_argument('--events', '-n', type=int, default=200000,
+                        help='number of synthetic events when no file is given (default: 200000)')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='number of runs, of which the fastest is reported (default: 3)')
+    parser.add_argument('file', metavar='FILE', nargs='?', help='a file to dump')
+    args = parser.parse_args()
+
+    if args.file is not None:
+        def parser_factory():
+            return open_parser(args.file)
+    else:
+        def parser_factory():
+            return SyntheticParser(args.events)
+
+    (lines, elapsed) = bench(parser_factory, args.repeat)
+    print(f'{lines} lines in {elapsed:.3f}s: {lines / elapsed:.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# Measures the throughput and peak memory of parsing, processing, writing,
+# dumping and rendering, using the synthetic corpus from corpus.py. Results
+# can be saved with --json and compared between commits with compare.py.
+#
+#   python benchmarks/bench_pipeline.py [--suite SUITE] [--json PATH]
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from corpus import generate_corpus
+from notesaladtools import nsdump
+from notesaladtools.devices import get_device
+from notesaladtools.parser import open_parser
+from notesaladtools.processor import add_key_off, convert_event_times, optimise
+from notesaladtools.render import play
+from notesaladtools.writer import open_writer
+
+suites = ('parse', 'process', 'write', 'dump', 'render')
+
+
+def read_events(path):
+    with open_parser(path) as input_parser:
+        return (list(input_parser.read_events()), input_parser.time_base)
+
+
+def bench_parse(path):
+    count = 0
+    with open_parser(path) as input_parser:
+        for _ in input_parser.read_events():
+            count += 1
+    return count
+
+
+def bench_process(events, process):
+    count = 0
+    for _ in process(iter(events)):
+        count += 1
+    return len(events)
+
+
+def bench_write(events, path):
+    with open_writer(path) as writer:
+        for event in events:
+            writer.write_event(event)
+    return len(events)
+
+
+def bench_dump(events):
+    nsdump.format_opl_write.cache_clear()
+    nsdump.format_opm_write.cache_clear()
+    with open(os.devnull, 'w', encoding='utf-8') as output:
+        nsdump.print_events(iter(events), output)
+    return len(events)
+
+
+def bench_summarize(events, time_base):
+    profile = nsdump.WriteProfile(time_base)
+    for event in events:
+        profile.update(event)
+    profile.finish()
+    return len(events)
+
+
+def bench_render(path, output_path):
+    # Returns the seconds of audio rendered
+    with open_parser(path) as input_parser, \
+            get_device(f'oplwav:{output_path}', opl_instances=input_parser.opl_chips) as chip:
+        play(input_parser, chip)
+        return input_parser.duration / input_parser.time_base
+
+
+def get_benchmarks(corpus, temp_dir):
+    # Returns a list of (suite, name, unit, function), where function returns
+    # the number of units processed
+    benchmarks = []
+    for (name, path) in corpus.items():
+        benchmarks.append(('parse', f'parse {name}', 'events', lambda path=path: bench_parse(path)))
+
+    loaded = {}
+
+    def get_events(name):
+        if name not in loaded:
+            loaded[name] = read_events(corpus[name])
+        return loaded[name]
+
+    for name in ('opl2.vgm', 'burst.vgm', 'opm.vgm'):
+        benchmarks.append(('process', f'optimise {name}', 'events',
+                           lambda name=name: bench_process(get_events(name)[0], optimise)))
+    benchmarks.append(('process', 'add_key_off opl2.vgm', 'events',
+                       lambda: bench_process(get_events('opl2.vgm')[0], add_key_off)))
+    benchmarks.append(('process', 'convert_event_times opl2.vgm', 'events',
+                       lambda: bench_process(get_events('opl2.vgm')[0],
+                                             lambda events: convert_event_times(events, 44100, 1000))))
+
+    for (name, output_name) in (('opl2.vgm', 'write.vgm'), ('opl3.vgm', 'write.vgm'), ('opl2.vgm', 'write.vgz')):
+        output_path = os.path.join(temp_dir, output_name)
+        benchmarks.append(('write', f'write {name} to {output_name[-3:]}', 'events',
+                           lambda name=name, output_path=output_path: bench_write(get_events(name)[0], output_path)))
+
+    for name in ('opl2.vgm', 'opm.vgm'):
+        benchmarks.append(('dump', f'dump {name}', 'events', lambda name=name: bench_dump(get_events(name)[0])))
+        benchmarks.append(('dump', f'summarize {name}', 'events',
+                           lambda name=name: bench_summarize(*get_events(name))))
+
+    output_path = os.path.join(temp_dir, 'render.wav')
+    for name in ('opl2.vgm', 'opl3.vgm'):
+        benchmarks.append(('render', f'render {name}', 'seconds',
+                           lambda name=name: bench_render(corpus[name], output_path)))
+    return benchmarks
+
+
+def measure(function, repeat):
+    # The fastest of repeat runs after a warm-up run, then one more run to
+    # find the peak memory allocated, as tracing slows everything down
+    function()
+    best = None
+    amount = 0
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        amount = function()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        function()
+        (_, peak_memory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'amount': amount, 'time': best, 'rate': amount / best if best > 0 else 0, 'peak_memory': peak_memory}
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parse, process, write, dump and render stages.')
+    parser.add_argument('--suite', '-s', choices=suites, action='append',
+                        help='run only the given suite (can be given more than once)')
+    parser.add_argument('--duration', '-d', type=float, default=60,
+                        help='length of each synthetic file in seconds (default: 60)')
+    parser.add_argument('--rate', type=int, default=2000,
+                        help='average register writes per second in the synthetic files (default: 2000)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic files (default: 0)')
+    parser.add_argument('--repeat', '-r', type=int, default=5,
+                        help='number of runs, of which the fastest is reported (default: 5)')
+    parser.add_argument('--json', metavar='PATH', help='write the results to PATH as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus = generate_corpus(os.path.join(temp_dir, 'corpus'), args.duration, args.rate, args.seed)
+        print(f'{"Benchmark":<36} {"Time (s)":>9} {"Rate":>20} {"Peak memory (MB)":>17}')
+        for (suite, name, unit, function) in get_benchmarks(corpus, temp_dir):
+            if args.suite is not None and suite not in args.suite:
+                continue
+            try:
+                result = measure(function, args.repeat)
+            except ImportError as e:
+                # The MIDI parser and the emulators need optional packages
+                results[name] = {'suite': suite, 'skipped': str(e)}
+                print(f'{name:<36} skipped ({e})')
+                continue
+            result['suite'] = suite
+            result['unit'] = unit
+            results[name] = result
+            rate = f'{result["rate"]:.0f} {unit}/s' if unit != 'seconds' \
+                else f'{result["rate"]:.1f}x realtime'
+            print(f'{name:<36} {result["time"]:>9.3f} {rate:>20} {result["peak_memory"] / 1000000:>17.2f}')
+
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'commit': get_commit(), 'python': platform.python_version(), 'duration': args.duration,
+                       'rate': args.rate, 'seed': args.seed, 'results': results}, output, indent=2)
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Measures how long each command line tool takes to import, using
+# python -X importtime, and checks it against a budget. Also checks that no
+# tool imports the optional or slow-loading modules that are meant to be
+# imported only when needed. Exits with status 1 if any check fails.
+#
+#   python benchmarks/bench_startup.py [--repeat N] [--scale FACTOR]
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time budgets in milliseconds, excluding the interpreter's own
+# startup. argparse alone accounts for around 15 ms.
+startup_budgets = {
+    'nsdump': 45,
+    'nsplay': 45,
+    'nsconvert': 40,
+    'nsrender': 50,
+    'nslinkbench': 50,
+    'nsindex': 40,
+    'nsmidi': 30,
+}
+default_budget = 40
+
+# Modules that should only be imported once a tool needs them
+deferred_modules = ('concurrent.futures', 'gzip', 'mido', 'multiprocessing', 'notesalad', 'numpy', 'pyaudio',
+                    'pyrad', 'serial', 'sqlite3')
+# Modules a tool needs whatever it is asked to do
+required_modules = {
+    'nslinkbench': ('multiprocessing',),
+    'nsindex': ('sqlite3',),
+}
+
+
+def get_entry_points():
+    # (name, module) for each console script in setup.py
+    with open(os.path.join(repo_dir, 'setup.py'), encoding='utf-8') as setup_file:
+        return re.findall(r"'(\w+)=([\w.]+):main'", setup_file.read())
+
+
+def measure_import(module):
+    # Returns the cumulative import time in microseconds and the names of all
+    # modules imported, or None and the error if the import failed
+    env = dict(os.environ)
+    # Use cached bytecode, as an installed package would
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = repo_dir + os.pathsep + env.get('PYTHONPATH', '')
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env,
+                             capture_output=True, text=True, check=False)
+    if process.returncode != 0:
+        return (None, process.stderr.strip().splitlines()[-1])
+    total = None
+    modules = []
+    for line in process.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        modules.append(name)
+        if name == module:
+            total = int(parts[1])
+    return (total, modules)
+
+
+def is_deferred(name, allowed):
+    return any(name == module or name.startswith(module + '.')
+               for module in deferred_modules if module not in allowed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of each command line tool.')
+    parser.add_argument('--repeat', '-r', type=int, default=5,
+                        help='number of runs, of which the median is reported (default: 5)')
+    parser.add_argument('--scale', '-s', type=float, default=1,
+                        help='multiply the budgets by FACTOR, for slower machines (default: 1)')
+    args = parser.parse_args()
+
+    failures = 0
+    print(f'{"Tool":<14} {"Import (ms)":>12} {"Budget (ms)":>12}')
+    for (name, module) in get_entry_points():
+        # The first run writes the bytecode cache
+        (total, modules) = measure_import(module)
+        if total is None:
+            print(f'{name:<14} {"-":>12} {"-":>12}  {modules}')
+            failures += 1
+            continue
+        elapsed = statistics.median(measure_import(module)[0] for _ in range(args.repeat)) / 1000
+        budget = startup_budgets.get(name, default_budget) * args.scale
+        problems = []
+        if elapsed > budget:
+            problems.append('over budget')
+        loaded = sorted(set(module_name for module_name in modules
+                            if is_deferred(module_name, required_modules.get(name, ()))))
+        if len(loaded) > 0:
+            problems.append('imports ' + ', '.join(loaded))
+        print(f'{name:<14} {elapsed:>12.1f} {budget:>12.0f}  {"; ".join(problems) or "ok"}')
+        if len(problems) > 0:
+            failures += 1
+
+    if failures > 0:
+        print(f'{failures} tools failed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
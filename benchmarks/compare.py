@@ -0,0 +1,68 @@
+# Compares two sets of results saved by bench_pipeline.py --json, flagging
+# benchmarks that got slower or used more memory. Exits with status 1 if any
+# did, so it can be used to check for regressions between commits.
+#
+#   python benchmarks/compare.py [--threshold PERCENT] BASELINE.json RESULTS.json
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as input_file:
+        return json.load(input_file)
+
+
+def compare(baseline, results, threshold=10, memory_threshold=20):
+    # Yields (name, time change %, memory change %, flags), with None for
+    # changes that cannot be measured
+    for (name, result) in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or 'skipped' in base or 'skipped' in result:
+            continue
+        # Files of a different length take longer, so compare rates
+        time_change = (base['rate'] / result['rate'] - 1) * 100 if result['rate'] > 0 else None
+        memory_change = (result['peak_memory'] / base['peak_memory'] - 1) * 100 if base['peak_memory'] > 0 else None
+        flags = []
+        if time_change is not None and time_change > threshold:
+            flags.append('SLOWER')
+        if memory_change is not None and memory_change > memory_threshold:
+            flags.append('MORE MEMORY')
+        yield (name, time_change, memory_change, flags)
+
+
+def format_change(change):
+    return '-' if change is None else f'{change:+.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two sets of benchmark results.')
+    parser.add_argument('--threshold', '-t', type=float, default=10,
+                        help='flag benchmarks more than PERCENT slower (default: 10)')
+    parser.add_argument('--memory-threshold', type=float, default=20,
+                        help='flag benchmarks using more than PERCENT more peak memory (default: 20)')
+    parser.add_argument('baseline', metavar='BASELINE', help='results to compare against')
+    parser.add_argument('results', metavar='RESULTS', help='new results')
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    results = load_results(args.results)
+    print(f'Comparing {results.get("commit") or args.results} against {baseline.get("commit") or args.baseline}')
+    if (baseline.get('duration'), baseline.get('rate')) != (results.get('duration'), results.get('rate')):
+        print('Warning: the results were measured with different corpus settings')
+
+    regressions = 0
+    print(f'{"Benchmark":<36} {"Time":>8} {"Memory":>8}')
+    for (name, time_change, memory_change, flags) in compare(baseline, results, args.threshold,
+                                                             args.memory_threshold):
+        print(f'{name:<36} {format_change(time_change):>8} {format_change(memory_change):>8}  {" ".join(flags)}')
+        if len(flags) > 0:
+            regressions += 1
+
+    if regressions > 0:
+        print(f'{regressions} regressions')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+# Generates a deterministic corpus of synthetic VGM, VGZ, DRO and MIDI files
+# for the benchmarks. The same duration, rate and seed always give the same
+# files, so results can be compared between commits.
+#
+#   python benchmarks/corpus.py [--duration SECONDS] [--rate WRITES] OUTPUT_DIR
+import argparse
+import gzip
+import os
+import random
+import struct
+
+from notesaladtools.events import EndEvent, JumpToMarkerEvent, MarkerEvent, OPLWriteEvent, OPMWriteEvent
+from notesaladtools.writer import BufferedStream, VGMWriter
+
+vgm_time_base = 44100
+# Writes are grouped into ticks, as most players update the chip at a fixed rate
+tick_rate = 60
+
+opl_operator_offsets = (0x00, 0x01, 0x02, 0x08, 0x09, 0x0a, 0x10, 0x11, 0x12)
+opl_operator_regs = (0x20, 0x40, 0x60, 0x80, 0xe0)
+
+
+def get_opl_writes(rng, ch, four_op=False):
+    # The register writes for one note on an OPL channel: operator settings
+    # for the first operator pair (and the second for 4-op channels), then
+    # frequency and key on. Channels 9-17 are in the second register bank.
+    bank = 0x100 if ch >= 9 else 0
+    ch %= 9
+    writes = []
+    pairs = (ch, ch + 3) if four_op else (ch,)
+    for pair in pairs:
+        for offset in (opl_operator_offsets[pair], opl_operator_offsets[pair] + 3):
+            for reg in opl_operator_regs:
+                writes.append((bank | (reg + offset), rng.randrange(0x100)))
+        writes.append((bank | (0xc0 + pair), rng.randrange(0x10) | 0x30))
+    fnum = rng.randrange(0x150, 0x2b0)
+    writes.append((bank | (0xa0 + ch), fnum & 0xff))
+    writes.append((bank | (0xb0 + ch), 0x20 | (rng.randrange(2, 7) << 2) | (fnum >> 8)))
+    return writes
+
+
+def get_opm_writes(rng, ch):
+    writes = []
+    for reg_base in range(0x40, 0x100, 0x20):
+        for slot in range(4):
+            writes.append((reg_base + (slot * 8) + ch, rng.randrange(0x100)))
+    writes.append((0x20 + ch, 0xc0 | rng.randrange(0x40)))
+    writes.append((0x28 + ch, rng.randrange(0x80)))
+    writes.append((0x30 + ch, rng.randrange(0x100) & 0xfc))
+    writes.append((0x08, 0x78 | ch))
+    return writes
+
+
+def generate_events(kind, duration=60, rate=2000, seed=0):
+    # Returns a list of events in 44100 Hz samples, averaging rate register
+    # writes per second. kind is one of:
+    #   opl2   notes on the 9 OPL2 channels
+    #   opl3   OPL3 with all six 4-op channels enabled, using both banks
+    #   opm    notes on the 8 OPM channels
+    #   loop   as opl2, looping back to a quarter of the way through
+    #   burst  as opl2, but with most writes sent in bursts every half second
+    rng = random.Random(f'{kind}:{seed}')
+    events = []
+    keys_on = {}
+    time = 0
+
+    def add_write(reg, value):
+        if kind == 'opm':
+            events.append(OPMWriteEvent(time, reg, value))
+        else:
+            events.append(OPLWriteEvent(time, reg, value))
+
+    if kind == 'opl3':
+        add_write(0x105, 0x01)
+        add_write(0x104, 0x3f)
+    elif kind != 'opm':
+        add_write(0x01, 0x20)
+
+    tick_count = round(duration * tick_rate)
+    loop_tick = tick_count // 4 if kind == 'loop' else None
+    writes_per_tick = rate / tick_rate
+    budget = 0
+    for tick in range(tick_count):
+        time = tick * vgm_time_base // tick_rate
+        if tick == loop_tick:
+            events.append(MarkerEvent(time, 0))
+        if kind == 'burst':
+            budget += writes_per_tick * 0.2
+            if tick % (tick_rate // 2) == 0:
+                budget += writes_per_tick * 0.8 * (tick_rate // 2)
+        else:
+            budget += writes_per_tick
+        while budget >= 1:
+            if kind == 'opm':
+                ch = rng.randrange(8)
+                if keys_on.pop(ch, False):
+                    add_write(0x08, ch)
+                    budget -= 1
+                    continue
+                writes = get_opm_writes(rng, ch)
+            elif kind == 'opl3':
+                ch = rng.choice((0, 1, 2, 9, 10, 11, 6, 7, 8, 15, 16, 17))
+                four_op = ch % 9 < 3
+                if keys_on.pop(ch, False):
+                    add_write((0x100 if ch >= 9 else 0) | (0xb0 + ch % 9), 0)
+                    budget -= 1
+                    continue
+                writes = get_opl_writes(rng, ch, four_op)
+            else:
+                ch = rng.randrange(9)
+                if keys_on.pop(ch, False):
+                    add_write(0xb0 + ch, 0)
+                    budget -= 1
+                    continue
+                # Short updates, such as volume and pitch changes, are more
+                # common than new notes
+                if rng.random() < 0.5:
+                    writes = [(0x40 + opl_operator_offsets[ch] + 3, rng.randrange(0x40)),
+                              (0xa0 + ch, rng.randrange(0x100))]
+                else:
+                    writes = get_opl_writes(rng, ch)
+            for (reg, value) in writes:
+                add_write(reg, value)
+            budget -= len(writes)
+            # Notes end with a key on, and are keyed off next time the
+            # channel is picked
+            if writes[-1][0] & 0xff & 0xf0 in (0x00, 0xb0):
+                keys_on[ch] = True
+
+    end_time = tick_count * vgm_time_base // tick_rate
+    if loop_tick is not None:
+        events.append(JumpToMarkerEvent(end_time, 0))
+    events.append(EndEvent(end_time))
+    return events
+
+
+def write_vgm(path, events):
+    if path.lower().endswith('.vgz'):
+        writer = VGMWriter(BufferedStream(gzip.open(path, 'wb')))
+    else:
+        writer = VGMWriter(open(path, 'wb'))
+    with writer:
+        for event in events:
+            writer.write_event(event)
+
+
+def write_dro(path, events, time_base=vgm_time_base):
+    # DRO 2.0 with interleaved register/value pairs. Register numbers are
+    # stored as indexes into a code map, with the top bit set for the second
+    # OPL3 bank; two further codes mark delays.
+    writes = [event for event in events if isinstance(event, OPLWriteEvent)]
+    codemap = sorted(set(event.reg & 0xff for event in writes))
+    if len(codemap) > 126:
+        raise ValueError('Too many different registers for a DRO file')
+    codes = {reg: code for (code, reg) in enumerate(codemap)}
+    short_delay = len(codemap)
+    long_delay = short_delay + 1
+
+    pairs = bytearray()
+    current_time = 0
+    for event in writes:
+        time = event.time * 1000 // time_base
+        delay = time - current_time
+        current_time = time
+        while delay > 0:
+            if delay > 256:
+                long_value = min(delay >> 8, 256)
+                pairs += bytes((long_delay, long_value - 1))
+                delay -= long_value << 8
+            else:
+                pairs += bytes((short_delay, delay - 1))
+                delay = 0
+        pairs += bytes((codes[event.reg & 0xff] | (0x80 if event.reg & 0x100 else 0), event.value))
+
+    duration = events[-1].time * 1000 // time_base
+    hardware_type = 2 if any(event.reg & 0x100 for event in writes) else 0
+    with open(path, 'wb') as output_file:
+        output_file.write(struct.pack('<8sHH', b'DBRAWOPL', 2, 0))
+        output_file.write(struct.pack('<IIBBBBBB', len(pairs) // 2, duration, hardware_type, 0, 0,
+                                      short_delay, long_delay, len(codemap)))
+        output_file.write(bytes(codemap))
+        output_file.write(pairs)
+
+
+def write_variable_length(data, value):
+    buffer = [value & 0x7f]
+    value >>= 7
+    while value > 0:
+        buffer.append(0x80 | (value & 0x7f))
+        value >>= 7
+    data += bytes(reversed(buffer))
+
+
+def write_midi(path, duration=60, rate=2000, seed=0):
+    # A type 0 standard MIDI file at 120 bpm, with notes on channels 1-9 and
+    # drums on channel 10. rate is the number of register writes per second
+    # to aim for, taking roughly 12 writes for each note on or off.
+    rng = random.Random(f'midi:{seed}')
+    ticks_per_beat = 480
+    ticks_per_second = ticks_per_beat * 2
+    notes_per_second = max(1, rate // 12)
+    messages = []
+    for i in range(round(duration * notes_per_second)):
+        start = i * ticks_per_second // notes_per_second
+        length = rng.randrange(ticks_per_beat // 8, ticks_per_beat * 2)
+        ch = rng.choice((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9))
+        note = rng.randrange(35, 82) if ch == 9 else rng.randrange(36, 96)
+        messages.append((start, 1, bytes((0x90 | ch, note, rng.randrange(40, 128)))))
+        messages.append((start + length, 0, bytes((0x80 | ch, note, 0x40))))
+    # Note offs first where several messages share a time
+    messages.sort(key=lambda message: message[:2])
+
+    track = bytearray()
+    for ch in range(10):
+        write_variable_length(track, 0)
+        track += bytes((0xc0 | ch, rng.randrange(128)))
+    current_time = 0
+    for (time, _, message) in messages:
+        write_variable_length(track, time - current_time)
+        track += message
+        current_time = time
+    write_variable_length(track, 0)
+    track += b'\xff\x2f\x00'
+
+    with open(path, 'wb') as output_file:
+        output_file.write(struct.pack('>4sIHHH', b'MThd', 6, 0, 1, ticks_per_beat))
+        output_file.write(struct.pack('>4sI', b'MTrk', len(track)))
+        output_file.write(track)
+
+
+# (file name, kind of events)
+corpus_files = (
+    ('opl2.vgm', 'opl2'),
+    ('opl2.vgz', 'opl2'),
+    ('opl3.vgm', 'opl3'),
+    ('opm.vgm', 'opm'),
+    ('loop.vgm', 'loop'),
+    ('burst.vgm', 'burst'),
+    ('opl2.dro', 'opl2'),
+    ('opl3.dro', 'opl3'),
+    ('song.mid', 'midi'),
+)
+
+
+def generate_corpus(output_dir, duration=60, rate=2000, seed=0):
+    # Returns a dictionary of file names to paths
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    events = {}
+    for (name, kind) in corpus_files:
+        path = os.path.join(output_dir, name)
+        if kind == 'midi':
+            write_midi(path, duration, rate, seed)
+        else:
+            if kind not in events:
+                events[kind] = generate_events(kind, duration, rate, seed)
+            if name.endswith('.dro'):
+                write_dro(path, events[kind])
+            else:
+                write_vgm(path, events[kind])
+        paths[name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic files for the benchmarks.')
+    parser.add_argument('--duration', '-d', type=float, default=60,
+                        help='length of each file in seconds (default: 60)')
+    parser.add_argument('--rate', '-r', type=int, default=2000,
+                        help='average register writes per second (default: 2000)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('output_dir', metavar='OUTPUT_DIR', help='directory to write the files to')
+    args = parser.parse_args()
+
+    for (name, path) in generate_corpus(args.output_dir, args.duration, args.rate, args.seed).items():
+        print(f'{name}: {os.path.getsize(path)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+from collections import deque
+import threading
+import time
+
+frame_size = 4
+
+
+class RingBuffer:
+    # Single producer, single consumer. Each side only advances its own
+    # position, so neither needs to take a lock.
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.read_pos = 0
+        self.write_pos = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.size - self.available()
+
+    def write(self, data):
+        length = len(data)
+        start = self.write_pos % self.size
+        first = min(length, self.size - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[0:length - first] = data[first:]
+        self.write_pos += length
+
+    def read(self, length):
+        length = min(length, self.available())
+        start = self.read_pos % self.size
+        first = min(length, self.size - start)
+        data = bytes(self.buffer[start:start + first]) + \
+            bytes(self.buffer[0:length - first])
+        self.read_pos += length
+        return data
+
+
+class AudioEngine:
+    def __init__(self, device, sample_rate, latency=0.1, buffer_size=None, block_size=512):
+        import pyaudio
+        self.pyaudio = pyaudio
+        self.device = device
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.latency_samples = round(latency * sample_rate)
+        if buffer_size is None:
+            buffer_size = self.latency_samples + (block_size * 4)
+        self.ring = RingBuffer(buffer_size * frame_size)
+        self.underruns = 0
+        self._primed = False
+
+        # Register writes are stamped with the sample time at which they
+        # were made, and applied when the producer thread reaches it
+        self._write_queue = deque()
+        self._write_time = 0.0
+        self._render_time = 0
+        self._wake = threading.Event()
+        self._running = True
+        self._producer = threading.Thread(target=self._produce, daemon=True)
+        self._producer.start()
+
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=pyaudio.paInt16, channels=2, rate=sample_rate, output=True,
+                                  frames_per_buffer=block_size, stream_callback=self._callback)
+
+    @property
+    def buffered_samples(self):
+        return self.ring.available() // frame_size
+
+    @property
+    def played_samples(self):
+        return self.ring.read_pos // frame_size
+
+    def write(self, reg, value):
+        self._write_queue.append((round(self._write_time), reg, value))
+
+    def get_stats(self):
+        return {'buffered_samples': self.buffered_samples, 'buffer_samples': self.ring.size // frame_size,
+                'sample_rate': self.sample_rate, 'underruns': self.underruns}
+
+    def reset(self):
+        self._write_queue.append((round(self._write_time), None, None))
+
+    def wait(self, wait_time):
+        self._write_time += wait_time * self.sample_rate
+        self._wake.set()
+        ahead = self._write_time - self.played_samples
+        while ahead > self.latency_samples and self._running:
+            time.sleep((ahead - self.latency_samples) / self.sample_rate)
+            ahead = self._write_time - self.played_samples
+
+    def _apply_writes(self):
+        queue = self._write_queue
+        while len(queue) > 0 and queue[0][0] <= self._render_time:
+            (_, reg, value) = queue.popleft()
+            if reg is None:
+                self.device.reset()
+            else:
+                self.device.write(reg, value)
+
+    def _produce(self):
+        block_time = self.block_size / self.sample_rate
+        while self._running:
+            self._apply_writes()
+            end_time = min(int(self._write_time), self._render_time +
+                           (self.ring.free() // frame_size))
+            if len(self._write_queue) > 0:
+                end_time = min(end_time, self._write_queue[0][0])
+
+            samples = min(end_time - self._render_time, self.block_size)
+            if samples <= 0:
+                if int(self._write_time) <= self._render_time:
+                    # Wait for the caller to advance time
+                    self._wake.wait(block_time)
+                    self._wake.clear()
+                else:
+                    # Wait for the ring buffer to drain
+                    time.sleep(block_time / 2)
+                continue
+
+            buffer = bytearray(samples * frame_size)
+            self.device.get_samples(buffer)
+            self.ring.write(buffer)
+            self._render_time += samples
+
+    def _callback(self, _in_data, frame_count, _time_info, _status):
+        length = frame_count * frame_size
+        if not self._primed:
+            # Output silence until the first block has been rendered, so the
+            # start of playback is not counted as an underrun
+            if self.ring.available() < length:
+                return (bytes(length), self.pyaudio.paContinue)
+            self._primed = True
+        data = self.ring.read(length)
+        if len(data) < length:
+            # Only count a shortfall as an underrun if the caller had already
+            # scheduled audio that the producer has not rendered yet
+            if self._render_time < int(self._write_time):
+                self.underruns += 1
+            data = data + bytes(length - len(data))
+        return (data, self.pyaudio.paContinue)
+
+    def drain(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._render_time >= int(self._write_time) and self.ring.available() == 0:
+                break
+            time.sleep(self.block_size / self.sample_rate)
+
+    def close(self):
+        self.drain(self.latency_samples / self.sample_rate + 0.5)
+        self._running = False
+        self._wake.set()
+        self._producer.join()
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from .events import EndEvent, JumpToMarkerEvent, MarkerEvent, OPLWriteEvent, OPMWriteEvent
+
+# Increment when a change to rendering alters the output for the same input
+cache_format_version = 1
+
+event_type_codes = {
+    OPLWriteEvent: 1,
+    OPMWriteEvent: 2,
+    MarkerEvent: 3,
+    JumpToMarkerEvent: 4,
+    EndEvent: 5
+}
+
+
+def get_emulator_version():
+    try:
+        from importlib import metadata
+        return metadata.version('notesalad')
+    except Exception:  # pylint: disable=broad-except
+        return 'unknown'
+
+
+def hash_events(events, hasher):
+    pack = struct.Struct('<Bqii').pack
+    for event in events:
+        code = event_type_codes.get(type(event), 0)
+        if code == 1:
+            hasher.update(pack(code, event.time, event.reg | (event.chip << 9), event.value))
+        elif code == 2:
+            hasher.update(pack(code, event.time, event.reg, event.value))
+        elif code in (3, 4):
+            hasher.update(pack(code, event.time, event.index, 0))
+        else:
+            hasher.update(pack(code, event.time, 0, 0))
+
+
+class RenderCache:
+    def __init__(self, cache_dir, max_size=None, max_age=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, events, settings):
+        hasher = hashlib.sha256()
+        hasher.update(repr((cache_format_version, get_emulator_version(),
+                            settings)).encode('utf-8'))
+        hash_events(events, hasher)
+        return hasher.hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pcm')
+
+    def fetch(self, key, output_path):
+        entry_path = self._get_entry_path(key)
+        try:
+            # Opening the entry keeps it readable even if another process
+            # evicts or replaces it before the copy finishes
+            with open(entry_path, 'rb') as entry:
+                os.utime(entry_path)
+                with open(output_path, 'wb') as output:
+                    shutil.copyfileobj(entry, output)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, source_path):
+        (fd, temp_path) = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp, open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, temp)
+            os.replace(temp_path, self._get_entry_path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            age = now - stat.st_mtime
+            if entry.name.endswith('.tmp'):
+                # Left behind by a process that died while storing an entry
+                if age > 3600:
+                    self._remove(entry.path)
+            elif entry.name.endswith('.pcm'):
+                if self.max_age is not None and age > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        if self.max_size is None:
+            return
+        total_size = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
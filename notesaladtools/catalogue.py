@@ -0,0 +1,225 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+index_extensions = ('.dro', '.vgm', '.vgz', '.rad', '.mid', '.opl3raw')
+
+# Increment when the table or the way files are analysed changes, so that
+# existing catalogues are rebuilt
+catalogue_version = 1
+
+catalogue_columns = (
+    ('path', 'TEXT PRIMARY KEY'), ('size', 'INTEGER'), ('mtime', 'REAL'), ('hash', 'TEXT'), ('format', 'TEXT'),
+    ('duration', 'REAL'), ('loop_duration', 'REAL'), ('has_loop', 'INTEGER'), ('chips', 'TEXT'),
+    ('chips_used', 'TEXT'), ('opl_chips', 'INTEGER'), ('writes', 'INTEGER'), ('opl_writes', 'INTEGER'),
+    ('opm_writes', 'INTEGER'), ('key_ons', 'INTEGER'), ('write_rate', 'REAL'), ('peak_rate', 'REAL'),
+    ('title', 'TEXT'), ('game', 'TEXT'), ('artist', 'TEXT'), ('error', 'TEXT'), ('indexed_at', 'REAL')
+)
+column_names = tuple(name for (name, _) in catalogue_columns)
+
+
+def hash_file(path, block_size=1 << 20):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        while True:
+            block = input_file.read(block_size)
+            if len(block) == 0:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def find_files(roots):
+    for root in roots:
+        if os.path.isfile(root):
+            yield os.path.abspath(root)
+            continue
+        for (dir_path, dir_names, file_names) in os.walk(root):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in index_extensions:
+                    yield os.path.abspath(os.path.join(dir_path, file_name))
+
+
+def analyse_file(path):
+    # The parsers and nsdump are imported here, in the worker processes, so
+    # that querying the catalogue doesn't wait for them to load
+    from .events import JumpToMarkerEvent
+    from .metadata import read_metadata
+    from .nsdump import WriteProfile
+    from .parser import open_parser
+
+    record = {}
+    metadata = read_metadata(path)
+    if metadata is not None:
+        record['format'] = metadata.format
+        record['loop_duration'] = metadata.loop_duration
+        record['chips'] = ','.join(metadata.chips)
+        if metadata.gd3_tag is not None:
+            record['title'] = metadata.gd3_tag.track_name_en or metadata.gd3_tag.track_name_jp
+            record['game'] = metadata.gd3_tag.game_name_en or metadata.gd3_tag.game_name_jp
+            record['artist'] = metadata.gd3_tag.track_author_en or metadata.gd3_tag.track_author_jp
+    else:
+        record['format'] = os.path.splitext(path)[1].lower()[1:]
+
+    input_parser = open_parser(path)
+    if input_parser is None:
+        raise ValueError('Unsupported file type')
+    with input_parser:
+        profile = WriteProfile(input_parser.time_base)
+        has_loop = False
+        for event in input_parser.read_events():
+            if type(event) == JumpToMarkerEvent:
+                has_loop = True
+            profile.update(event)
+        profile.finish()
+        # Some parsers only know the duration once they have been read
+        duration = max(profile.end_time, input_parser.duration or 0) / input_parser.time_base
+        record['opl_chips'] = input_parser.opl_chips
+
+    record['duration'] = duration
+    record['has_loop'] = 1 if has_loop else 0
+    record['chips_used'] = ','.join(profile.chips_used)
+    record['writes'] = profile.writes
+    record['opl_writes'] = profile.opl_writes
+    record['opm_writes'] = profile.opm_writes
+    record['key_ons'] = profile.key_ons
+    record['write_rate'] = profile.writes / duration if duration > 0 else 0
+    record['peak_rate'] = profile.peak_window[0] / profile.window
+    return record
+
+
+def index_file(path, known_hash=None):
+    # Runs in a worker process. A file whose contents still match known_hash
+    # is not analysed again; only its size and modification time are returned.
+    record = {'path': path}
+    try:
+        stat = os.stat(path)
+        record['size'] = stat.st_size
+        record['mtime'] = stat.st_mtime
+        record['hash'] = hash_file(path)
+        if record['hash'] == known_hash:
+            return (False, record)
+        record.update(analyse_file(path))
+    except Exception as e:  # pylint: disable=broad-except
+        record['error'] = str(e) or type(e).__name__
+    record['indexed_at'] = time.time()
+    return (True, record)
+
+
+def _index_file(job):
+    return index_file(*job)
+
+
+class Catalogue:
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        (version,) = self.connection.execute('PRAGMA user_version').fetchone()
+        if version != catalogue_version:
+            self.connection.execute('DROP TABLE IF EXISTS files')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            + ', '.join(f'{name} {column_type}' for (name, column_type) in catalogue_columns) + ')')
+        self.connection.execute(f'PRAGMA user_version = {catalogue_version}')
+        self.connection.commit()
+
+    def get_states(self):
+        return {path: (size, mtime, file_hash, error) for (path, size, mtime, file_hash, error)
+                in self.connection.execute('SELECT path, size, mtime, hash, error FROM files')}
+
+    def store(self, record):
+        values = [record.get(name) for name in column_names]
+        self.connection.execute(
+            f'INSERT OR REPLACE INTO files ({", ".join(column_names)}) '
+            + f'VALUES ({", ".join("?" * len(column_names))})', values)
+
+    def update_stat(self, record):
+        self.connection.execute('UPDATE files SET size = ?, mtime = ? WHERE path = ?',
+                                (record['size'], record['mtime'], record['path']))
+
+    def remove(self, path):
+        self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def query(self, where=(), params=(), order_by='path', limit=None):
+        sql = 'SELECT * FROM files'
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order_by}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        cursor = self.connection.execute(sql, params)
+        names = [column[0] for column in cursor.description]
+        for row in cursor:
+            yield dict(zip(names, row))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def update_catalogue(catalogue, roots, workers=None, prune=True, commit_interval=500):
+    # Yields (status, path, error) for each file, where status is one of
+    # added, updated, unchanged, removed or failed. Files with the same size
+    # and modification time as when they were indexed are not read at all;
+    # the rest are hashed, and analysed only if their contents changed. Files
+    # that failed to be analysed are always analysed again, as the failure
+    # may have been fixed since.
+    states = catalogue.get_states()
+    seen = set()
+    jobs = []
+    for path in find_files(roots):
+        seen.add(path)
+        state = states.get(path)
+        if state is not None and state[3] is not None:
+            jobs.append((path, None))
+            continue
+        if state is not None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is not None and (stat.st_size, stat.st_mtime) == state[:2]:
+                yield ('unchanged', path, None)
+                continue
+        jobs.append((path, None if state is None else state[2]))
+
+    from concurrent.futures import ProcessPoolExecutor
+    pending = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (analysed, record) in executor.map(_index_file, jobs, chunksize=8):
+            path = record['path']
+            if not analysed:
+                catalogue.update_stat(record)
+                status = 'unchanged'
+            else:
+                catalogue.store(record)
+                if record.get('error') is not None:
+                    status = 'failed'
+                else:
+                    status = 'updated' if path in states else 'added'
+            pending += 1
+            if pending >= commit_interval:
+                catalogue.commit()
+                pending = 0
+            yield (status, path, record.get('error'))
+
+    if prune:
+        # Only files below the given roots are considered missing
+        root_paths = {os.path.abspath(root) for root in roots}
+        prefixes = tuple(os.path.join(root, '') for root in root_paths)
+        for path in states:
+            if path not in seen and (path in root_paths or path.startswith(prefixes)):
+                if not os.path.exists(path):
+                    catalogue.remove(path)
+                    yield ('removed', path, None)
+    catalogue.commit()
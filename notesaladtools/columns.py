@@ -0,0 +1,73 @@
+from array import array
+import os
+import struct
+import sys
+
+byte_order = '<' if sys.byteorder == 'little' else '>'
+
+
+class NpyColumn:
+    # A one-dimensional array in NumPy's .npy format, appended to in chunks so
+    # it can be written without holding it in memory. The header has a fixed
+    # size, so the final length can be filled in when the column is closed.
+    header_size = 128
+
+    def __init__(self, path, typecode, chunk_size=65536):
+        self.output_file = open(path, 'wb')
+        self.typecode = typecode
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.buffer = array(typecode)
+        item_size = self.buffer.itemsize
+        if typecode in ('f', 'd'):
+            self.descr = f'{byte_order}f{item_size}'
+        elif item_size == 1:
+            self.descr = '|u1' if typecode == 'B' else '|i1'
+        else:
+            self.descr = f'{byte_order}{"u" if typecode.isupper() else "i"}{item_size}'
+        self._write_header()
+
+    def _write_header(self):
+        header = f"{{'descr': '{self.descr}', 'fortran_order': False, 'shape': ({self.count},), }}"
+        header = header.ljust(self.header_size - 11) + '\n'
+        self.output_file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.buffer.tofile(self.output_file)
+        self.count += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.output_file.seek(0)
+        self._write_header()
+        self.output_file.close()
+
+
+class ColumnWriter:
+    # Writes each column of a table to its own .npy file in a directory.
+    # Missing values are stored as -1.
+    def __init__(self, output_dir, columns):
+        os.makedirs(output_dir, exist_ok=True)
+        self.columns = {name: NpyColumn(os.path.join(output_dir, name + '.npy'), typecode)
+                        for (name, typecode) in columns}
+
+    def write(self, record):
+        for (name, column) in self.columns.items():
+            value = record.get(name)
+            column.append(-1 if value is None else value)
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,24 +1,40 @@
-from .opl import OPLController, OPLUSBSerial, OPLWAV, OPLEmulator, RetroWaveOPL3
-from .opm import OPMController, OPMUSBSerial, OPMWAV, OPMEmulator
+from importlib import import_module
 
+# Device types: the module implementing each one, its chip and controller
+# classes, and how the chip is opened. Modules are imported only when a device
+# of that type is opened, so that tools which never open a device don't pay
+# for importing them.
+device_types = {
+    'oplem': ('opl', 'OPLEmulator', 'OPLController', 'emulator'),
+    'opmem': ('opm', 'OPMEmulator', 'OPMController', 'emulator'),
+    'oplser': ('opl', 'OPLUSBSerial', 'OPLController', 'serial'),
+    'rwave': ('opl', 'RetroWaveOPL3', 'OPLController', 'serial'),
+    'opmser': ('opm', 'OPMUSBSerial', 'OPMController', 'serial'),
+    'oplwav': ('opl', 'OPLWAV', 'OPLController', 'wav'),
+    'oplraw': ('opl', 'OPLWAV', 'OPLController', 'raw'),
+    'opmwav': ('opm', 'OPMWAV', 'OPMController', 'wav'),
+    'opmraw': ('opm', 'OPMWAV', 'OPMController', 'raw'),
+}
 
-def get_device(name):
-    if name == 'oplem':
-        return OPLController(OPLEmulator())
-    if name == 'opmem':
-        return OPMController(OPMEmulator())
 
-    parts = name.split(':', maxsplit=1)
-    if len(parts) > 1:
-        (devtype, path) = parts
-        if devtype == 'oplser':
-            return OPLController(OPLUSBSerial(path))
-        if devtype == 'rwave':
-            return OPLController(RetroWaveOPL3(path))
-        if devtype == 'oplwav':
-            return OPLController(OPLWAV(path))
-        if devtype == 'opmser':
-            return OPMController(OPMUSBSerial(path))
-        if devtype == 'opmwav':
-            return OPMController(OPMWAV(path))
-    raise ValueError('Invalid device name')
+def get_device(name, output_rate=None, sample_format='s16', latency=0.1, buffer_size=None, opl_instances=1):
+    (devtype, _, path) = name.partition(':')
+    device_type = device_types.get(devtype)
+    # Emulators take no path, and the other devices require one
+    if device_type is None or (path == '') != (device_type[3] == 'emulator'):
+        raise ValueError('Invalid device name')
+    (module_name, chip_name, controller_name, kind) = device_type
+    module = import_module(f'.{module_name}', __package__)
+
+    args = ()
+    kwargs = {}
+    if kind == 'emulator':
+        kwargs = {'latency': latency, 'buffer_size': buffer_size}
+    elif kind == 'serial':
+        args = (path,)
+    else:
+        args = (path,)
+        kwargs = {'output_rate': output_rate, 'sample_format': sample_format, 'raw': kind == 'raw'}
+    if module_name == 'opl' and kind != 'serial':
+        kwargs['instances'] = opl_instances
+    return getattr(module, controller_name)(getattr(module, chip_name)(*args, **kwargs))
@@ -4,10 +4,11 @@ class VGMEvent:
 
 
 class OPLWriteEvent(VGMEvent):
-    def __init__(self, time, reg, value):
+    def __init__(self, time, reg, value, chip=0):
         super().__init__(time)
         self.reg = reg & 0x1ff
         self.value = value
+        self.chip = chip
 
 
 class OPMWriteEvent(VGMEvent):
@@ -0,0 +1,46 @@
+import os.path
+
+from .parser import DROParser, VGMParser, open_parser
+from .vgmformat import get_vgm_chips
+
+dro_hardware_chips = {0: ('YM3812',), 1: ('YM3812', 'YM3812'), 2: ('YMF262',)}
+
+
+class FileMetadata:
+    # Header fields of a file, read without parsing its commands. Durations
+    # are in seconds.
+    def __init__(self, path):
+        self.path = path
+        self.format = None
+        self.version = None
+        self.duration = 0
+        self.loop_duration = 0
+        self.chips = ()
+        self.gd3_tag = None
+
+
+def read_metadata(path, read_gd3=True):
+    # Only VGM, VGZ and DRO files carry their metadata in a header; returns
+    # None for other formats. The GD3 tag follows the command data, so for
+    # VGZ files the stream is inflated up to it, but not parsed.
+    (_, ext) = os.path.splitext(path)
+    if ext.lower() not in ('.vgm', '.vgz', '.dro'):
+        return None
+
+    metadata = FileMetadata(path)
+    with open_parser(path) as input_parser:
+        if isinstance(input_parser, VGMParser):
+            header = input_parser.header
+            metadata.format = 'vgm'
+            metadata.version = f'{header.version >> 8:x}.{header.version & 0xff:02x}'
+            metadata.duration = header.total_samples / input_parser.time_base
+            metadata.loop_duration = header.loop_samples / input_parser.time_base
+            metadata.chips = tuple(get_vgm_chips(header))
+            if read_gd3:
+                metadata.gd3_tag = input_parser.read_gd3_tag()
+        elif isinstance(input_parser, DROParser):
+            metadata.format = 'dro'
+            metadata.version = '2.0'
+            metadata.duration = input_parser.duration / input_parser.time_base
+            metadata.chips = dro_hardware_chips.get(input_parser.hardware_type, ())
+    return metadata
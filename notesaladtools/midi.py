@@ -1,8 +1,40 @@
+from math import floor
+
 from mido.ports import BaseOutput
 from .opl import OPLWriteEvent, OPLController, OPLEmulator
 from .opm import OPMWriteEvent, OPMController, OPMEmulator
 
 
+class VoiceSpreader:
+    # Spreads notes across several chips, sending each note to the chip with
+    # the fewest notes held. Other channel messages go to every chip, so they
+    # all keep the same channel state.
+    def __init__(self, chips):
+        self.chips = chips
+        self.loads = [0] * chips
+        self.notes = {}
+
+    def route(self, msg):
+        if msg.type == 'note_on' and msg.velocity > 0:
+            key = (msg.channel, msg.note)
+            chip = self.notes.get(key)
+            if chip is None:
+                chip = min(range(self.chips), key=self.loads.__getitem__)
+                self.notes[key] = chip
+                self.loads[chip] += 1
+            return (chip,)
+        if msg.type in ('note_on', 'note_off'):
+            chip = self.notes.pop((msg.channel, msg.note), None)
+            if chip is not None:
+                self.loads[chip] -= 1
+                return (chip,)
+        elif msg.type == 'control_change' and msg.control in (120, 123):
+            # All sound off and all notes off
+            for key in [key for key in self.notes if key[0] == msg.channel]:
+                self.loads[self.notes.pop(key)] -= 1
+        return range(self.chips)
+
+
 class VGMMIDIOutput(BaseOutput):
     def _open(self, driver):
         self.driver = driver
@@ -13,6 +45,19 @@ class VGMMIDIOutput(BaseOutput):
     def update(self):
         self.driver.update()
 
+    def process_block(self, messages, block_start, block_time):
+        # Apply each message at its offset within the block, then run the
+        # driver's timers once for the whole block
+        offset = 0
+        for (timestamp, msg) in messages:
+            msg_offset = min(max(timestamp - block_start, 0), block_time)
+            self.device.wait(msg_offset - offset)
+            offset = msg_offset
+            self.send(msg)
+        self.device.wait(block_time - offset)
+        self.set_time(floor((block_start + block_time) * 1000))
+        self.update()
+
     def _send(self, msg):
         self.driver.send(msg.bin())
 
@@ -53,6 +98,41 @@ class OPL3MIDIOutput(VGMMIDIOutput):
         self.device.reset()
 
 
+class MultiOPL3MIDIOutput(VGMMIDIOutput):
+    # One OPL3 MIDI driver per chip, with notes spread across them by load
+    def _open(self, device, chips=2):
+        self.device = device
+        from notesalad.opl import OPL3MIDI, OPLCallbackDevice
+        self.spreader = VoiceSpreader(chips)
+        self.drivers = []
+        for chip in range(chips):
+            driver = OPL3MIDI(OPLCallbackDevice(
+                lambda reg, value, chip=chip: self._opl_write(chip, reg, value), None))
+            driver.reset()
+            self.drivers.append(driver)
+            self.device.write_event(OPLWriteEvent(0, 0x105, 1, chip))
+
+    def set_time(self, time_ms):
+        for driver in self.drivers:
+            driver.set_time(time_ms)
+
+    def update(self):
+        for driver in self.drivers:
+            driver.update()
+
+    def _opl_write(self, chip, reg, value):
+        self.device.write_event(OPLWriteEvent(0, reg, value, chip))
+
+    def _send(self, msg):
+        data = msg.bin()
+        for chip in self.spreader.route(msg):
+            self.drivers[chip].send(data)
+
+    def _close(self):
+        for driver in self.drivers:
+            driver.close()
+
+
 class OPMMIDIOutput(VGMMIDIOutput):
     def _open(self, device):
         self.device = device
@@ -89,6 +169,16 @@ class OPL3EmulatorOutput(OPL3MIDIOutput):
         self.device.close()
 
 
+class MultiOPL3EmulatorOutput(MultiOPL3MIDIOutput):
+    def _open(self, chips=2, **kwargs):
+        device = OPLController(OPLEmulator(instances=chips))
+        super()._open(**kwargs, device=device, chips=chips)
+
+    def _close(self):
+        super()._close()
+        self.device.close()
+
+
 class OPMEmulatorOutput(OPMMIDIOutput):
     def _open(self, **kwargs):
         device = OPMController(OPMEmulator())
@@ -3,6 +3,7 @@ import argparse
 from notesaladtools.utils import parse_time
 from notesaladtools.vgmformat import GD3Tag
 from .parser import open_parser
+from .profiling import PipelineProfile
 from .writer import open_writer
 from .processor import add_end_pause, add_key_off, convert_event_times, detect_loop, optimise, set_endpoint
 from .processor import trim_start_silence, trim_start_to_marker, trim_start_to_time
@@ -33,6 +34,8 @@ def main():
                         help='treat duplicate markers as loop')
     parser.add_argument('--end-on-loop', action='store_true',
                         help='cut the file at the loop end point without looping')
+    parser.add_argument('--midi-chips', nargs=1, type=int, default=(1,), metavar='N',
+                        help='spread MIDI input across N OPL3 chips (VGM supports up to 2)')
     parser.add_argument('--title', nargs=1, type=str,
                         metavar='TITLE', help='set track title in metadata')
     parser.add_argument('--game', nargs=1, type=str,
@@ -47,58 +50,67 @@ def main():
                         metavar='AUTHOR', help='set VGM file author in metadata')
     parser.add_argument('--notes', nargs=1, type=str,
                         metavar='NOTES', help='set notes in metadata')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the events, time and peak memory of each conversion stage')
+    parser.add_argument('--profile-json', nargs=1, metavar='PATH',
+                        help='write the --profile results to PATH as JSON')
 
     args = parser.parse_args()
 
-    gd3_tag = GD3Tag()
-    if args.title is not None:
-        gd3_tag.track_name_en = args.title[0]
-    if args.game is not None:
-        gd3_tag.game_name_en = args.game[0]
-    if args.system is not None:
-        gd3_tag.system_name_en = args.system[0]
-    if args.artist is not None:
-        gd3_tag.track_author_en = args.artist[0]
-    if args.release_date is not None:
-        gd3_tag.release_date = args.release_date[0]
-    if args.vgm_author is not None:
-        gd3_tag.vgm_author = args.vgm_author[0]
-    if args.notes is not None:
-        gd3_tag.notes = args.notes[0]
+    # Stages are only wrapped when profiling, so this costs nothing otherwise
+    profile = PipelineProfile(args.profile or args.profile_json is not None)
+    with open_parser(args.input[0], args.midi_chips[0]) as vgmparser:
+        # Metadata from the input is kept, except where replaced by options
+        gd3_tag = vgmparser.read_gd3_tag() or GD3Tag()
+        if args.title is not None:
+            gd3_tag.track_name_en = args.title[0]
+        if args.game is not None:
+            gd3_tag.game_name_en = args.game[0]
+        if args.system is not None:
+            gd3_tag.system_name_en = args.system[0]
+        if args.artist is not None:
+            gd3_tag.track_author_en = args.artist[0]
+        if args.release_date is not None:
+            gd3_tag.release_date = args.release_date[0]
+        if args.vgm_author is not None:
+            gd3_tag.vgm_author = args.vgm_author[0]
+        if args.notes is not None:
+            gd3_tag.notes = args.notes[0]
 
-    with open_parser(args.input[0]) as vgmparser:
-        with open_writer(args.output[0]) as vgmwriter:
+        with profile.closing('close', open_writer(args.output[0])) as vgmwriter:
             if not gd3_tag.is_empty():
                 vgmwriter.gd3_tag = gd3_tag
 
-            events = vgmparser.read_events()
+            events = profile.stage('parse', vgmparser.read_events())
 
             # Set up filters
             if args.trim_start_to_marker:
-                events = trim_start_to_marker(
-                    events, args.trim_start_to_marker[0])
+                events = profile.stage('trim_start_to_marker', trim_start_to_marker(
+                    events, args.trim_start_to_marker[0]))
             if args.start is not None:
                 start_time = int(args.start[0] * vgmparser.time_base)
-                events = trim_start_to_time(events, start_time)            
+                events = profile.stage('trim_start_to_time', trim_start_to_time(events, start_time))
             if args.trim_start_silence:
-                events = trim_start_silence(events)
+                events = profile.stage('trim_start_silence', trim_start_silence(events))
             if args.duration is not None:
                 duration = int(args.duration[0] * vgmparser.time_base)
-                events = set_endpoint(events, duration)
+                events = profile.stage('set_endpoint', set_endpoint(events, duration))
             if args.optimise:
-                events = optimise(events)
+                events = profile.stage('optimise', optimise(events))
             if args.key_off:
-                events = add_key_off(events)
+                events = profile.stage('add_key_off', add_key_off(events))
             if args.pause is not None:
                 pause_length = int(args.pause[0] * vgmparser.time_base)
-                events = add_end_pause(events, pause_length)
+                events = profile.stage('add_end_pause', add_end_pause(events, pause_length))
             if args.end_on_loop:
-                events = detect_loop(events, True)
+                events = profile.stage('detect_loop', detect_loop(events, True))
             elif args.detect_loop:
-                events = detect_loop(events)
+                events = profile.stage('detect_loop', detect_loop(events))
 
-            events = convert_event_times(
-                events, vgmparser.time_base, vgmwriter.time_base)
+            events = profile.stage('convert_event_times', convert_event_times(
+                events, vgmparser.time_base, vgmwriter.time_base))
 
-            for event in events:
+            for event in profile.sink('write_event', events):
                 vgmwriter.write_event(event)
+
+    profile.report(args.profile_json[0] if args.profile_json is not None else None, args.profile)
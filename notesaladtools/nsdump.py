@@ -1,185 +1,230 @@
 import argparse
+from contextlib import nullcontext
+import csv
+from functools import lru_cache
+import json
+import sys
 from . import opl
+from .columns import ColumnWriter
 from .events import EndEvent, JumpToMarkerEvent, MarkerEvent, OPLWriteEvent, OPMWriteEvent
 from .parser import open_parser
+from .profiling import PipelineProfile
+from .transport import LinkModel, LinkScheduler
+from .utils import parse_time
 
 
-def format_reg_opl(reg, val):
-    reg = reg & 0x1ff
+# Each register's layout is a format template, the fields packed into its
+# value as (name, shift, mask, labels) and any constant fields. Layouts are
+# built once for every register, and formatted lines are memoised.
+empty_layout = ('', (), {})
+
+
+def get_opl_layout(reg):
     reg8 = reg & 0xff
     if reg == 0x08:
-        notesel = (val >> 6) & 1
-        return f'NOTE SEL: {notesel:b}'
+        return ('NOTE SEL: {notesel:b}', (('notesel', 6, 1, None),), {})
     if 0x20 <= reg8 <= 0x35:
-        slot = opl.get_slot(reg - 0x20) + 1
-        am = (val >> 7) & 1
-        vib = (val >> 6) & 1
-        egt = (val >> 5) & 1
-        ksr = (val >> 4) & 1
-        mult = val & 0x0f
-        return f'Slot: {slot:2d} AM: {am:b} VIB: {vib:b} EGT: {egt:b} KSR: {ksr:b} MULT: {mult:x}'
+        return ('Slot: {slot:2d} AM: {am:b} VIB: {vib:b} EGT: {egt:b} KSR: {ksr:b} MULT: {mult:x}',
+                (('am', 7, 1, None), ('vib', 6, 1, None), ('egt', 5, 1, None), ('ksr', 4, 1, None),
+                 ('mult', 0, 0x0f, None)),
+                {'slot': opl.get_slot(reg - 0x20) + 1})
     if 0x40 <= reg8 <= 0x55:
-        slot = opl.get_slot(reg - 0x40) + 1
-        ksl = (val >> 6) & 0x03
-        tl = val & 0x3f
-        return f'Slot: {slot:2d} KSL: {ksl:x} TL: {tl:x}'
+        return ('Slot: {slot:2d} KSL: {ksl:x} TL: {tl:x}',
+                (('ksl', 6, 0x03, None), ('tl', 0, 0x3f, None)),
+                {'slot': opl.get_slot(reg - 0x40) + 1})
     if 0x60 <= reg8 <= 0x75:
-        slot = opl.get_slot(reg - 0x60) + 1
-        ar = (val >> 4) & 0x0f
-        dr = val & 0x0f
-        return f'Slot: {slot:2d} AR: {ar:x} DR: {dr:x}'
+        return ('Slot: {slot:2d} AR: {ar:x} DR: {dr:x}',
+                (('ar', 4, 0x0f, None), ('dr', 0, 0x0f, None)),
+                {'slot': opl.get_slot(reg - 0x60) + 1})
     if 0x80 <= reg8 <= 0x95:
-        slot = opl.get_slot(reg - 0x80) + 1
-        sl = (val >> 4) & 0x0f
-        rr = val & 0x0f
-        return f'Slot: {slot:2d} SL: {sl:x} RR: {rr:x}'
+        return ('Slot: {slot:2d} SL: {sl:x} RR: {rr:x}',
+                (('sl', 4, 0x0f, None), ('rr', 0, 0x0f, None)),
+                {'slot': opl.get_slot(reg - 0x80) + 1})
     if 0xa0 <= reg8 <= 0xa8:
-        channel = opl.get_channel(reg - 0xa0) + 1
-        return f'Channel: {channel:2d} F number (L): {val:x}'
+        return ('Channel: {channel:2d} F number (L): {fnum_l:x}',
+                (('fnum_l', 0, 0xff, None),),
+                {'channel': opl.get_channel(reg - 0xa0) + 1})
     if 0xb0 <= reg8 <= 0xb8:
-        channel = opl.get_channel(reg - 0xb0) + 1
-        kon = (val >> 5) & 0x01
-        block = (val >> 2) & 0x07
-        fnum = val & 0x03
-        kon_str = 'ON, ' if kon == 1 else 'OFF,'
-        return f'KEY {kon_str} Channel: {channel:2d} BLOCK: {block:x} F number (H): {fnum:x}'
+        return ('KEY {key_on} Channel: {channel:2d} BLOCK: {block:x} F number (H): {fnum_h:x}',
+                (('key_on', 5, 0x01, ('OFF,', 'ON, ')), ('block', 2, 0x07, None), ('fnum_h', 0, 0x03, None)),
+                {'channel': opl.get_channel(reg - 0xb0) + 1})
     if reg == 0xbd:
-        dam = (val >> 7) & 1
-        dvb = (val >> 6) & 1
-        ryt = (val >> 5) & 1
-        bd = (val >> 4) & 1
-        sd = (val >> 3) & 1
-        tom = (val >> 2) & 1
-        tc = (val >> 1) & 1
-        hh = val & 1
-        return f'DAM: {dam:b} DVB: {dvb:b} RYT: {ryt:b} BD: {bd:b} SD: {sd:b} TOM: {tom:b} TC: {tc:b} HH: {hh:b}'
+        return ('DAM: {dam:b} DVB: {dvb:b} RYT: {ryt:b} BD: {bd:b} SD: {sd:b} TOM: {tom:b} TC: {tc:b} HH: {hh:b}',
+                (('dam', 7, 1, None), ('dvb', 6, 1, None), ('ryt', 5, 1, None), ('bd', 4, 1, None),
+                 ('sd', 3, 1, None), ('tom', 2, 1, None), ('tc', 1, 1, None), ('hh', 0, 1, None)),
+                {})
     if 0xc0 <= reg8 <= 0xc8:
-        channel = opl.get_channel(reg - 0xc0) + 1
-        chd = (val >> 7) & 1
-        chc = (val >> 6) & 1
-        chb = (val >> 5) & 1
-        cha = (val >> 4) & 1
-        fb = (val >> 1) & 0x07
-        cnt = val & 1
-        return f'Channel: {channel:2d} CHD: {chd:b} CHC: {chc:b} CHB: {chb:b} CHA: {cha:b} FB: {fb:x} CNT: {cnt:b}'
+        return ('Channel: {channel:2d} CHD: {chd:b} CHC: {chc:b} CHB: {chb:b} CHA: {cha:b} FB: {fb:x} CNT: {cnt:b}',
+                (('chd', 7, 1, None), ('chc', 6, 1, None), ('chb', 5, 1, None), ('cha', 4, 1, None),
+                 ('fb', 1, 0x07, None), ('cnt', 0, 1, None)),
+                {'channel': opl.get_channel(reg - 0xc0) + 1})
     if 0xe0 <= reg8 <= 0xf5:
-        slot = opl.get_slot(reg - 0xe0) + 1
-        ws = val & 0x07
-        return f'Slot: {slot:2d} WS: {ws:x}'
+        return ('Slot: {slot:2d} WS: {ws:x}', (('ws', 0, 0x07, None),),
+                {'slot': opl.get_slot(reg - 0xe0) + 1})
     if reg == 0x104:
-        conn = val & 0x3f
-        return f'CONNECTION SEL: {conn:06b}'
+        return ('CONNECTION SEL: {conn:06b}', (('conn', 0, 0x3f, None),), {})
     if reg == 0x105:
-        new = val & 1
-        return f'NEW: {new:b}'
-    else:
-        return ''
+        return ('NEW: {new:b}', (('new', 0, 1, None),), {})
+    return empty_layout
 
 
-def format_reg_opm(reg, val):
-    reg = reg & 0xff
-    val = val & 0xff
+def get_opm_layout(reg):
     if reg == 0x08:
-        sn = (val & 0x78) >> 3
-        ch = (val & 0x07)
-        return f'Channel: {ch:d} Slot: {sn:04b}'
+        return ('Channel: {channel:d} Slot: {sn:04b}', (('sn', 3, 0x0f, None), ('channel', 0, 0x07, None)), {})
     if reg == 0x0f:
-        ne = (val & 0x80) >> 7
-        nfrq = (val & 0x1f)
-        return f'Noise Enable: {ne:b} Frequency: {nfrq:2x}'
+        return ('Noise Enable: {ne:b} Frequency: {nfrq:2x}', (('ne', 7, 1, None), ('nfrq', 0, 0x1f, None)), {})
     if reg == 0x10:
-        return f'CLKA1: {val:02x}'
+        return ('CLKA1: {clka1:02x}', (('clka1', 0, 0xff, None),), {})
     if reg == 0x11:
-        clka2 = val & 0x3
-        return f'CLKA2: {clka2:x}'
+        return ('CLKA2: {clka2:x}', (('clka2', 0, 0x03, None),), {})
     if reg == 0x12:
-        return f'CLKB: {val:02x}'
+        return ('CLKB: {clkb:02x}', (('clkb', 0, 0xff, None),), {})
     if reg == 0x14:
-        csm = (val & 0x80) >> 7
-        rst_a = (val & 0x10) >> 4
-        rst_b = (val & 0x20) >> 5
-        irq_a = (val & 0x04) >> 2
-        irq_b = (val & 0x08) >> 3
-        load_a = (val & 0x01)
-        load_b = (val & 0x02) >> 1
-        return f'CSM: {csm:b} RSTA: {rst_a:b} RSTB: {rst_b:b} IRQA: {irq_a:b} IRQB: {irq_b:b} LOADA: {load_a:b} ' \
-            + f'LOADB: {load_b:b}'
+        return ('CSM: {csm:b} RSTA: {rst_a:b} RSTB: {rst_b:b} IRQA: {irq_a:b} IRQB: {irq_b:b} LOADA: {load_a:b} '
+                + 'LOADB: {load_b:b}',
+                (('csm', 7, 1, None), ('rst_a', 4, 1, None), ('rst_b', 5, 1, None), ('irq_a', 2, 1, None),
+                 ('irq_b', 3, 1, None), ('load_a', 0, 1, None), ('load_b', 1, 1, None)),
+                {})
     if reg == 0x18:
-        return f'Low Frequency: {val:2x}'
+        return ('Low Frequency: {lfrq:2x}', (('lfrq', 0, 0xff, None),), {})
     if reg == 0x19:
-        return f'PMD/AMD: {val:2x}'
+        return ('PMD/AMD: {pmd_amd:2x}', (('pmd_amd', 0, 0xff, None),), {})
     if reg == 0x1b:
-        ct1 = (val & 0x40) >> 6
-        ct2 = (val & 0x80) >> 7
-        w = (val & 0x03)
-        return f'CT1: {ct1:b} CT2: {ct2:b} Waveform: {w:x}'
+        return ('CT1: {ct1:b} CT2: {ct2:b} Waveform: {w:x}',
+                (('ct1', 6, 1, None), ('ct2', 7, 1, None), ('w', 0, 0x03, None)), {})
     if 0x20 <= reg <= 0x27:
-        ch = reg - 0x20
-        r = (val & 0x80) >> 7
-        l = (val & 0x40) >> 6
-        fb = (val & 0x38) >> 3
-        conect = (val & 0x07)
-        return f'Channel: {ch:d} Left: {l:b} Right: {r:b} Feedback: {fb:x} Connection: {conect:x}'
+        return ('Channel: {channel:d} Left: {l:b} Right: {r:b} Feedback: {fb:x} Connection: {conect:x}',
+                (('r', 7, 1, None), ('l', 6, 1, None), ('fb', 3, 0x07, None), ('conect', 0, 0x07, None)),
+                {'channel': reg - 0x20})
     if 0x28 <= reg <= 0x2f:
-        ch = reg - 0x28
-        octave = (val & 0x70) >> 4
-        note = (val & 0x0f)
-        return f'Channel: {ch:d} Octave: {octave:x} Note: {note:x}'
+        return ('Channel: {channel:d} Octave: {octave:x} Note: {note:x}',
+                (('octave', 4, 0x07, None), ('note', 0, 0x0f, None)), {'channel': reg - 0x28})
     if 0x30 <= reg <= 0x37:
-        ch = reg - 0x30
-        kf = (val & 0xfc) >> 2
-        return f'Channel: {ch:d} Key Fraction: {kf:2x}'
+        return ('Channel: {channel:d} Key Fraction: {kf:2x}', (('kf', 2, 0x3f, None),), {'channel': reg - 0x30})
     if 0x38 <= reg <= 0x3f:
-        ch = reg - 0x38
-        pms = (val & 0x70) >> 4
-        ams = (val & 0x03)
-        return f'Channel: {ch:d} PMS: {pms:x} AMS: {ams:x}'
+        return ('Channel: {channel:d} PMS: {pms:x} AMS: {ams:x}',
+                (('pms', 4, 0x07, None), ('ams', 0, 0x03, None)), {'channel': reg - 0x38})
     if 0x40 <= reg <= 0x5f:
-        slot = reg - 0x40
-        dt1 = (val & 0x70) >> 4
-        mul = (val & 0x0f)
-        return f'Slot: {slot:d} Detune 1: {dt1:x} Mult: {mul:x}'
+        return ('Slot: {slot:d} Detune 1: {dt1:x} Mult: {mul:x}',
+                (('dt1', 4, 0x07, None), ('mul', 0, 0x0f, None)), {'slot': reg - 0x40})
     if 0x60 <= reg <= 0x7f:
-        slot = reg - 0x60
-        tl = (val & 0x7f)
-        return f'Slot: {slot:d} Level: {tl:2x}'
+        return ('Slot: {slot:d} Level: {tl:2x}', (('tl', 0, 0x7f, None),), {'slot': reg - 0x60})
     if 0x80 <= reg <= 0x9f:
-        slot = reg - 0x80
-        ks = (val & 0xc0) >> 6
-        ar = (val & 0x1f)
-        return f'Slot: {slot:d} Key Scaling: {ks:x} Attack: {ar:2x}'
+        return ('Slot: {slot:d} Key Scaling: {ks:x} Attack: {ar:2x}',
+                (('ks', 6, 0x03, None), ('ar', 0, 0x1f, None)), {'slot': reg - 0x80})
     if 0xa0 <= reg <= 0xbf:
-        slot = reg - 0xa0
-        amsen = (val & 0x80) >> 7
-        d1r = (val & 0x1f)
-        return f'Slot: {slot:d} AM Enabled: {amsen:b} Decay 1: {d1r:2x}'
+        return ('Slot: {slot:d} AM Enabled: {amsen:b} Decay 1: {d1r:2x}',
+                (('amsen', 7, 1, None), ('d1r', 0, 0x1f, None)), {'slot': reg - 0xa0})
     if 0xc0 <= reg <= 0xdf:
-        slot = reg - 0xc0
-        dt2 = (val & 0xc0) >> 6
-        d2r = (val & 0x1f)
-        return f'Slot: {slot:d} Detune 2: {dt2:x} Decay 2: {d2r:2x}'
+        return ('Slot: {slot:d} Detune 2: {dt2:x} Decay 2: {d2r:2x}',
+                (('dt2', 6, 0x03, None), ('d2r', 0, 0x1f, None)), {'slot': reg - 0xc0})
     if 0xe0 <= reg <= 0xff:
-        slot = reg - 0xe0
-        d1l = (val & 0xf0) >> 4
-        rr = (val & 0x0f)
-        return f'Slot: {slot:d} Decay 1 Level: {d1l:x} Release: {rr:x}'
-    return ''
+        return ('Slot: {slot:d} Decay 1 Level: {d1l:x} Release: {rr:x}',
+                (('d1l', 4, 0x0f, None), ('rr', 0, 0x0f, None)), {'slot': reg - 0xe0})
+    return empty_layout
+
+
+opl_layouts = [get_opl_layout(reg) for reg in range(0x200)]
+opm_layouts = [get_opm_layout(reg) for reg in range(0x100)]
+
+
+def get_opl_reg_channel(reg):
+    # Channel numbers are those shown in the listing. Slot registers belong to
+    # the channel that uses the slot in 2-op mode.
+    constants = opl_layouts[reg][2]
+    if 'slot' in constants:
+        channel = opl.get_op_reg_channel(reg)
+        return None if channel is None else channel + 1
+    return constants.get('channel')
+
+
+def get_opm_reg_channel(reg):
+    # The key on register names its channel in the value, so has none here
+    constants = opm_layouts[reg][2]
+    if 'slot' in constants:
+        return constants['slot'] & 0x07
+    return constants.get('channel')
+
+
+opl_reg_channels = [get_opl_reg_channel(reg) for reg in range(0x200)]
+opm_reg_channels = [get_opm_reg_channel(reg) for reg in range(0x100)]
+
+
+def get_opl_reg_class(reg):
+    reg8 = reg & 0xff
+    if reg8 == 0xbd:
+        return 'Rhythm (BD)'
+    for (first, last, name) in ((0x20, 0x35, 'AM/VIB/EGT/KSR/MULT (20-35)'), (0x40, 0x55, 'KSL/TL (40-55)'),
+                                (0x60, 0x75, 'AR/DR (60-75)'), (0x80, 0x95, 'SL/RR (80-95)'),
+                                (0xa0, 0xa8, 'F number (A0-A8)'), (0xb0, 0xb8, 'Key on/block (B0-B8)'),
+                                (0xc0, 0xc8, 'Feedback/connection (C0-C8)'), (0xe0, 0xf5, 'Waveform (E0-F5)')):
+        if first <= reg8 <= last:
+            return name
+    return 'Other'
+
+
+def get_opm_reg_class(reg):
+    if reg == 0x08:
+        return 'Key on (08)'
+    for (first, last, name) in ((0x20, 0x27, 'Channel control (20-27)'), (0x28, 0x37, 'Key code/fraction (28-37)'),
+                                (0x38, 0x3f, 'PMS/AMS (38-3F)'), (0x40, 0x5f, 'DT1/MUL (40-5F)'),
+                                (0x60, 0x7f, 'TL (60-7F)'), (0x80, 0x9f, 'KS/AR (80-9F)'),
+                                (0xa0, 0xbf, 'AMS-EN/D1R (A0-BF)'), (0xc0, 0xdf, 'DT2/D2R (C0-DF)'),
+                                (0xe0, 0xff, 'D1L/RR (E0-FF)')):
+        if first <= reg <= last:
+            return name
+    return 'Other'
+
+
+opl_reg_classes = [get_opl_reg_class(reg) for reg in range(0x200)]
+opm_reg_classes = [get_opm_reg_class(reg) for reg in range(0x100)]
+
+
+def decode_layout(layout, val):
+    (_, fields, constants) = layout
+    values = dict(constants)
+    for (name, shift, mask, _) in fields:
+        values[name] = (val >> shift) & mask
+    return values
+
+
+def format_layout(layout, val):
+    (template, fields, constants) = layout
+    values = dict(constants)
+    for (name, shift, mask, labels) in fields:
+        field = (val >> shift) & mask
+        values[name] = field if labels is None else labels[field]
+    return template.format(**values)
+
+
+def format_reg_opl(reg, val):
+    return format_layout(opl_layouts[reg & 0x1ff], val)
+
+
+def format_reg_opm(reg, val):
+    return format_layout(opm_layouts[reg & 0xff], val & 0xff)
+
+
+# Large enough to hold every register and value, but bounded in case values
+# outside a byte are written
+@lru_cache(maxsize=0x20000)
+def format_opl_write(reg, value):
+    port = (reg & 0x100) >> 8
+    reg8 = reg & 0xff
+    return f'{port:d} {reg8:02x} {value:02x} | {format_reg_opl(reg, value)}'
+
+
+@lru_cache(maxsize=0x10000)
+def format_opm_write(reg, value):
+    return f'{reg:02x} {value:02x} | {format_reg_opm(reg, value)}'
 
 
 def format_event(event):
     event_type = type(event)
     if event_type == OPLWriteEvent:
-        reg = event.reg
-        port = (reg & 0x100) >> 8
-        reg8 = reg & 0xff
-        value = event.value
-        details = format_reg_opl(reg, value)
-        desc = f'{port:d} {reg8:02x} {value:02x} | {details}'
+        desc = format_opl_write(event.reg, event.value)
     elif event_type == OPMWriteEvent:
-        reg = event.reg
-        value = event.value
-        details = format_reg_opm(reg, value)
-        desc = f'{reg:02x} {value:02x} | {details}'
+        desc = format_opm_write(event.reg, event.value)
     elif event_type == MarkerEvent:
         desc = f'Marker: {event.index}'
     elif event_type == JumpToMarkerEvent:
@@ -191,25 +236,412 @@ def format_event(event):
     return f'{event.time:08d}: {desc}'
 
 
-def print_events(input_parser):
-    for event in input_parser.read_events():
-        print(format_event(event))
+def parse_numbers(numbers_str, base=10):
+    # A number or an inclusive range, e.g. 3 or 0-8
+    if '-' in numbers_str:
+        (first, last) = numbers_str.split('-', maxsplit=1)
+        return range(int(first, base), int(last, base) + 1)
+    return [int(numbers_str, base)]
+
+
+def parse_chip(chip_str):
+    # opl, opm, or opl:N for one chip of a dual OPL file
+    if chip_str in ('opl', 'opm'):
+        return (chip_str, None)
+    if chip_str.startswith('opl:') and chip_str[4:].isdigit():
+        return ('opl', int(chip_str[4:]))
+    raise ValueError()
+
+
+class EventFilter:
+    # Selects writes by channel, slot, register and chip, and events by time.
+    # The selection is compiled into a table of registers up front, so each
+    # write is tested with a single lookup before anything is formatted.
+    # Channel and slot numbers are those shown in the listing. Time is in the
+    # parser's time base.
+    def __init__(self, channels=None, slots=None, regs=None, chips=None, start_time=None, end_time=None):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.channels = channels
+        self.opl_table = bytearray(0x400)
+        self.opm_table = bytearray(0x100)
+        for (chip, chip_index) in chips or (('opl', None), ('opm', None)):
+            if chip == 'opm':
+                for reg in range(0x100):
+                    self.opm_table[reg] = self._select_opm(reg, channels, slots, regs)
+                continue
+            for index in ((0, 1) if chip_index is None else (chip_index,)):
+                if index > 1:
+                    continue
+                for reg in range(0x200):
+                    self.opl_table[reg | (index << 9)] = self._select_opl(reg, channels, slots, regs)
+
+    @staticmethod
+    def _select_opl(reg, channels, slots, regs):
+        if regs is not None and reg not in regs and (reg & 0xff) not in regs:
+            return 0
+        if slots is not None and opl_layouts[reg][2].get('slot') not in slots:
+            return 0
+        if channels is not None and opl_reg_channels[reg] not in channels:
+            return 0
+        return 1
+
+    @staticmethod
+    def _select_opm(reg, channels, slots, regs):
+        if regs is not None and reg not in regs:
+            return 0
+        if slots is not None and opm_layouts[reg][2].get('slot') not in slots:
+            return 0
+        if channels is not None:
+            if reg == 0x08:
+                return 2
+            if opm_reg_channels[reg] not in channels:
+                return 0
+        return 1
+
+    def filter_events(self, events):
+        opl_table = self.opl_table
+        opm_table = self.opm_table
+        start_time = self.start_time
+        end_time = self.end_time
+        for event in events:
+            if end_time is not None and event.time > end_time:
+                # Nothing after this point can match
+                break
+            if start_time is not None and event.time < start_time:
+                continue
+            event_type = type(event)
+            if event_type == OPLWriteEvent:
+                if not opl_table[event.reg | (event.chip << 9)]:
+                    continue
+            elif event_type == OPMWriteEvent:
+                selected = opm_table[event.reg & 0xff]
+                if not selected or (selected == 2 and (event.value & 0x07) not in self.channels):
+                    continue
+            yield event
+
+
+@lru_cache(maxsize=0x20000)
+def decode_reg_opl(reg, val):
+    return decode_layout(opl_layouts[reg & 0x1ff], val)
 
 
-def summarize(input_parser):
-    chips_used = {}
-    for event in input_parser.read_events():
+@lru_cache(maxsize=0x10000)
+def decode_reg_opm(reg, val):
+    values = decode_layout(opm_layouts[reg & 0xff], val & 0xff)
+    if reg == 0x08:
+        values['key_on'] = 1 if values['sn'] != 0 else 0
+    return values
+
+
+record_types = ('opl', 'opm', 'marker', 'jump', 'end')
+
+# Columns and array type codes for tabular output. Channel and slot numbers
+# match the text output.
+record_columns = (
+    ('time', 'q'), ('seconds', 'd'), ('type', 'B'), ('chip', 'h'), ('port', 'h'), ('reg', 'h'), ('value', 'h'),
+    ('channel', 'h'), ('slot', 'h'), ('key_on', 'h'), ('block', 'h'), ('fnum', 'h'), ('tl', 'h'), ('index', 'i')
+)
+
+
+def get_records(events, time_base):
+    # Decoded events as flat dictionaries. Writes to the F number registers
+    # also carry the channel's full F number and block.
+    opl_registers = {}
+    for event in events:
         event_type = type(event)
+        record = {'time': event.time, 'seconds': event.time / time_base}
         if event_type == OPLWriteEvent:
-            chips_used['OPL2'] = True
-            reg_lsb = event.reg & 0xff
-            if 0xb0 <= reg_lsb <= 0xb8 and (event.value & 0x20) != 0:
-                # Key on
-                if event.reg & 0x100 != 0:
-                    chips_used['OPL3'] = True
+            reg = event.reg
+            record['type'] = 'opl'
+            record['chip'] = event.chip
+            record['port'] = reg >> 8
+            record['reg'] = reg & 0xff
+            record['value'] = event.value
+            record.update(decode_reg_opl(reg, event.value))
+            if 0xa0 <= (reg & 0xff) <= 0xb8:
+                key = reg | (event.chip << 9)
+                opl_registers[key] = event.value
+                base = key & ~0xff
+                offset = (reg & 0x0f)
+                fnum_l = opl_registers.get(base | 0xa0 | offset, 0)
+                reg_b0 = opl_registers.get(base | 0xb0 | offset, 0)
+                record['fnum'] = ((reg_b0 & 0x03) << 8) | fnum_l
+                record['block'] = (reg_b0 >> 2) & 0x07
         elif event_type == OPMWriteEvent:
-            chips_used['OPM'] = True
-    print('Chips used: ' + ', '.join(chips_used))
+            record['type'] = 'opm'
+            record['reg'] = event.reg
+            record['value'] = event.value
+            record.update(decode_reg_opm(event.reg, event.value))
+        elif event_type == MarkerEvent:
+            record['type'] = 'marker'
+            record['index'] = event.index
+        elif event_type == JumpToMarkerEvent:
+            record['type'] = 'jump'
+            record['index'] = event.index
+        elif event_type == EndEvent:
+            record['type'] = 'end'
+        else:
+            continue
+        yield record
+
+
+def write_jsonl(records, output, block_lines=4096):
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    lines = []
+    for record in records:
+        lines.append(dumps(record))
+        if len(lines) >= block_lines:
+            lines.append('')
+            output.write('\n'.join(lines))
+            lines = []
+    if len(lines) > 0:
+        lines.append('')
+        output.write('\n'.join(lines))
+    output.flush()
+
+
+def write_csv(records, output):
+    writer = csv.DictWriter(output, [name for (name, _) in record_columns], extrasaction='ignore',
+                            lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(records)
+    output.flush()
+
+
+def write_columns(records, output_dir):
+    type_codes = {name: code for (code, name) in enumerate(record_types)}
+    with ColumnWriter(output_dir, record_columns) as writer:
+        for record in records:
+            record['type'] = type_codes[record['type']]
+            writer.write(record)
+
+
+def print_events(events, output=None, block_lines=4096):
+    # Lines are written in blocks rather than printed one at a time
+    if output is None:
+        output = sys.stdout
+    lines = []
+    for event in events:
+        lines.append(format_event(event))
+        if len(lines) >= block_lines:
+            lines.append('')
+            output.write('\n'.join(lines))
+            lines = []
+    if len(lines) > 0:
+        lines.append('')
+        output.write('\n'.join(lines))
+    output.flush()
+
+
+class WriteProfile:
+    # Write rate and link usage, gathered in a single pass. Writes are counted
+    # in fixed windows (10 ms by default), and only the counts for the current
+    # window and a histogram of past windows are kept.
+    def __init__(self, time_base, window=0.01, baud=115200):
+        self.time_base = time_base
+        self.window = window
+        self.window_length = window * time_base
+        self.link = LinkModel(baud)
+        self.chips_used = {}
+        self.writes = 0
+        self.opl_writes = 0
+        self.opm_writes = 0
+        self.end_time = 0
+        self.channel_writes = {}
+        self.class_writes = {}
+        self.key_ons = 0
+        self.opl_registers = {}
+
+        self.burst_time = None
+        self.burst_writes = 0
+        self.peak_burst = (0, 0)
+
+        # Histogram of writes per window, keyed by the bit length of the count
+        self.window_index = None
+        self.window_writes = 0
+        self.rate_histogram = {}
+        self.peak_window = (0, 0)
+        self.busy_windows = 0
+        self.over_budget = []
+
+        self.second = None
+        self.second_key_ons = 0
+        self.peak_key_ons = (0, 0)
+
+    def update(self, event):
+        event_type = type(event)
+        if event_type != OPLWriteEvent and event_type != OPMWriteEvent:
+            if event_type == EndEvent:
+                self.end_time = max(self.end_time, event.time)
+            return
+        self.writes += 1
+        self.end_time = max(self.end_time, event.time)
+        reg = event.reg
+        key_on = False
+        if event_type == OPLWriteEvent:
+            self.opl_writes += 1
+            self.chips_used['OPL2'] = True
+            reg &= 0x1ff
+            channel = ('OPL', event.chip, opl_reg_channels[reg])
+            reg_class = ('OPL', opl_reg_classes[reg])
+            reg8 = reg & 0xff
+            if (0xb0 <= reg8 <= 0xb8) or reg8 == 0xbd:
+                # Count notes started, rather than repeated writes to notes
+                # already playing. Rhythm notes are keyed by the bits of BD.
+                key = reg | (event.chip << 9)
+                previous = self.opl_registers.get(key, 0)
+                self.opl_registers[key] = event.value
+                if reg8 == 0xbd:
+                    key_on = (event.value & 0x20) != 0 and (event.value & ~previous & 0x1f) != 0
+                else:
+                    key_on = (event.value & ~previous & 0x20) != 0
+                    if key_on and reg & 0x100 != 0:
+                        self.chips_used['OPL3'] = True
+        else:
+            self.opm_writes += 1
+            self.chips_used['OPM'] = True
+            reg &= 0xff
+            if reg == 0x08:
+                channel = ('OPM', 0, event.value & 0x07)
+                key_on = (event.value & 0x78) != 0
+            else:
+                channel = ('OPM', 0, opm_reg_channels[reg])
+            reg_class = ('OPM', opm_reg_classes[reg])
+        self.channel_writes[channel] = self.channel_writes.get(channel, 0) + 1
+        self.class_writes[reg_class] = self.class_writes.get(reg_class, 0) + 1
+
+        if event.time != self.burst_time:
+            self.burst_time = event.time
+            self.burst_writes = 0
+        self.burst_writes += 1
+        if self.burst_writes > self.peak_burst[0]:
+            self.peak_burst = (self.burst_writes, event.time)
+
+        window_index = int(event.time / self.window_length)
+        if window_index != self.window_index:
+            self._end_window()
+            self.window_index = window_index
+        self.window_writes += 1
+
+        if key_on:
+            self.key_ons += 1
+            second = int(event.time / self.time_base)
+            if second != self.second:
+                self.second = second
+                self.second_key_ons = 0
+            self.second_key_ons += 1
+            if self.second_key_ons > self.peak_key_ons[0]:
+                self.peak_key_ons = (self.second_key_ons, second)
+
+    def _end_window(self):
+        writes = self.window_writes
+        if writes == 0:
+            return
+        self.busy_windows += 1
+        bucket = writes.bit_length()
+        self.rate_histogram[bucket] = self.rate_histogram.get(bucket, 0) + 1
+        if writes > self.peak_window[0]:
+            self.peak_window = (writes, self.window_index)
+        if self.link.get_send_time(writes) > self.window:
+            # Runs of consecutive windows are reported together
+            if len(self.over_budget) > 0 and self.over_budget[-1][1] == self.window_index - 1:
+                (first, _, peak) = self.over_budget[-1]
+                self.over_budget[-1] = (first, self.window_index, max(peak, writes))
+            else:
+                self.over_budget.append((self.window_index, self.window_index, writes))
+        self.window_writes = 0
+
+    def finish(self):
+        self._end_window()
+
+    def get_bytes_per_second(self, writes, write_size=None):
+        if write_size is None:
+            write_size = self.link.write_size
+        return (writes * write_size) / self.window
+
+    def report(self):
+        window = self.window
+        duration = self.end_time / self.time_base
+        print('Chips used: ' + ', '.join(self.chips_used))
+        print(f'Duration: {duration:.2f} s')
+        mean_rate = self.writes / duration if duration > 0 else 0
+        print(f'Writes: {self.writes} (OPL: {self.opl_writes}, OPM: {self.opm_writes}), {mean_rate:.1f} per second')
+        if self.writes == 0:
+            return
+        (burst, burst_time) = self.peak_burst
+        print(f'Peak burst: {burst} writes at {burst_time / self.time_base:.3f} s')
+        (peak_writes, peak_index) = self.peak_window
+        print(f'Peak rate: {peak_writes / window:.0f} writes/s in the window at {peak_index * window:.3f} s')
+        key_on_rate = self.key_ons / duration if duration > 0 else 0
+        (peak_key_ons, peak_second) = self.peak_key_ons
+        print(f'Key ons: {self.key_ons}, {key_on_rate:.1f} per second '
+              + f'(peak {peak_key_ons} in the second from {peak_second} s)')
+
+        print(f'Writes per {window * 1000:g} ms window:')
+        total_windows = max(int(self.end_time / self.window_length) + 1, self.busy_windows)
+        print(f'  {"0 writes/s":>22}: {total_windows - self.busy_windows} windows')
+        for bucket in sorted(self.rate_histogram):
+            low = (1 << (bucket - 1)) / window
+            high = ((1 << bucket) - 1) / window
+            label = f'{low:.0f} writes/s' if low == high else f'{low:.0f}-{high:.0f} writes/s'
+            print(f'  {label:>22}: {self.rate_histogram[bucket]} windows')
+
+        print('Writes per channel:')
+        for ((chip_type, chip, channel), writes) in sorted(
+                self.channel_writes.items(), key=lambda item: (item[0][:2], -1 if item[0][2] is None else item[0][2])):
+            chip_name = chip_type if chip == 0 else f'{chip_type}:{chip}'
+            channel_name = 'global' if channel is None else f'{channel:2d}'
+            print(f'  {chip_name} {channel_name}: {writes}')
+
+        print('Writes per register class:')
+        for ((chip_type, reg_class), writes) in sorted(self.class_writes.items()):
+            print(f'  {chip_type} {reg_class}: {writes}')
+
+        print('Estimated link usage:')
+        protocols = [name for (name, writes) in (('oplser', self.opl_writes), ('opmser', self.opm_writes))
+                     if writes > 0]
+        print(f'  {"/".join(protocols)}: mean {mean_rate * self.link.write_size:.0f} bytes/s, '
+              + f'peak {self.get_bytes_per_second(peak_writes):.0f} bytes/s')
+        if self.opl_writes > 0:
+            # RetroWave sends 6 bytes of 7 bit data per write
+            rwave_size = (6 * 8) / 7
+            print(f'  rwave: mean {mean_rate * rwave_size:.0f} bytes/s, '
+                  + f'peak {self.get_bytes_per_second(peak_writes, rwave_size):.0f} bytes/s')
+
+        budget = self.link.bytes_per_second
+        if len(self.over_budget) == 0:
+            print(f'No windows exceed the link budget of {self.link.baud} baud ({budget:.0f} bytes/s)')
+            return
+        print(f'Windows exceeding the link budget of {self.link.baud} baud ({budget:.0f} bytes/s):')
+        for (first, last, writes) in self.over_budget:
+            print(f'  {first * window:10.3f}s-{(last + 1) * window:.3f}s: '
+                  + f'peak {self.get_bytes_per_second(writes):.0f} bytes/s')
+
+
+def summarize(events, time_base, window=0.01, baud=115200):
+    profile = WriteProfile(time_base, window, baud)
+    for event in events:
+        profile.update(event)
+    profile.finish()
+    profile.report()
+
+
+def check_link(events, time_base, baud):
+    link_scheduler = LinkScheduler(LinkModel(baud), time_base, warn=False)
+    for _ in link_scheduler.schedule(events):
+        pass
+
+    for (time, writes, lateness) in link_scheduler.late_groups:
+        print(f'{time:10.3f}s: {writes} writes, {lateness * 1000:.1f} ms late')
+    late_count = len(link_scheduler.late_groups)
+    if late_count == 0:
+        print(f'All {link_scheduler.groups} event groups can be sent in time at {baud} baud')
+        return True
+    max_lateness = max(lateness for (_, _, lateness) in link_scheduler.late_groups)
+    print(f'{late_count} of {link_scheduler.groups} event groups cannot be sent in time at {baud} baud '
+          + f'(up to {max_lateness * 1000:.1f} ms late)')
+    return False
 
 
 def main():
@@ -217,11 +649,85 @@ def main():
         prog='nsdump', description='List or summarize register writes in VGM files.')
     parser.add_argument('--summarize', '-s', help='display a summary of the file instead of listing all writes',
                         action='store_true', default=False)
+    parser.add_argument('--window', metavar='MS', nargs=1, type=float, default=(10,),
+                        help='measure write rates in windows of MS milliseconds when summarizing (default: 10)')
+    parser.add_argument('--budget', metavar='BAUD', nargs=1, type=int, default=(115200,),
+                        help='list the windows that exceed a serial link at BAUD when summarizing (default: 115200)')
+    parser.add_argument('--check-link', metavar='BAUD', nargs=1, type=int,
+                        help='check whether the file can be played in time over a serial link at BAUD')
+    parser.add_argument('--format', '-f', choices=('text', 'jsonl', 'csv', 'columns'), default='text',
+                        help='list writes as text, JSON Lines, CSV, or a directory of NumPy .npy columns '
+                        + '(default: text)')
+    parser.add_argument('--output', '-o', metavar='PATH', nargs=1,
+                        help='write the listing to PATH instead of standard output (required for columns)')
+    parser.add_argument('--channel', '-c', metavar='CHANNELS', nargs=1, action='append',
+                        help='only include writes to CHANNELS (e.g. 1 or 1-3), numbered as in the listing')
+    parser.add_argument('--slot', metavar='SLOTS', nargs=1, action='append',
+                        help='only include writes to SLOTS (e.g. 5 or 1-6), numbered as in the listing')
+    parser.add_argument('--reg', '-r', metavar='REGS', nargs=1, action='append',
+                        help='only include writes to registers REGS, in hex (e.g. b0-b8 or 104)')
+    parser.add_argument('--chip', metavar='CHIP', nargs=1, action='append',
+                        help='only include writes to CHIP: opl, opm, or opl:N for one chip of a dual chip file')
+    parser.add_argument('--from', metavar='TIME', nargs=1, type=parse_time, dest='start',
+                        help='start at TIME')
+    parser.add_argument('--to', metavar='TIME', nargs=1, type=parse_time, dest='end',
+                        help='stop after TIME')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the events, time and peak memory of each stage to standard error')
+    parser.add_argument('--profile-json', nargs=1, metavar='PATH',
+                        help='write the --profile results to PATH as JSON')
     parser.add_argument('file', metavar='FILE', nargs=1,
                         help='the input VGM file')
     args = parser.parse_args()
+    if args.format == 'columns' and args.output is None:
+        print('An output directory is required for columns format')
+        sys.exit(1)
+    try:
+        channels = {c for s in args.channel for c in parse_numbers(s[0])} if args.channel is not None else None
+        slots = {s for n in args.slot for s in parse_numbers(n[0])} if args.slot is not None else None
+        regs = {r for s in args.reg for r in parse_numbers(s[0], 16)} if args.reg is not None else None
+        chips = [parse_chip(c[0]) for c in args.chip] if args.chip is not None else None
+    except ValueError:
+        print('Invalid filter')
+        sys.exit(1)
+
+    profile = PipelineProfile(args.profile or args.profile_json is not None)
     with open_parser(args.file[0]) as input_parser:
-        if args.summarize:
-            summarize(input_parser)
+        time_base = input_parser.time_base
+        events = profile.stage('parse', input_parser.read_events())
+        if any(f is not None for f in (channels, slots, regs, chips, args.start, args.end)):
+            event_filter = EventFilter(channels, slots, regs, chips,
+                                       None if args.start is None else int(args.start[0] * time_base),
+                                       None if args.end is None else int(args.end[0] * time_base))
+            events = profile.stage('filter', event_filter.filter_events(events))
+        if args.check_link is not None:
+            sink_name = 'check_link'
+        elif args.summarize:
+            sink_name = 'summarize'
         else:
-            print_events(input_parser)
+            sink_name = args.format
+        events = profile.sink(sink_name, events)
+
+        link_ok = True
+        if args.check_link is not None:
+            link_ok = check_link(events, time_base, args.check_link[0])
+        elif args.summarize:
+            summarize(events, time_base, args.window[0] / 1000, args.budget[0])
+        elif args.format == 'columns':
+            write_columns(get_records(events, time_base), args.output[0])
+        else:
+            # Only close the output if it was opened here
+            output = nullcontext(sys.stdout)
+            if args.output is not None:
+                output = open(args.output[0], 'w', encoding='utf-8', newline='')
+            with output as output_file:
+                if args.format == 'jsonl':
+                    write_jsonl(get_records(events, time_base), output_file)
+                elif args.format == 'csv':
+                    write_csv(get_records(events, time_base), output_file)
+                else:
+                    print_events(events, output_file)
+
+    profile.report(args.profile_json[0] if args.profile_json is not None else None, args.profile)
+    if not link_ok:
+        sys.exit(1)
@@ -0,0 +1,129 @@
+import argparse
+import sys
+
+from .catalogue import Catalogue, update_catalogue
+from .utils import parse_time
+
+sort_columns = ('path', 'duration', 'write_rate', 'peak_rate', 'writes', 'key_ons', 'size', 'title')
+
+
+def update(args):
+    counts = {}
+    with Catalogue(args.database[0]) as catalogue:
+        workers = args.jobs[0] if args.jobs is not None else None
+        for (status, path, error) in update_catalogue(catalogue, args.path, workers, not args.no_prune):
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'failed':
+                print(f'{path}: FAILED ({error})')
+            elif args.verbose and status != 'unchanged':
+                print(f'{path}: {status}')
+    print(', '.join(f'{counts.get(status, 0)} {status}'
+                    for status in ('added', 'updated', 'unchanged', 'removed', 'failed')))
+
+
+def get_query(args):
+    where = []
+    params = []
+    if args.errors:
+        where.append('error IS NOT NULL')
+    else:
+        where.append('error IS NULL')
+    for chip in args.chip or ():
+        # Matches either the chips named in the header or those written to
+        where.append("(',' || lower(coalesce(chips, '')) || ',' || lower(chips_used) || ',') LIKE ?")
+        params.append(f'%,{chip[0].lower()},%')
+    if args.min_duration is not None:
+        where.append('duration >= ?')
+        params.append(args.min_duration[0])
+    if args.max_duration is not None:
+        where.append('duration <= ?')
+        params.append(args.max_duration[0])
+    if args.loop is not None:
+        where.append('(has_loop != 0 OR loop_duration > 0) = ?')
+        params.append(1 if args.loop else 0)
+    if args.min_rate is not None:
+        where.append('write_rate >= ?')
+        params.append(args.min_rate[0])
+    if args.max_rate is not None:
+        where.append('write_rate <= ?')
+        params.append(args.max_rate[0])
+    if args.min_peak_rate is not None:
+        where.append('peak_rate >= ?')
+        params.append(args.min_peak_rate[0])
+    if args.text is not None:
+        where.append("(title LIKE ? OR game LIKE ? OR artist LIKE ? OR path LIKE ?)")
+        params.extend([f'%{args.text[0]}%'] * 4)
+    return (where, params)
+
+
+def query(args):
+    (where, params) = get_query(args)
+    order_by = args.sort + (' DESC' if args.reverse else '')
+    with Catalogue(args.database[0]) as catalogue:
+        for row in catalogue.query(where, params, order_by, args.limit[0] if args.limit is not None else None):
+            if args.paths:
+                print(row['path'])
+            elif args.errors:
+                print(f'{row["path"]}: {row["error"]}')
+            else:
+                chips = row['chips_used'] or row['chips'] or '-'
+                title = ' - '.join(field for field in (row['game'], row['title']) if field)
+                print(f'{row["path"]}\t{row["duration"]:.1f}s\t{chips}\t{row["write_rate"]:.0f} writes/s\t'
+                      + f'{row["peak_rate"]:.0f} peak\t{title}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='nsindex', description='Catalogue VGM, VGZ, DRO and MIDI files and query the catalogue.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    update_parser = subparsers.add_parser('update', help='add new and changed files to the catalogue')
+    update_parser.add_argument('--jobs', '-j', metavar='N', nargs=1, type=int,
+                               help='number of worker processes (default: number of CPUs)')
+    update_parser.add_argument('--no-prune', action='store_true',
+                               help='keep entries for files that no longer exist')
+    update_parser.add_argument('--verbose', '-v', action='store_true',
+                               help='list each file added, updated or removed')
+    update_parser.add_argument('database', metavar='DATABASE', nargs=1,
+                               help='the catalogue file')
+    update_parser.add_argument('path', metavar='PATH', nargs='+',
+                               help='files or directories to index')
+
+    query_parser = subparsers.add_parser('query', help='list catalogued files matching the given conditions')
+    query_parser.add_argument('--chip', '-c', metavar='CHIP', nargs=1, action='append',
+                              help='only files using CHIP, e.g. OPL3, OPM or YM2151 (can be given more than once)')
+    query_parser.add_argument('--min-duration', metavar='TIME', nargs=1, type=parse_time,
+                              help='only files at least TIME long')
+    query_parser.add_argument('--max-duration', metavar='TIME', nargs=1, type=parse_time,
+                              help='only files at most TIME long')
+    query_parser.add_argument('--loop', action='store_true', default=None,
+                              help='only files that loop')
+    query_parser.add_argument('--no-loop', action='store_false', dest='loop',
+                              help='only files that do not loop')
+    query_parser.add_argument('--min-rate', metavar='WRITES', nargs=1, type=float,
+                              help='only files averaging at least WRITES register writes per second')
+    query_parser.add_argument('--max-rate', metavar='WRITES', nargs=1, type=float,
+                              help='only files averaging at most WRITES register writes per second')
+    query_parser.add_argument('--min-peak-rate', metavar='WRITES', nargs=1, type=float,
+                              help='only files peaking at WRITES register writes per second or more')
+    query_parser.add_argument('--text', '-t', metavar='TEXT', nargs=1,
+                              help='only files with TEXT in the title, game, artist or path')
+    query_parser.add_argument('--errors', action='store_true',
+                              help='list files that could not be analysed instead')
+    query_parser.add_argument('--sort', '-s', choices=sort_columns, default='path',
+                              help='sort order (default: path)')
+    query_parser.add_argument('--reverse', '-r', action='store_true', help='reverse the sort order')
+    query_parser.add_argument('--limit', '-n', metavar='N', nargs=1, type=int, help='list at most N files')
+    query_parser.add_argument('--paths', action='store_true', help='list only the paths of matching files')
+    query_parser.add_argument('database', metavar='DATABASE', nargs=1,
+                              help='the catalogue file')
+
+    args = parser.parse_args()
+    if args.command == 'update':
+        update(args)
+    elif args.command == 'query':
+        query(args)
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,159 @@
+import argparse
+import multiprocessing
+import sys
+import time
+
+from .opl import OPLController
+from .opm import OPMController
+from .render import open_input, play
+from .transport import LinkModel, LinkScheduler
+from .virtualdev import VirtualSerialDevice, protocols
+
+# The link each nsplay serial device schedules writes for, at its fixed baud
+# rate. RetroWave writes are 6 bytes of SPI data, 7-bit encoded.
+link_models = {
+    'oplser': LinkModel(115200),
+    'opmser': LinkModel(115200),
+    'rwave': LinkModel(115200, (6 * 8) / 7),
+}
+
+
+class RecordingChip:
+    realtime = False
+
+    def __init__(self):
+        self.writes = []
+        self.time = 0
+
+    def write(self, reg, value):
+        self.writes.append((self.time, reg, value))
+
+    def wait(self, wait_time):
+        if wait_time > 0:
+            self.time += wait_time
+
+    def flush(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def record_writes(vgmparser, protocol, lookahead=None, max_lead=0.02):
+    # The writes nsplay will send, after the link scheduler drops superseded
+    # writes and the controller drops the ones that do not change a register
+    chip = RecordingChip()
+    controller = OPMController(chip) if protocol == 'opmser' else OPLController(chip)
+    events = vgmparser.read_events()
+    if lookahead is not None:
+        link_scheduler = LinkScheduler(link_models[protocol], vgmparser.time_base, lookahead, max_lead,
+                                       warn=False)
+        events = link_scheduler.schedule(events)
+    play(vgmparser, controller, events)
+    return chip.writes
+
+
+def get_expected_writes(input_path, protocol, lookahead=None, max_lead=0.02):
+    with open_input(input_path) as vgmparser:
+        return record_writes(vgmparser, protocol, lookahead, max_lead)
+
+
+def run_nsplay(argv):
+    from .nsplay import main as nsplay_main
+    sys.argv = ['nsplay'] + argv
+    nsplay_main()
+
+
+def match_writes(expected, actual, window=0.1):
+    # Pair each received write with the next expected write to the same
+    # register and value, skipping any that were dropped along the way. The
+    # skip is bounded: the expected write may be at most window seconds
+    # further on from the previous pair than the received one, so a write
+    # that was never expected is not paired with a much later one.
+    pairs = []
+    i = 0
+    last_pair = None
+    for (actual_time, reg, value) in actual:
+        limit = float('inf')
+        if last_pair is not None:
+            limit = last_pair[0] + (actual_time - last_pair[1]) + window
+        j = i
+        while j < len(expected) and expected[j][0] <= limit and expected[j][1:] != (reg, value):
+            j += 1
+        if j == len(expected) or expected[j][0] > limit:
+            continue
+        last_pair = (expected[j][0], actual_time)
+        pairs.append(last_pair)
+        i = j + 1
+    return pairs
+
+
+def get_percentile(ordered, percentile):
+    return ordered[min(len(ordered) - 1, (len(ordered) * percentile) // 100)]
+
+
+def format_stats(values):
+    ordered = sorted(values)
+    return (f'mean {sum(ordered) / len(ordered) * 1000:.3f} ms, '
+            + f'p99 {get_percentile(ordered, 99) * 1000:.3f} ms, max {ordered[-1] * 1000:.3f} ms')
+
+
+def print_report(expected, actual):
+    print(f'Writes: {len(actual)} received, {len(expected)} expected')
+    if len(actual) < 2:
+        return
+
+    span = actual[-1][0] - actual[0][0]
+    if span > 0:
+        print(f'Throughput: {len(actual) / span:.1f} writes/s')
+    gaps = [b[0] - a[0] for (a, b) in zip(actual, actual[1:])]
+    print(f'Inter-write latency: {format_stats(gaps)}')
+
+    pairs = match_writes(expected, actual)
+    if len(pairs) > 0:
+        # Playback starts at an arbitrary time, so measure errors relative to
+        # the median offset between the received and source timelines
+        offsets = sorted(actual_time - expected_time for (expected_time, actual_time) in pairs)
+        offset = offsets[len(offsets) // 2]
+        errors = [abs(actual_offset - offset) for actual_offset in offsets]
+        print(f'Timing error over {len(pairs)} matched writes: {format_stats(errors)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='nslinkbench',
+        description='Benchmark serial playback with nsplay against a virtual device. '
+        + 'Unrecognised options are passed on to nsplay.')
+    parser.add_argument('--protocol', '-p', choices=protocols, default='oplser',
+                        help='the serial device protocol to emulate (default: oplser)')
+    parser.add_argument('--baud', '-b', metavar='BAUD', nargs=1, type=int, default=(115200,),
+                        help='simulate the transfer time of a link at BAUD, or 0 to disable (default: 115200)')
+    parser.add_argument('file', metavar='FILE', nargs=1,
+                        help='the file to play')
+
+    (args, nsplay_args) = parser.parse_known_args()
+
+    # The expected writes are scheduled the same way nsplay schedules them
+    schedule_parser = argparse.ArgumentParser(add_help=False)
+    schedule_parser.add_argument('--lookahead', nargs=1, type=float)
+    schedule_parser.add_argument('--max-lead', nargs=1, type=float, default=(0.02,))
+    (schedule_args, _) = schedule_parser.parse_known_args(nsplay_args)
+
+    expected = get_expected_writes(args.file[0], args.protocol,
+                                   schedule_args.lookahead[0] if schedule_args.lookahead is not None else None,
+                                   schedule_args.max_lead[0])
+    with VirtualSerialDevice(args.protocol, args.baud[0]) as device:
+        process = multiprocessing.Process(target=run_nsplay, args=(
+            ['--device', f'{args.protocol}:{device.path}'] + nsplay_args + [args.file[0]],))
+        process.start()
+        process.join()
+        # Give the reader thread time to drain the last writes
+        time.sleep(0.2)
+
+    if process.exitcode != 0:
+        print(f'nsplay exited with code {process.exitcode}', file=sys.stderr)
+        sys.exit(1)
+    print_report(expected, device.writes)
@@ -1,13 +1,18 @@
 import argparse
-from math import floor
+from contextlib import ExitStack
+import queue
 import sys
+import threading
 import time
 
-import mido
-from .midi import OPL2EmulatorOutput, OPL3EmulatorOutput, OPMEmulatorOutput, StdOutOutput, VGMMIDIOutput
+channel_count = 16
+
+# mido and the emulator outputs are imported only once a device is opened, so
+# that argument errors and --help don't wait for them to load
 
 
 def list_devices():
+    import mido
     print('Input devices:')
     for dev in sorted(set(mido.get_input_names())):
         print('  mido:' + dev)
@@ -17,45 +22,106 @@ def list_devices():
         print('  mido:' + dev)
     print('  opl2em')
     print('  opl3em')
+    print('  opl3em:<chips>')
     print('  opmem')
     print('  stdout')
 
 
-def get_device_events(dev):
-    with dev:
-        while True:
-            yield dev.poll()
+class MIDIInput:
+    # Messages arrive from a port callback or a playback thread, stamped with
+    # the time they were due, so the main loop can block until there is
+    # something to do. A message of None marks the end of the input.
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def start(self):
+        pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DeviceInput(MIDIInput):
+    def __init__(self, port_name):
+        super().__init__()
+        import mido
+        self.port = mido.open_input(port_name, callback=self._receive)
+
+    def _receive(self, msg):
+        self.queue.put((time.perf_counter(), msg))
+
+    def close(self):
+        self.port.close()
 
 
-def get_file_events(file):
-    with file:
+class FileInput(MIDIInput):
+    def __init__(self, path):
+        super().__init__()
+        import mido
+        self.file = mido.MidiFile(path)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        # Deadlines are absolute, so time spent delivering one message does
+        # not delay the ones after it
         msg_time = time.perf_counter()
-        for msg in file:
+        for msg in self.file:
             if msg.is_meta:
                 continue
             msg_time = msg_time + msg.time
-            while time.perf_counter() < msg_time:
-                yield None
-            yield msg
+            delay = msg_time - time.perf_counter()
+            if delay > 0 and self._closed.wait(delay):
+                return
+            self.queue.put((msg_time, msg))
+        self.queue.put((msg_time, None))
+
+    def close(self):
+        self._closed.set()
+        if self._thread.is_alive():
+            self._thread.join()
 
 
 def open_midi_input(dev_name):
     print('Opening input device: ' + dev_name)
     if dev_name.startswith('mido:'):
-        return get_device_events(mido.open_input(dev_name[5:]))
+        return DeviceInput(dev_name[5:])
     if dev_name.startswith('file:'):
-        return get_file_events(mido.MidiFile(dev_name[5:]))
+        return FileInput(dev_name[5:])
     return None
 
 
 def open_midi_output(dev_name):
     print('Opening output device: ' + dev_name)
     if dev_name.startswith('mido:'):
+        import mido
         return mido.open_output(dev_name[5:])
+    from .midi import MultiOPL3EmulatorOutput, OPL2EmulatorOutput, OPL3EmulatorOutput, OPMEmulatorOutput
+    from .midi import StdOutOutput
     if dev_name == 'opl2em':
         return OPL2EmulatorOutput()
     if dev_name == 'opl3em':
         return OPL3EmulatorOutput()
+    if dev_name.startswith('opl3em:'):
+        chips = dev_name[7:]
+        if not chips.isdigit() or int(chips) < 1:
+            return None
+        return MultiOPL3EmulatorOutput(chips=int(chips))
     if dev_name == 'opmem':
         return OPMEmulatorOutput()
     if dev_name == 'stdout':
@@ -63,19 +129,126 @@ def open_midi_output(dev_name):
     return None
 
 
+class RoutedOutput:
+    # Emulator outputs are processed in blocks, with each message applied at
+    # its offset within the block. Other outputs are sent messages directly.
+    def __init__(self, output, block_size):
+        from .midi import VGMMIDIOutput
+        self.output = output
+        self.block_mode = isinstance(output, VGMMIDIOutput)
+        self.block_time = None
+        self.lead = 0
+        if self.block_mode:
+            chip = output.device.chip
+            self.block_time = block_size / chip.sample_rate
+            # The block timeline runs ahead of the wall clock by the audio
+            # engine's latency, so its buffer stays at the target fill and
+            # any shortfall is counted as an underrun
+            engine = getattr(chip, 'engine', None)
+            if engine is not None:
+                self.lead = engine.latency_samples / engine.sample_rate
+        self.block_start = None
+        self.block_messages = []
+
+    @property
+    def block_end(self):
+        return self.block_start + self.block_time
+
+    @property
+    def next_update(self):
+        # The wall clock time at which the current block is due
+        return self.block_end - self.lead
+
+    def start(self, start_time):
+        self.block_start = start_time
+
+    def send(self, msg_time, msg):
+        if self.block_mode:
+            self.block_messages.append((msg_time + self.lead, msg))
+        else:
+            self.output.send(msg)
+
+    def update(self, now):
+        if not self.block_mode:
+            return
+        while now + self.lead >= self.block_end:
+            self.output.process_block(
+                self.block_messages, self.block_start, self.block_time)
+            self.block_messages = []
+            self.block_start = self.block_end
+
+    def flush(self):
+        if self.block_mode and len(self.block_messages) > 0:
+            self.output.process_block(
+                self.block_messages, self.block_start, self.block_time)
+            self.block_messages = []
+
+
+def parse_channels(channels_str):
+    if '-' in channels_str:
+        (first, last) = channels_str.split('-', maxsplit=1)
+        channels = range(int(first), int(last) + 1)
+    else:
+        channels = [int(channels_str)]
+    for channel in channels:
+        if channel < 0 or channel >= channel_count:
+            raise ValueError()
+    return channels
+
+
+def parse_route(route_str):
+    # CHANNELS:OUTPUT[:CHANNEL], e.g. 0-7:1 or 9:0:15
+    parts = route_str.split(':')
+    if len(parts) < 2 or len(parts) > 3:
+        raise ValueError()
+    channels = parse_channels(parts[0])
+    output = int(parts[1])
+    dest_channel = None
+    if len(parts) > 2:
+        dest_channel = parse_channels(parts[2])[0]
+    return (channels, output, dest_channel)
+
+
+def get_routing_table(routes, output_count, disabled_channels=(), solo_channels=None, swap_perc=False):
+    # The (output, channel) pairs that each input channel is sent to
+    if routes is None:
+        routes = [(range(channel_count), output, None)
+                  for output in range(output_count)]
+
+    table = [[] for _ in range(channel_count)]
+    for (channels, output, dest_channel) in routes:
+        if output < 0 or output >= output_count:
+            raise ValueError()
+        for channel in channels:
+            if channel in disabled_channels:
+                continue
+            if solo_channels is not None and channel not in solo_channels:
+                continue
+            target_channel = channel if dest_channel is None else dest_channel
+            if swap_perc and target_channel in (9, 15):
+                target_channel = 24 - target_channel
+            table[channel].append((output, target_channel))
+    return [tuple(targets) for targets in table]
+
+
 def main():
     parser = argparse.ArgumentParser(
-        prog='nsmidi', description='Route MIDI events to a real or emulated device.')
+        prog='nsmidi', description='Route MIDI events to real or emulated devices.')
     parser.add_argument('--list-devs', '-l', help='list input or output devices',
                         action='store_true', default=False)
     parser.add_argument('--input-device', '-i', metavar='DEVICE',
                         nargs=1, help='select input device')
-    parser.add_argument('--output-device', '-o',
-                        metavar='DEVICE', nargs=1, help='select output device')
+    parser.add_argument('--output-device', '-o', metavar='DEVICE', nargs=1, action='append',
+                        help='select output device (can be given more than once)')
+    parser.add_argument('--route', '-r', metavar='CHANNELS:OUTPUT[:CHANNEL]', nargs=1, action='append',
+                        help='send events on CHANNELS (e.g. 0-7) to the output with index OUTPUT, '
+                        + 'optionally on another channel (default: all channels to every output)')
     parser.add_argument('--disable-channel', '-d', metavar='CHANNEL', nargs=1, action='append', type=int,
                         help='do not output events on the specified channel')
     parser.add_argument('--solo-channel', '-s', metavar='CHANNEL', nargs=1,
                         action='append', type=int, help='only play events on the specified channel')
+    parser.add_argument('--block-size', '-b', metavar='FRAMES', nargs=1, type=int, default=(256,),
+                        help='audio block size for emulator outputs (default: 256)')
     parser.add_argument('--swap-perc', '-p', action='store_true',
                         default=False, help='swap channels 10 and 16')
     args = parser.parse_args()
@@ -89,44 +262,67 @@ def main():
         print('No output device specified')
         sys.exit(1)
 
+    disabled_channels = [c[0] for c in args.disable_channel] if args.disable_channel is not None else [
+    ]
+    solo_channels = [
+        c[0] for c in args.solo_channel] if args.solo_channel is not None else None
+    try:
+        routes = [parse_route(r[0]) for r in args.route] if args.route is not None else None
+        routing_table = get_routing_table(routes, len(args.output_device), disabled_channels,
+                                          solo_channels, args.swap_perc)
+    except ValueError:
+        print('Invalid route')
+        sys.exit(1)
+
     input_dev = open_midi_input(args.input_device[0])
     if input_dev is None:
         print('Cannot open input device')
         sys.exit(1)
-    output_dev = open_midi_output(args.output_device[0])
-    if output_dev is None:
-        print('Cannot open output device')
-        sys.exit(1)
+    output_devs = []
+    for dev_name in args.output_device:
+        output_dev = open_midi_output(dev_name[0])
+        if output_dev is None:
+            print('Cannot open output device')
+            sys.exit(1)
+        output_devs.append(output_dev)
     print('Ready')
 
-    ignore_channels = [c[0] for c in args.disable_channel] if args.disable_channel is not None else [
-    ]
-    solo_channels = [
-        c[0] for c in args.solo_channel] if args.solo_channel is not None else None
-
-    with output_dev:
-        output_dev.reset()
-        try:
-            for msg in input_dev:
-                if msg is None:
-                    if isinstance(output_dev, VGMMIDIOutput):
-                        cur_time_ms = floor(time.perf_counter() * 1000)
-                        output_dev.set_time(cur_time_ms)
-                        output_dev.update()
-                        output_dev.device.wait(0.001)
-                    else:
-                        time.sleep(0.001)
-                else:
-                    if hasattr(msg, 'channel'):
-                        if msg.channel in ignore_channels:
-                            continue
-                        if solo_channels is not None and not msg.channel in solo_channels:
-                            continue
-                        if args.swap_perc:
-                            if msg.channel == 9:
-                                msg = msg.copy(channel=15)
-                            elif msg.channel == 15:
-                                msg = msg.copy(channel=9)
-                    output_dev.send(msg)
-        finally:
+    with ExitStack() as stack:
+        stack.enter_context(input_dev)
+        outputs = []
+        for output_dev in output_devs:
+            stack.enter_context(output_dev)
             output_dev.reset()
+            stack.callback(output_dev.reset)
+            outputs.append(RoutedOutput(output_dev, args.block_size[0]))
+        block_outputs = [output for output in outputs if output.block_mode]
+
+        start_time = time.perf_counter()
+        for output in outputs:
+            output.start(start_time)
+        input_dev.start()
+        while True:
+            # Wake for the next message, or when the next block is due
+            timeout = None
+            if len(block_outputs) > 0:
+                timeout = max(0, min(output.next_update for output in block_outputs)
+                              - time.perf_counter())
+            item = input_dev.get(timeout)
+            if item is not None and item[1] is None:
+                for output in outputs:
+                    output.flush()
+                break
+
+            due_time = time.perf_counter() if item is None else item[0]
+            for output in block_outputs:
+                output.update(due_time)
+            if item is None:
+                continue
+
+            (msg_time, msg) = item
+            if hasattr(msg, 'channel'):
+                for (output, channel) in routing_table[msg.channel]:
+                    outputs[output].send(msg_time, msg if channel == msg.channel else msg.copy(channel=channel))
+            else:
+                for output in outputs:
+                    output.send(msg_time, msg)
@@ -1,7 +1,11 @@
 import argparse
-import time
 from .parser import open_parser
 from .devices import get_device
+from .pcm import sample_formats
+from .profiling import PipelineProfile
+from .render import play
+from .telemetry import PlaybackTelemetry
+from .transport import LinkScheduler
 
 
 def main():
@@ -9,26 +13,88 @@ def main():
         prog='nsplay', description='Play back .DRO, .VGM and .VGZ files.')
     parser.add_argument('--device', '-d', metavar='DEVICE', default=('oplem',),
                         type=str, nargs=1, help='set the device to use', dest='device')
+    parser.add_argument('--rate', '-r', metavar='HZ', nargs=1, type=int,
+                        help='resample WAV and raw PCM output to the specified sample rate')
+    parser.add_argument('--format', '-f', choices=sample_formats, default='s16',
+                        help='sample format for WAV and raw PCM output (default: s16)')
+    parser.add_argument('--latency', metavar='MS', nargs=1, type=float, default=(100,),
+                        help='audio latency for emulator playback in milliseconds (default: 100)')
+    parser.add_argument('--buffer-size', metavar='FRAMES', nargs=1, type=int,
+                        help='audio ring buffer size for emulator playback')
+    parser.add_argument('--lookahead', metavar='SECONDS', nargs=1, type=float,
+                        help='schedule serial writes ahead of time to fit the link bandwidth, looking ahead SECONDS')
+    parser.add_argument('--max-lead', metavar='SECONDS', nargs=1, type=float, default=(0.02,),
+                        help='send writes at most SECONDS early when using --lookahead (default: 0.02)')
+    parser.add_argument('--midi-chips', metavar='N', nargs=1, type=int, default=(1,),
+                        help='spread MIDI file playback across N OPL3 chips for more polyphony (default: 1)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print scheduling statistics at the end of playback')
+    parser.add_argument('--status', action='store_true',
+                        help='show a live status line with lateness, buffer and queue levels during playback')
+    parser.add_argument('--telemetry', nargs=1, metavar='PATH',
+                        help='log playback telemetry to PATH as CSV, or as JSON Lines if PATH ends in .jsonl')
+    parser.add_argument('--telemetry-interval', metavar='MS', nargs=1, type=float, default=(100,),
+                        help='interval between --status updates and --telemetry samples in milliseconds '
+                             + '(default: 100)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the events, time and peak memory of each playback stage at the end')
+    parser.add_argument('--profile-json', nargs=1, metavar='PATH',
+                        help='write the --profile results to PATH as JSON')
     parser.add_argument('file', metavar='FILE', nargs=1,
                         help='the file to play')
 
     args = parser.parse_args()
 
-    with open_parser(args.file[0]) as vgmparser, get_device(args.device[0]) as chip:
-        try:
-            chip.reset()
-
-            last_event_time = 0
-            for event in vgmparser.read_events():
-                chip.wait((event.time - last_event_time) / vgmparser.time_base)
-                chip.write_event(event)
-                last_event_time = event.time
-
-            chip.wait((vgmparser.duration - last_event_time) /
-                      vgmparser.time_base)
+    output_rate = args.rate[0] if args.rate is not None else None
+    profile = PipelineProfile(args.profile or args.profile_json is not None)
+    telemetry = None
+    with open_parser(args.file[0], args.midi_chips[0]) as vgmparser, \
+            get_device(args.device[0], output_rate, args.format, args.latency[0] / 1000,
+                       args.buffer_size[0] if args.buffer_size is not None else None,
+                       vgmparser.opl_chips) as chip:
+        events = profile.stage('parse', vgmparser.read_events())
+        link = getattr(chip.chip, 'link', None)
+        link_scheduler = None
+        if args.lookahead is not None and link is not None:
+            link_scheduler = LinkScheduler(
+                link, vgmparser.time_base, args.lookahead[0], args.max_lead[0])
+            events = profile.stage('schedule', link_scheduler.schedule(events))
+        if args.status or args.telemetry is not None:
+            telemetry = PlaybackTelemetry(chip.chip, vgmparser.time_base, args.telemetry_interval[0] / 1000,
+                                          args.telemetry[0] if args.telemetry is not None else None, args.status)
+            events = telemetry.track(events)
+            telemetry.start()
+        # Includes time spent waiting for realtime output
+        events = profile.sink('play', events)
 
-            chip.all_notes_off()
+        try:
+            play(vgmparser, chip, events)
         except KeyboardInterrupt:
             # Reset chip
             chip.reset()
             print()
+
+    # Take the last sample once the device has finished output
+    if telemetry is not None:
+        telemetry.stop()
+
+    # Serial writes and emulator audio are still being output until the
+    # device is closed, so report on them afterwards
+    underruns = getattr(chip.chip, 'underruns', 0)
+    if underruns > 0:
+        print(f'Audio buffer underruns: {underruns}')
+
+    scheduler = getattr(chip.chip, 'scheduler', None)
+    if args.stats and scheduler is not None:
+        stats = scheduler.get_stats()
+        print(f'Scheduling lateness over {stats["count"]} event groups: '
+              + f'mean {stats["mean"] * 1000:.3f} ms, p99 {stats["p99"] * 1000:.3f} ms, '
+              + f'max {stats["max"] * 1000:.3f} ms')
+    writer = getattr(chip.chip, 'writer', None)
+    if args.stats and writer is not None:
+        print(f'Serial queue: max depth {writer.max_queue_depth}, '
+              + f'max stall {writer.max_stall * 1000:.1f} ms, total stall {writer.total_stall * 1000:.1f} ms')
+    if args.stats and link_scheduler is not None:
+        print(f'Link: {len(link_scheduler.late_groups)} of {link_scheduler.groups} event groups late, '
+              + f'{link_scheduler.collapsed_writes} superseded writes dropped')
+    profile.report(args.profile_json[0] if args.profile_json is not None else None, args.profile)
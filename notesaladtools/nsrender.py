@@ -0,0 +1,102 @@
+import argparse
+import glob
+import os
+import sys
+
+from .cache import RenderCache
+from .pcm import sample_formats
+from .render import get_output_names, get_render_jobs, render_batch, render_mixed_batch
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            paths.append(pattern)
+    # Patterns can overlap, so render each file once
+    seen = set()
+    unique_paths = []
+    for path in paths:
+        key = os.path.normcase(os.path.abspath(path))
+        if key not in seen:
+            seen.add(key)
+            unique_paths.append(path)
+    return unique_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='nsrender', description='Render many .DRO, .VGM and .VGZ files to WAV in parallel.')
+    parser.add_argument('--output-dir', '-o', metavar='DIR', nargs=1, required=True,
+                        help='the directory to write WAV files to')
+    parser.add_argument('--chip', '-c', choices=('opl', 'opm', 'mix'), default='opl',
+                        help='the chip to emulate, or mix to render both and mix them (default: opl)')
+    parser.add_argument('--jobs', '-j', metavar='N', nargs=1, type=int,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--rate', '-r', metavar='HZ', nargs=1, type=int,
+                        help='resample the output to the specified sample rate')
+    parser.add_argument('--format', '-f', choices=sample_formats, default='s16',
+                        help='output sample format (default: s16)')
+    parser.add_argument('--opl-gain', metavar='GAIN', nargs=1, type=float, default=(1.0,),
+                        help='OPL output gain when mixing (default: 1.0)')
+    parser.add_argument('--opm-gain', metavar='GAIN', nargs=1, type=float, default=(1.0,),
+                        help='OPM output gain when mixing (default: 1.0)')
+    parser.add_argument('--cache', metavar='DIR', nargs=1,
+                        help='reuse renders stored in DIR, and store new renders there')
+    parser.add_argument('--cache-size', metavar='MB', nargs=1, type=float,
+                        help='evict the oldest renders when the cache exceeds MB megabytes')
+    parser.add_argument('--cache-max-age', metavar='DAYS', nargs=1, type=float,
+                        help='evict renders not used for DAYS days')
+    parser.add_argument('--stems', action='store_true',
+                        help='render one WAV file per channel of each input')
+    parser.add_argument('input', metavar='INPUT', nargs='+',
+                        help='input files or glob patterns')
+
+    args = parser.parse_args()
+    if args.stems and args.chip == 'mix':
+        parser.error('--stems cannot be used with --chip mix')
+
+    input_paths = expand_inputs(args.input)
+    try:
+        get_output_names(input_paths)
+    except ValueError as e:
+        parser.error(str(e))
+    output_dir = args.output_dir[0]
+    os.makedirs(output_dir, exist_ok=True)
+    workers = args.jobs[0] if args.jobs is not None else None
+
+    cache = None
+    if args.cache is not None:
+        max_size = int(args.cache_size[0] * 1000000) if args.cache_size is not None else None
+        max_age = args.cache_max_age[0] * 86400 if args.cache_max_age is not None else None
+        cache = RenderCache(args.cache[0], max_size, max_age)
+
+    output_rate = args.rate[0] if args.rate is not None else None
+    if args.chip == 'mix':
+        jobs = input_paths
+        results = render_mixed_batch(input_paths, output_dir, (args.opl_gain[0], args.opm_gain[0]), workers,
+                                     output_rate or 44100, args.format, cache)
+    else:
+        jobs = list(get_render_jobs(
+            input_paths, output_dir, args.chip, args.stems))
+        results = render_batch(jobs, workers, output_rate=output_rate,
+                               sample_format=args.format, cache=cache)
+
+    failures = 0
+    total_duration = 0
+    for result in results:
+        if result.error is not None:
+            failures += 1
+            print(f'{result.output_path}: FAILED ({result.error})')
+            continue
+        total_duration += result.duration
+        cached = ', cached' if result.cached else ''
+        print(f'{result.output_path}: {result.duration:.2f}s in {result.wall_time:.2f}s '
+              + f'({result.realtime_factor:.1f}x realtime{cached})')
+
+    print(f'Rendered {len(jobs) - failures} of {len(jobs)} files, '
+          + f'{total_duration:.2f}s of audio, {failures} failed')
+    if failures > 0:
+        sys.exit(1)
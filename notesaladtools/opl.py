@@ -1,8 +1,10 @@
 from io import BufferedWriter
-from threading import Lock
 import struct
 import time
 from .events import OPLWriteEvent
+from .pcm import open_pcm_output
+from .scheduler import PlaybackScheduler
+from .transport import LinkModel, SerialWriter
 from .utils import retrowave_7bit_encode
 
 reg_slot_map = {
@@ -76,31 +78,43 @@ def get_reg_channel(reg, op4=False):
     return reg & 0x0f
 
 
+def get_op_reg_channel(reg):
+    offset = reg & 0x1f
+    if offset > 0x15 or offset & 0x07 > 5:
+        return None
+    ch = ((offset >> 3) * 3) + ((offset & 0x07) % 3)
+    return ch + 9 if reg & 0x100 == 0x100 else ch
+
+
 class OPLController:
     def __init__(self, chip):
         self.chip = chip
         self.realtime = None if chip is None else chip.realtime
+        # Chips with several instances take the instance index above bit 9
+        # of the register number
+        self.instances = getattr(chip, 'instances', 1)
+        self.reg_mask = (self.instances << 9) - 1
         self.registers = []
         self._clear_registers()
 
     def _clear_registers(self):
         self.registers.clear()
-        for _ in range(0, 0x200):
+        for _ in range(0, 0x200 * self.instances):
             self.registers.append(None)
 
     def write_event(self, event):
-        if isinstance(event, OPLWriteEvent):
-            self.write(event.reg, event.value)
+        if isinstance(event, OPLWriteEvent) and event.chip < self.instances:
+            self.write(event.reg | (event.chip << 9), event.value)
 
     def write(self, reg, value):
-        reg = reg & 0x1ff
+        reg = reg & self.reg_mask
         if self.registers[reg] != value:
             if self.chip is not None:
                 self.chip.write(reg, value)
             self.registers[reg] = value
 
     def read(self, reg, default=None):
-        reg = reg & 0x1ff
+        reg = reg & self.reg_mask
         if self.registers[reg] is None:
             return default
         return self.registers[reg]
@@ -123,8 +137,9 @@ class OPLController:
             self.chip.close()
 
     def all_notes_off(self):
-        for ch in range(0, 18):
-            self.note_off(ch)
+        for instance in range(self.instances):
+            for ch in range(0, 18):
+                self.note_off(ch, instance)
 
     def note_on(self, ch, note):
         block, fnum = get_block_fnum(note)
@@ -133,12 +148,12 @@ class OPLController:
         self.write(0xb0 + reg_offset, ((fnum & 0x300) >> 8)
                    | ((block & 0x07) << 2) | 0x20)
 
-    def note_off(self, ch):
-        reg_offset = get_ch_reg_offset(ch)
-        value = self.read(0xb0 + reg_offset)
+    def note_off(self, ch, instance=0):
+        reg = (0xb0 + get_ch_reg_offset(ch)) | (instance << 9)
+        value = self.read(reg)
         if value is not None:
             value = value & ~0x20
-            self.write(0xb0 + reg_offset, value)
+            self.write(reg, value)
 
     def is_4op_ch(self, ch):
         if ch < 0 or ch > 5:
@@ -165,9 +180,10 @@ class OPLController:
 
 class OPLChip:
     realtime = True
+    instances = 1
 
     def __init__(self):
-        self.last_wait_time = None
+        self.scheduler = PlaybackScheduler()
 
     def write(self, reg, value):
         raise NotImplementedError()
@@ -178,17 +194,15 @@ class OPLChip:
     def wait(self, wait_time):
         self.flush()
         if wait_time > 0:
-            now = time.monotonic()
-            if self.last_wait_time is None:
-                self.last_wait_time = now
-            delay = (self.last_wait_time + wait_time) - now
-            if delay > 0:
-                time.sleep(delay)
-            self.last_wait_time = self.last_wait_time + wait_time
+            self.scheduler.wait(wait_time)
 
     def reset(self):
         raise NotImplementedError()
 
+    def get_stats(self):
+        # Counters read by playback telemetry
+        return {}
+
     def close(self):
         pass
 
@@ -200,82 +214,167 @@ class OPLChip:
 
 
 class OPLUSBSerial(OPLChip):
-    def __init__(self, device_path):
+    def __init__(self, device_path, baud=115200, queue_size=256):
         super().__init__()
         from serial import Serial
-        self.device = BufferedWriter(Serial(device_path, 115200))
+        self.device = BufferedWriter(Serial(device_path, baud))
+        self.link = LinkModel(baud)
+        self.writer = SerialWriter(self.device, queue_size)
+        self.scheduler = self.writer.scheduler
+        self.packet = bytearray()
 
     def write(self, reg, value):
         port = (reg & 0x100) >> 8
         reg = reg & 0xff
-        self.device.write(struct.pack('<BBB', port, reg, value))
+        self.packet.extend(struct.pack('<BBB', port, reg, value))
 
     def flush(self):
-        self.device.flush()
+        if len(self.packet) > 0:
+            self.writer.send(bytes(self.packet))
+            self.packet = bytearray()
 
-    def reset(self):
-        self.device.write(b'\xff\x00\x01')
+    def wait(self, wait_time):
         self.flush()
+        if wait_time > 0:
+            self.writer.advance(wait_time)
+
+    def reset(self):
+        self.packet = bytearray()
+        self.writer.clear()
+        self.writer.send_now(b'\xff\x00\x01')
+        self.writer.sync()
         time.sleep(0.1)
 
+    def get_stats(self):
+        return self.writer.get_stats()
+
     def close(self):
+        self.flush()
+        self.writer.close()
         self.device.close()
 
 
 class RetroWaveOPL3(OPLChip):
-    def __init__(self, device_path):
+    def __init__(self, device_path, baud=115200, queue_size=256):
         super().__init__()
         from serial import Serial
-        self.device = BufferedWriter(Serial(device_path, 115200))
+        self.device = BufferedWriter(Serial(device_path, baud))
+        # 6 bytes of SPI data per write, 7-bit encoded
+        self.link = LinkModel(baud, (6 * 8) / 7)
+        self.writer = SerialWriter(self.device, queue_size)
+        self.scheduler = self.writer.scheduler
         self.buffered_writes = []
 
     def write(self, reg, value):
         self.buffered_writes.append((reg, value))
 
     def flush(self):
-        data = bytearray()
+        if len(self.buffered_writes) == 0:
+            return
+
+        # The I/O expander alternates between its two GPIO registers for each
+        # byte of a transaction, so all the writes can share a single one
+        data = bytearray((0x42, 0x12))
         for reg, value in self.buffered_writes:
             port = (reg & 0x100) >> 8
             reg = reg & 0xff
             value = value & 0xff
             if port == 0:
-                data.extend((0x42, 0x12, 0xe1, reg, 0xe3, value, 0xfb, value))
+                data.extend((0xe1, reg, 0xe3, value, 0xfb, value))
             elif port == 1:
-                data.extend((0x42, 0x12, 0xe5, reg, 0xe7, value, 0xfb, value))
+                data.extend((0xe5, reg, 0xe7, value, 0xfb, value))
 
         self._spi_write(data)
         self.buffered_writes = []
 
-    def _spi_write(self, data):
+    def wait(self, wait_time):
+        self.flush()
+        if wait_time > 0:
+            self.writer.advance(wait_time)
+
+    def _spi_write(self, data, urgent=False):
         packet = bytearray()
         packet.append(0x00)
         packet.extend(retrowave_7bit_encode(data, True))
         packet.append(0x02)
-        self.device.write(packet)
-        self.device.flush()
+        if urgent:
+            self.writer.send_now(bytes(packet))
+        else:
+            self.writer.send(bytes(packet))
 
     def reset(self):
-        self._spi_write((0x42, 0x12, 0xfe))
-        self._spi_write((0x42, 0x12, 0xff))
+        self.writer.clear()
+        self._spi_write((0x42, 0x12, 0xfe), True)
+        self._spi_write((0x42, 0x12, 0xff), True)
         self.buffered_writes = []
 
+    def get_stats(self):
+        return self.writer.get_stats()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.device.close()
+
+
+class OPLEmulatorBank:
+    # Several emulator instances, each rendered on its own thread and mixed
+    # into one stream. Register numbers carry the instance index above bit 9.
+    def __init__(self, sample_rate, instances):
+        from concurrent.futures import ThreadPoolExecutor
+        from notesalad import opl
+        self.devices = [opl.OPLEmulator(sample_rate) for _ in range(instances)]
+        self.executor = ThreadPoolExecutor(instances)
+
+    def write(self, reg, value):
+        self.devices[reg >> 9].write(reg & 0x1ff, value)
+
+    def reset(self):
+        for device in self.devices:
+            device.reset()
+
+    def _render(self, device, length):
+        buffer = bytearray(length)
+        device.get_samples(buffer)
+        return buffer
+
+    def get_samples(self, buffer):
+        import numpy as np
+        buffers = list(self.executor.map(
+            self._render, self.devices, [len(buffer)] * len(self.devices)))
+        samples = np.frombuffer(b''.join(buffers), dtype='<i2').reshape(
+            len(self.devices), -1)
+        mix = samples.sum(axis=0, dtype=np.int32)
+        buffer[:] = np.clip(mix, -32768, 32767).astype('<i2').tobytes()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def open_opl_emulator(sample_rate, instances=1):
+    from notesalad import opl
+    if instances > 1:
+        return OPLEmulatorBank(sample_rate, instances)
+    return opl.OPLEmulator(sample_rate)
+
 
 class OPLWAV(OPLChip):
     realtime = False
 
-    def __init__(self, wav_path, sample_rate=49716):
+    def __init__(self, wav_path, sample_rate=49716, output_rate=None, sample_format='s16', raw=False,
+                 instances=1):
         super().__init__()
-        import wave
-        from notesalad import opl
+        # Rendered as fast as possible, so there is no playback timing to
+        # schedule
+        self.scheduler = None
         self.sample_rate = sample_rate
-        self.wav = wave.open(wav_path, 'wb')
-        self.wav.setnchannels(2)
-        self.wav.setsampwidth(2)
-        self.wav.setframerate(self.sample_rate)
-        self.opl_device = opl.OPLEmulator(self.sample_rate)
+        self.instances = instances
+        self.wav = open_pcm_output(
+            wav_path, self.sample_rate, output_rate, sample_format, raw)
+        self.opl_device = open_opl_emulator(self.sample_rate, instances)
 
     def write(self, reg, value):
-        reg = reg & 0x1ff
+        reg = reg & ((self.instances << 9) - 1)
         self.opl_device.write(reg, value)
 
     def wait(self, wait_time):
@@ -297,29 +396,35 @@ class OPLWAV(OPLChip):
 
     def close(self):
         self.wav.close()
+        if self.instances > 1:
+            self.opl_device.close()
 
 
 class OPLEmulator(OPLChip):
-    def __init__(self, sample_rate=44100):
+    def __init__(self, sample_rate=44100, latency=0.1, buffer_size=None, block_size=512, instances=1):
         super().__init__()
-        import pyaudio
-        from notesalad import opl
+        # Timed by the audio engine, which reports its own statistics
+        self.scheduler = None
+        from .audio import AudioEngine
         self.sample_rate = sample_rate
-        self.pyaudio = pyaudio
-        self.opl = opl
-        self._write_queue = []
-        self._queue_lock = Lock()
-        self.p = pyaudio.PyAudio()
-        self.opl_device = opl.OPLEmulator(self.sample_rate)
-        self.stream = self.p.open(format=pyaudio.paInt16, channels=2, rate=self.sample_rate,
-                                  output=True)
+        self.instances = instances
+        self.opl_device = open_opl_emulator(self.sample_rate, instances)
+        self.engine = AudioEngine(
+            self.opl_device, self.sample_rate, latency, buffer_size, block_size)
+
+    @property
+    def underruns(self):
+        return self.engine.underruns
+
+    def get_stats(self):
+        return self.engine.get_stats()
 
     def write(self, reg, value):
-        reg = reg & 0x1ff
-        self.opl_device.write(reg, value)
+        reg = reg & ((self.instances << 9) - 1)
+        self.engine.write(reg, value)
 
     def reset(self):
-        self.opl_device.reset()
+        self.engine.reset()
 
     def flush(self):
         pass
@@ -327,15 +432,9 @@ class OPLEmulator(OPLChip):
     def wait(self, wait_time):
         if wait_time <= 0:
             return
-        samples = round(wait_time * self.sample_rate)
-        while samples > 0:
-            buffersamples = min(samples, 11025)
-            buffer = bytearray(buffersamples * 4)
-            self.opl_device.get_samples(buffer)
-            self.stream.write(bytes(buffer))
-            samples -= buffersamples
+        self.engine.wait(wait_time)
 
     def close(self):
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        self.engine.close()
+        if self.instances > 1:
+            self.opl_device.close()
@@ -1,9 +1,9 @@
 from io import BufferedWriter
-from threading import Lock
 import struct
-import time
 
 from .events import OPMWriteEvent
+from .pcm import open_pcm_output
+from .transport import LinkModel, SerialWriter
 
 
 class OPMController:
@@ -76,6 +76,10 @@ class OPMChip:
     def reset(self):
         raise NotImplementedError()
 
+    def get_stats(self):
+        # Counters read by playback telemetry
+        return {}
+
     def close(self):
         pass
 
@@ -87,49 +91,52 @@ class OPMChip:
 
 
 class OPMUSBSerial(OPMChip):
-    def __init__(self, device_path):
+    def __init__(self, device_path, baud=115200, queue_size=256):
         from serial import Serial
-        self.device = BufferedWriter(Serial(device_path, 115200))
-        self.last_wait_time = None
+        self.device = BufferedWriter(Serial(device_path, baud))
+        self.link = LinkModel(baud)
+        self.writer = SerialWriter(self.device, queue_size)
+        self.scheduler = self.writer.scheduler
+        self.packet = bytearray()
 
     def write(self, reg, value):
         reg = reg & 0xff
         value = value & 0xff
-        self.device.write(struct.pack('<BBB', 0, reg, value))
+        self.packet.extend(struct.pack('<BBB', 0, reg, value))
 
     def flush(self):
-        self.device.flush()
+        if len(self.packet) > 0:
+            self.writer.send(bytes(self.packet))
+            self.packet = bytearray()
 
     def wait(self, wait_time):
         self.flush()
         if wait_time > 0:
-            now = time.monotonic()
-            if self.last_wait_time is None:
-                self.last_wait_time = now
-            delay = (self.last_wait_time + wait_time) - now
-            if delay > 0:
-                time.sleep(delay)
-            self.last_wait_time = self.last_wait_time + wait_time
+            self.writer.advance(wait_time)
 
     def reset(self):
-        self.device.write(b'\xff\x00\x01')
-        self.flush()
+        self.packet = bytearray()
+        self.writer.clear()
+        self.writer.send_now(b'\xff\x00\x01')
+        self.writer.sync()
+
+    def get_stats(self):
+        return self.writer.get_stats()
 
     def close(self):
+        self.flush()
+        self.writer.close()
         self.device.close()
 
 
 class OPMWAV(OPMChip):
     realtime = False
 
-    def __init__(self, wav_path, sample_rate=55930):
-        import wave
+    def __init__(self, wav_path, sample_rate=55930, output_rate=None, sample_format='s16', raw=False):
         from notesalad import opm
         self.sample_rate = sample_rate
-        self.wav = wave.open(wav_path, 'wb')
-        self.wav.setnchannels(2)
-        self.wav.setsampwidth(2)
-        self.wav.setframerate(self.sample_rate)
+        self.wav = open_pcm_output(
+            wav_path, self.sample_rate, output_rate, sample_format, raw)
         self.opm_device = opm.OPMEmulator(self.sample_rate)
 
     def write(self, reg, value):
@@ -158,25 +165,28 @@ class OPMWAV(OPMChip):
 
 
 class OPMEmulator(OPMChip):
-    def __init__(self, sample_rate=44100):
-        import pyaudio
+    def __init__(self, sample_rate=44100, latency=0.1, buffer_size=None, block_size=512):
         from notesalad import opm
+        from .audio import AudioEngine
         self.sample_rate = sample_rate
-        self.pyaudio = pyaudio
         self.opm = opm
-        self._write_queue = []
-        self._queue_lock = Lock()
-        self.p = pyaudio.PyAudio()
         self.opm_device = opm.OPMEmulator(self.sample_rate)
-        self.stream = self.p.open(format=pyaudio.paInt16, channels=2, rate=self.sample_rate,
-                                  output=True)
+        self.engine = AudioEngine(
+            self.opm_device, self.sample_rate, latency, buffer_size, block_size)
+
+    @property
+    def underruns(self):
+        return self.engine.underruns
+
+    def get_stats(self):
+        return self.engine.get_stats()
 
     def write(self, reg, value):
         reg = reg & 0x1ff
-        self.opm_device.write(reg, value)
+        self.engine.write(reg, value)
 
     def reset(self):
-        self.opm_device.reset()
+        self.engine.reset()
 
     def flush(self):
         pass
@@ -184,15 +194,7 @@ class OPMEmulator(OPMChip):
     def wait(self, wait_time):
         if wait_time <= 0:
             return
-        samples = round(wait_time * self.sample_rate)
-        while samples > 0:
-            buffersamples = min(samples, 11025)
-            buffer = bytearray(buffersamples * 4)
-            self.opm_device.get_samples(buffer)
-            self.stream.write(bytes(buffer))
-            samples -= buffersamples
+        self.engine.wait(wait_time)
 
     def close(self):
-        self.stream.stop_stream()
-        self.stream.close()
-        self.p.terminate()
+        self.engine.close()
@@ -1,8 +1,8 @@
 import os.path
-import gzip
 import struct
 from .utils import read_struct
 from .events import EndEvent, JumpToMarkerEvent, MarkerEvent, OPLWriteEvent, OPMWriteEvent
+from .vgmformat import VGMHeader, read_gd3_tag, vgm_header_struct
 
 
 class Parser:
@@ -10,10 +10,14 @@ class Parser:
         self.input_file = input_file
         self.time_base = None
         self.duration = None
+        self.opl_chips = 1
 
     def read_events(self):
         raise NotImplementedError()
 
+    def read_gd3_tag(self):
+        return None
+
     def close(self):
         pass
 
@@ -80,21 +84,25 @@ class VGMParser(Parser):
         self._read_header()
 
     def _read_header(self):
-        vgm_header = read_struct(self.input_file, '<4sIIIIIIII', 'ident', 'end_offset', 'ver',
-                                 'sn76489clock', 'ym2413clock', 'gd3_offset', 'total_samples', 'loop_offset',
-                                 'loop_samples')
-
-        if vgm_header['ver'] < 0x150:
+        self.header = VGMHeader.unpack(self.input_file.read(vgm_header_struct.size))
+        if self.header.ident != b'Vgm ':
+            raise Exception('Not a VGM file')
+        if self.header.version < 0x150:
             raise Exception('Unsupported VGM version')
 
-        self.input_file.seek(0x34)
-        self._vgm_offset = read_struct(self.input_file, '<I', 'vgm_offset')[
-            'vgm_offset'] + 0x34
-        self._end_offset = vgm_header['end_offset'] + 4
-        self.duration = vgm_header['total_samples']
-        self._has_loop = vgm_header['loop_offset'] != 0 and vgm_header['loop_samples'] != 0
-        self._loop_offset = vgm_header['loop_offset'] + 0x1c
-        self._loop_samples = vgm_header['loop_samples']
+        self._vgm_offset = self.header.vgm_data_offset + 0x34
+        self._end_offset = self.header.eof_offset + 4
+        self.duration = self.header.total_samples
+        self._has_loop = self.header.loop_offset != 0 and self.header.loop_samples != 0
+        self._loop_offset = self.header.loop_offset + 0x1c
+        self._loop_samples = self.header.loop_samples
+
+        # Bit 30 of a chip's clock marks a second chip of the same type
+        if self.header.version >= 0x151 and (self.header.ym3812_clock | self.header.ymf262_clock) & 0x40000000:
+            self.opl_chips = 2
+
+    def read_gd3_tag(self):
+        return read_gd3_tag(self.input_file, self.header)
 
     def read_events(self):
         self.input_file.seek(self._vgm_offset)
@@ -120,6 +128,14 @@ class VGMParser(Parser):
                 reg = self.input_file.read(1)[0] | 0x100
                 value = self.input_file.read(1)[0]
                 yield OPLWriteEvent(cur_time, reg, value)
+            elif cmd in (0xaa, 0xae):
+                reg = self.input_file.read(1)[0]
+                value = self.input_file.read(1)[0]
+                yield OPLWriteEvent(cur_time, reg, value, 1)
+            elif cmd == 0xaf:
+                reg = self.input_file.read(1)[0] | 0x100
+                value = self.input_file.read(1)[0]
+                yield OPLWriteEvent(cur_time, reg, value, 1)
             elif cmd == 0x54:
                 reg = self.input_file.read(1)[0]
                 value = self.input_file.read(1)[0]
@@ -183,35 +199,42 @@ class RADParser(Parser):
 
 
 class OPL3MIDIParser(Parser):
-    def __init__(self, input_file):
+    def __init__(self, input_file, chips=1):
         super().__init__(input_file)
         self._event_queue = []
         self._current_time = 0
         self.duration = 0
         self.time_base = 1000
+        self.opl_chips = chips
 
-        def write_cbk(reg, value):
+        def write_cbk(chip, reg, value):
             self._event_queue.append(OPLWriteEvent(
-                self._current_time, reg, value))
+                self._current_time, reg, value, chip))
         import mido
         import notesalad.opl
+        from .midi import VoiceSpreader
         self._midi_file = mido.MidiFile(input_file)
-        self._midi_impl = notesalad.opl.OPL3MIDI(
-            notesalad.opl.OPLCallbackDevice(write_cbk, None))
+        self._midi_impls = [notesalad.opl.OPL3MIDI(notesalad.opl.OPLCallbackDevice(
+            lambda reg, value, chip=chip: write_cbk(chip, reg, value), None)) for chip in range(chips)]
+        self._spreader = VoiceSpreader(chips)
 
     def read_events(self):
-        yield OPLWriteEvent(0, 0x105, 0x01)
+        for chip in range(self.opl_chips):
+            yield OPLWriteEvent(0, 0x105, 0x01, chip)
         event_time = 0
         for msg in self._midi_file:
             event_time = event_time + (msg.time * 1000)
             while self._current_time < event_time:
-                self._midi_impl.set_time(self._current_time)
-                self._midi_impl.update()
+                for midi_impl in self._midi_impls:
+                    midi_impl.set_time(self._current_time)
+                    midi_impl.update()
                 self._current_time = self._current_time + 1
             if msg.is_meta:
                 continue
             if self._filter_midi(msg):
-                self._midi_impl.send(msg.bin())
+                data = msg.bin()
+                for chip in self._spreader.route(msg):
+                    self._midi_impls[chip].send(data)
             for event in self._event_queue:
                 yield event
             self._event_queue.clear()
@@ -242,7 +265,7 @@ class OPL3RawParser(Parser):
                 yield MarkerEvent(current_time, value)
 
 
-def open_parser(path):
+def open_parser(path, midi_chips=1):
     (_, ext) = os.path.splitext(path)
     ext = ext.lower()
     if ext == '.dro':
@@ -250,11 +273,13 @@ def open_parser(path):
     if ext == '.vgm':
         return VGMParser(open(path, 'rb'))
     if ext == '.vgz':
+        # Imported only when needed, to keep startup fast for other formats
+        import gzip
         return VGMParser(gzip.open(path))
     if ext == '.rad':
         return RADParser(open(path, 'rb'))
     if ext == '.mid':
-        return OPL3MIDIParser(path)
+        return OPL3MIDIParser(path, midi_chips)
     if ext == '.opl3raw':
         return OPL3RawParser(open(path, 'rb'))
     return None
@@ -0,0 +1,165 @@
+from math import gcd
+import struct
+import sys
+
+sample_formats = ('s16', 'f32')
+
+
+class Resampler:
+    def __init__(self, src_rate, dest_rate, channels=2, taps=32, rolloff=0.95):
+        import numpy as np
+        self.np = np
+        divisor = gcd(src_rate, dest_rate)
+        self.up = dest_rate // divisor
+        self.down = src_rate // divisor
+        self.channels = channels
+        self.taps = taps
+
+        # Windowed sinc low pass filter at the upsampled rate, split into one
+        # set of taps per phase
+        length = taps * self.up
+        cutoff = min(1.0, self.up / self.down) * rolloff
+        n = np.arange(length) - ((length - 1) / 2)
+        kernel = cutoff * np.sinc(cutoff * n / self.up) * \
+            np.kaiser(length, 8.6)
+        self.phases = kernel.reshape(taps, self.up).T.astype(np.float32)
+        self.phases /= self.phases.sum(axis=1, keepdims=True)
+        self.delay = length // 2
+
+        self._buffer = np.zeros((taps - 1, channels), dtype=np.float32)
+        self._buffer_start = -(taps - 1)
+        self._tap_offsets = np.arange(taps)
+        self._in_count = 0
+        self._out_count = 0
+
+    def process(self, samples):
+        np = self.np
+        self._buffer = np.concatenate((self._buffer, samples))
+        self._in_count += len(samples)
+        end = self._buffer_start + len(self._buffer)
+        return self._render(-((self.delay - (end * self.up)) // self.down))
+
+    def flush(self):
+        np = self.np
+        self._buffer = np.concatenate(
+            (self._buffer, np.zeros((self.taps, self.channels), dtype=np.float32)))
+        return self._render(-((-self._in_count * self.up) // self.down))
+
+    def _render(self, out_end):
+        np = self.np
+        if out_end <= self._out_count:
+            return np.zeros((0, self.channels), dtype=np.float32)
+
+        positions = (np.arange(self._out_count, out_end, dtype=np.int64)
+                     * self.down) + self.delay
+        phases = positions % self.up
+        indices = (positions // self.up) - self._buffer_start
+        indices = indices[:, None] - self._tap_offsets[None, :]
+        output = np.einsum('nk,nkc->nc', self.phases[phases],
+                           self._buffer[indices])
+        self._out_count = out_end
+
+        # Discard input that no later output depends on
+        next_index = ((self._out_count * self.down) + self.delay) // self.up
+        discard = max(0, next_index - (self.taps - 1) - self._buffer_start)
+        self._buffer = self._buffer[discard:]
+        self._buffer_start += discard
+        return output
+
+
+class WAVWriter:
+    def __init__(self, output_file, sample_rate, channels=2, sample_format='s16'):
+        self.output_file = output_file
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.sample_width = 4 if sample_format == 'f32' else 2
+        self.data_size = 0
+        self._write_header()
+
+    def _write_header(self):
+        block_align = self.channels * self.sample_width
+        frames = self.data_size // block_align
+        if self.sample_format == 'f32':
+            fmt = struct.pack('<HHIIHHH', 3, self.channels, self.sample_rate,
+                              self.sample_rate * block_align, block_align, 32, 0)
+            extra = b'fact' + struct.pack('<II', 4, frames)
+        else:
+            fmt = struct.pack('<HHIIHH', 1, self.channels, self.sample_rate,
+                              self.sample_rate * block_align, block_align, 16)
+            extra = b''
+        header = b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt + extra + \
+            b'data' + struct.pack('<I', self.data_size)
+        self.output_file.write(
+            b'RIFF' + struct.pack('<I', len(header) + self.data_size) + header)
+
+    def writeframes(self, data):
+        self.output_file.write(data)
+        self.data_size += len(data)
+
+    def close(self):
+        self.output_file.seek(0)
+        self._write_header()
+        self.output_file.close()
+
+
+class RawWriter:
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def writeframes(self, data):
+        self.output_file.write(data)
+
+    def close(self):
+        if self.output_file is sys.stdout.buffer:
+            self.output_file.flush()
+        else:
+            self.output_file.close()
+
+
+class PCMOutput:
+    def __init__(self, writer, sample_rate, output_rate=None, sample_format='s16'):
+        self.writer = writer
+        self.sample_format = sample_format
+        self.resampler = None
+        if output_rate is not None and output_rate != sample_rate:
+            self.resampler = Resampler(sample_rate, output_rate)
+
+    def writeframes(self, data):
+        if self.resampler is None and self.sample_format == 's16':
+            self.writer.writeframes(data)
+            return
+
+        import numpy as np
+        samples = np.frombuffer(data, dtype='<i2').reshape(-1, 2)
+        samples = samples.astype(np.float32) / 32768
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        self.write_samples(samples)
+
+    def write_samples(self, samples):
+        import numpy as np
+        if self.sample_format == 'f32':
+            data = samples.astype('<f4')
+        else:
+            data = np.clip(np.round(samples * 32768),
+                           -32768, 32767).astype('<i2')
+        self.writer.writeframes(data.tobytes())
+
+    def close(self):
+        if self.resampler is not None:
+            self.write_samples(self.resampler.flush())
+        self.writer.close()
+
+
+def open_pcm_output(path, sample_rate, output_rate=None, sample_format='s16', raw=False):
+    if sample_format not in sample_formats:
+        raise ValueError('Invalid sample format')
+    if path == '-':
+        writer = RawWriter(sys.stdout.buffer)
+    elif raw:
+        writer = RawWriter(open(path, 'wb'))
+    else:
+        writer = WAVWriter(open(path, 'wb'), output_rate or sample_rate,
+                           sample_format=sample_format)
+    return PCMOutput(writer, sample_rate, output_rate, sample_format)
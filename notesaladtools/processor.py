@@ -2,6 +2,14 @@ from copy import copy
 
 from notesaladtools.utils import convert_time_base
 from .events import EndEvent, JumpToMarkerEvent, MarkerEvent, OPLWriteEvent, OPMWriteEvent
+from .opl import get_op_reg_channel, get_reg_channel
+
+opl_global_regs = (0x01, 0x08, 0xbd, 0x104, 0x105)
+
+
+def get_opl_reg_key(event):
+    # Registers of each chip are kept apart by the chip index above bit 9
+    return event.reg | (event.chip << 9)
 
 
 class RegBuffer:
@@ -11,17 +19,18 @@ class RegBuffer:
 
     def update(self, event):
         if isinstance(event, OPLWriteEvent):
-            self.opl_registers[event.reg] = event.value
+            self.opl_registers[get_opl_reg_key(event)] = event.value
         elif isinstance(event, OPMWriteEvent):
             self.opm_registers[event.reg] = event.value
 
     def set_opl_registers(self, time):
-        if 0x105 in self.opl_registers:
-            yield OPLWriteEvent(time, 0x105, self.opl_registers[0x105])
+        for reg, value in self.opl_registers.items():
+            if reg & 0x1ff == 0x105:
+                yield OPLWriteEvent(time, 0x105, value, reg >> 9)
 
         for reg, value in self.opl_registers.items():
-            if reg != 0x105:
-                yield OPLWriteEvent(time, reg, value)
+            if reg & 0x1ff != 0x105:
+                yield OPLWriteEvent(time, reg, value, reg >> 9)
 
     def set_opm_registers(self, time):
         for reg, value in self.opm_registers.items():
@@ -56,7 +65,7 @@ def is_key_on(event):
 
 def set_key_off(event):
     if is_opl_key_on(event):
-        return OPLWriteEvent(event.time, event.reg, event.value & ~0x20)
+        return OPLWriteEvent(event.time, event.reg, event.value & ~0x20, event.chip)
     if is_opm_key_on(event):
         return OPMWriteEvent(event.time, event.reg, event.value & 0x07)
     return event
@@ -67,7 +76,7 @@ def optimise(events):
 
     for event in events:
         if isinstance(event, OPLWriteEvent):
-            if reg_buffer.opl_registers.get(event.reg, None) != event.value:
+            if reg_buffer.opl_registers.get(get_opl_reg_key(event), None) != event.value:
                 yield event
         elif isinstance(event, OPMWriteEvent):
             if reg_buffer.opm_registers.get(event.reg, None) != event.value:
@@ -142,11 +151,14 @@ def add_key_off(events):
 
     # OPL
     if uses_opl:
-        for reg_base in range(0xb0, 0xb9):
-            for reg in (reg_base, 0x100 | reg_base):
-                if reg in reg_buffer.opl_registers:
-                    value = reg_buffer.opl_registers[reg] & 0x1f
-                    yield OPLWriteEvent(end_time, reg, value)
+        chips = sorted(set(reg >> 9 for reg in reg_buffer.opl_registers))
+        for chip in chips:
+            for reg_base in range(0xb0, 0xb9):
+                for reg in (reg_base, 0x100 | reg_base):
+                    key = reg | (chip << 9)
+                    if key in reg_buffer.opl_registers:
+                        value = reg_buffer.opl_registers[key] & 0x1f
+                        yield OPLWriteEvent(end_time, reg, value, chip)
 
     # OPM
     if uses_opm:
@@ -187,3 +199,43 @@ def convert_event_times(events, src_time_base, dest_time_base):
         new_event.time = convert_time_base(
             event.time, src_time_base, dest_time_base)
         yield new_event
+
+
+def get_opl_write_channel(reg):
+    reg8 = reg & 0xff
+    if 0xa0 <= reg8 <= 0xc8:
+        return get_reg_channel(reg)
+    if 0x20 <= reg8 <= 0x95 or 0xe0 <= reg8 <= 0xf5:
+        return get_op_reg_channel(reg)
+    return None
+
+
+def filter_opl_channel(events, ch):
+    # Writes to the second channel of a 4-op pair also go to the first
+    # channel's stem. Its key on bits are ignored by the chip when the pair is
+    # in 4-op mode, so only those are excluded.
+    pair_ch = ch + 3 if ch % 9 < 3 else None
+    for event in events:
+        if isinstance(event, OPLWriteEvent):
+            if event.reg in opl_global_regs:
+                yield event
+                continue
+            event_ch = get_opl_write_channel(event.reg)
+            if event_ch == ch:
+                yield event
+            elif event_ch == pair_ch and event_ch is not None and not 0xb0 <= (event.reg & 0xff) <= 0xb8:
+                yield event
+        elif not isinstance(event, OPMWriteEvent):
+            yield event
+
+
+def filter_opm_channel(events, ch):
+    for event in events:
+        if isinstance(event, OPMWriteEvent):
+            if event.reg == 0x08:
+                if event.value & 0x07 == ch:
+                    yield event
+            elif event.reg < 0x20 or event.reg & 0x07 == ch:
+                yield event
+        elif not isinstance(event, OPLWriteEvent):
+            yield event
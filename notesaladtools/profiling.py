@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss():
+    # Peak resident set size of the process in bytes, where available
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageStats:
+    def __init__(self, name, upstream=None):
+        self.name = name
+        self.upstream = upstream
+        self.events_out = 0
+        # Time spent in this stage and the stages it pulls events from
+        self.inclusive_time = 0
+        self.peak_rss = None
+
+    @property
+    def events_in(self):
+        return None if self.upstream is None else self.upstream.events_out
+
+    @property
+    def time(self):
+        upstream_time = 0 if self.upstream is None else self.upstream.inclusive_time
+        return max(0, self.inclusive_time - upstream_time)
+
+    def get_dict(self):
+        return {'name': self.name, 'events_in': self.events_in, 'events_out': self.events_out,
+                'time': self.time, 'inclusive_time': self.inclusive_time, 'peak_rss': self.peak_rss}
+
+
+class PipelineProfile:
+    # Counts events and time for each stage of an event pipeline. Stages are
+    # generators pulling events from the previous stage, so each stage's own
+    # time is what remains after subtracting the time of the stage before it.
+    # When disabled, stages are returned unwrapped and cost nothing.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+        self._last_stage = None
+        self.start_time = time.perf_counter()
+
+    def stage(self, name, events):
+        if not self.enabled:
+            return events
+        stats = StageStats(name, self._last_stage)
+        self.stages.append(stats)
+        self._last_stage = stats
+        return self._run_stage(stats, events)
+
+    @staticmethod
+    def _run_stage(stats, events):
+        perf_counter = time.perf_counter
+        iterator = iter(events)
+        elapsed = 0
+        count = 0
+        try:
+            while True:
+                start_time = perf_counter()
+                try:
+                    event = next(iterator)
+                except StopIteration:
+                    elapsed += perf_counter() - start_time
+                    break
+                elapsed += perf_counter() - start_time
+                count += 1
+                yield event
+        finally:
+            stats.inclusive_time += elapsed
+            stats.events_out += count
+            stats.peak_rss = get_peak_rss()
+
+    def sink(self, name, events):
+        # The final consumer of the pipeline. Its time runs from the first
+        # event requested to the last, including the time of the stages
+        # before it.
+        if not self.enabled:
+            return events
+        stats = StageStats(name, self._last_stage)
+        self.stages.append(stats)
+        self._last_stage = None
+        return self._run_sink(stats, events)
+
+    @staticmethod
+    def _run_sink(stats, events):
+        start_time = time.perf_counter()
+        count = 0
+        try:
+            for event in events:
+                count += 1
+                yield event
+        finally:
+            stats.inclusive_time += time.perf_counter() - start_time
+            stats.events_out += count
+            stats.peak_rss = get_peak_rss()
+
+    @contextmanager
+    def section(self, name):
+        # A step outside the event pipeline
+        if not self.enabled:
+            yield
+            return
+        stats = StageStats(name)
+        stats.events_out = None
+        self.stages.append(stats)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.inclusive_time += time.perf_counter() - start_time
+            stats.peak_rss = get_peak_rss()
+
+    def closing(self, name, resource_obj):
+        # Use in place of a resource in a with statement to time its close
+        if not self.enabled:
+            return resource_obj
+        return self._closing(name, resource_obj)
+
+    @contextmanager
+    def _closing(self, name, resource_obj):
+        try:
+            yield resource_obj
+        finally:
+            with self.section(name):
+                resource_obj.close()
+
+    def get_dict(self):
+        return {'wall_time': time.perf_counter() - self.start_time, 'peak_rss': get_peak_rss(),
+                'stages': [stats.get_dict() for stats in self.stages]}
+
+    def print_table(self, output=None):
+        if output is None:
+            output = sys.stderr
+        wall_time = time.perf_counter() - self.start_time
+        print(f'{"Stage":<24} {"Events in":>10} {"Events out":>10} {"Time (s)":>9} {"Time %":>7} '
+              + f'{"Events/s":>11} {"Peak RSS (MB)":>14}', file=output)
+        for stats in self.stages:
+            events_in = '-' if stats.events_in is None else str(stats.events_in)
+            events_out = '-' if stats.events_out is None else str(stats.events_out)
+            events = stats.events_out if stats.events_in is None else stats.events_in
+            rate = f'{events / stats.time:.0f}' if stats.time > 0 and events else '-'
+            percent = stats.time * 100 / wall_time if wall_time > 0 else 0
+            peak_rss = '-' if stats.peak_rss is None else f'{stats.peak_rss / 1000000:.1f}'
+            print(f'{stats.name:<24} {events_in:>10} {events_out:>10} {stats.time:>9.3f} {percent:>6.1f}% '
+                  + f'{rate:>11} {peak_rss:>14}', file=output)
+        print(f'{"Total":<24} {"":>10} {"":>10} {wall_time:>9.3f}', file=output)
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump(self.get_dict(), output, indent=2)
+            output.write('\n')
+
+    def report(self, json_path=None, table=True):
+        if not self.enabled:
+            return
+        if table:
+            self.print_table()
+        if json_path is not None:
+            self.write_json(json_path)
@@ -0,0 +1,230 @@
+from collections import Counter
+import os
+import time
+
+from .devices import get_device
+from .parser import open_parser
+from .pcm import open_pcm_output
+from .processor import filter_opl_channel, filter_opm_channel
+
+channel_counts = {'opl': 18, 'opm': 8}
+channel_filters = {'opl': filter_opl_channel, 'opm': filter_opm_channel}
+mix_chip_types = ('opl', 'opm')
+
+
+def play(vgmparser, chip, events=None):
+    if events is None:
+        events = vgmparser.read_events()
+
+    chip.reset()
+
+    # Wait once per group of events sharing a timestamp
+    last_event_time = 0
+    for event in events:
+        if event.time != last_event_time:
+            chip.wait((event.time - last_event_time) / vgmparser.time_base)
+            last_event_time = event.time
+        chip.write_event(event)
+
+    chip.wait((vgmparser.duration - last_event_time) /
+              vgmparser.time_base)
+
+    chip.all_notes_off()
+
+
+class RenderResult:
+    def __init__(self, input_path, output_path):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.duration = 0
+        self.wall_time = 0
+        self.error = None
+        self.cached = False
+
+    @property
+    def realtime_factor(self):
+        if self.wall_time <= 0:
+            return 0
+        return self.duration / self.wall_time
+
+
+def open_input(input_path):
+    vgmparser = open_parser(input_path)
+    if vgmparser is None:
+        raise ValueError('Unsupported file type')
+    return vgmparser
+
+
+def get_events(vgmparser, chip_type, channel=None):
+    events = vgmparser.read_events()
+    if channel is not None:
+        events = channel_filters[chip_type](events, channel)
+    return events
+
+
+def render_file(input_path, output_path, chip_type='opl', channel=None, output_rate=None, sample_format='s16',
+                raw=False, cache=None):
+    result = RenderResult(input_path, output_path)
+    start_time = time.perf_counter()
+    try:
+        cache_key = None
+        if cache is not None and output_path != '-':
+            # Some parsers can only be read once, so hash the events using a
+            # separate parser
+            with open_input(input_path) as vgmparser:
+                cache_key = cache.get_key(get_events(vgmparser, chip_type, channel),
+                                          (chip_type, channel, output_rate, sample_format, raw, vgmparser.time_base,
+                                           vgmparser.duration))
+                if cache.fetch(cache_key, output_path):
+                    result.duration = vgmparser.duration / vgmparser.time_base
+                    result.cached = True
+                    result.wall_time = time.perf_counter() - start_time
+                    return result
+
+        vgmparser = open_input(input_path)
+        device_name = f'{chip_type}{"raw" if raw else "wav"}:{output_path}'
+        with vgmparser, get_device(device_name, output_rate, sample_format,
+                                   opl_instances=vgmparser.opl_chips) as chip:
+            play(vgmparser, chip, get_events(vgmparser, chip_type, channel))
+            result.duration = vgmparser.duration / vgmparser.time_base
+
+        if cache_key is not None:
+            cache.store(cache_key, output_path)
+    except Exception as e:  # pylint: disable=broad-except
+        result.error = str(e) or type(e).__name__
+    result.wall_time = time.perf_counter() - start_time
+    return result
+
+
+def _init_worker():
+    # Import the emulator bindings once per worker process rather than once
+    # per rendered file
+    # pylint: disable=import-outside-toplevel,unused-import
+    try:
+        from notesalad import opl, opm
+    except ImportError:
+        pass
+
+
+def get_output_names(input_paths):
+    # Output names without a suffix, keeping the directories below the
+    # inputs' common parent so files from different directories don't
+    # overwrite each other. Inputs that would still share a name, such as
+    # song.vgm and song.vgz, keep their extension in it.
+    paths = [os.path.abspath(input_path) for input_path in input_paths]
+    if len(paths) == 0:
+        return []
+    parent = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = [os.path.splitext(os.path.relpath(path, parent))[0] for path in paths]
+    counts = Counter(os.path.normcase(name) for name in names)
+    names = [name + '_' + os.path.splitext(path)[1][1:] if counts[os.path.normcase(name)] > 1 else name
+             for (name, path) in zip(names, paths)]
+
+    seen = set()
+    for (name, input_path) in zip(names, input_paths):
+        if os.path.normcase(name) in seen:
+            raise ValueError(f'{input_path}: another input would be rendered to the same file')
+        seen.add(os.path.normcase(name))
+    return names
+
+
+def get_output_path(name, output_dir, suffix='.wav'):
+    output_path = os.path.join(output_dir, name + suffix)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    return output_path
+
+
+def get_render_jobs(input_paths, output_dir, chip_type='opl', stems=False):
+    for (input_path, name) in zip(input_paths, get_output_names(input_paths)):
+        if not stems:
+            yield (input_path, get_output_path(name, output_dir), chip_type)
+            continue
+        for ch in range(0, channel_counts[chip_type]):
+            output_path = get_output_path(
+                name, output_dir, f'_ch{ch + 1:02d}.wav')
+            yield (input_path, output_path, chip_type, ch)
+
+
+def render_batch(jobs, workers=None, **kwargs):
+    # Imported here, as nsplay only uses this module for play
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(render_file, *job, **kwargs) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def mix_renders(part_results, gains, output_path, output_rate, sample_format='s16', block_size=65536):
+    result = RenderResult(part_results[0].input_path, output_path)
+    start_time = time.perf_counter()
+    try:
+        for part_result in part_results:
+            if part_result.error is not None:
+                raise RuntimeError(part_result.error)
+
+        import numpy as np
+
+        parts = []
+        for part_result in part_results:
+            if os.path.getsize(part_result.output_path) == 0:
+                parts.append(np.zeros((0, 2), dtype=np.float32))
+            else:
+                parts.append(np.memmap(part_result.output_path,
+                             dtype='<f4', mode='r').reshape(-1, 2))
+
+        length = max(len(part) for part in parts)
+        output = open_pcm_output(
+            output_path, output_rate, sample_format=sample_format)
+        for start in range(0, length, block_size):
+            block = np.zeros(
+                (min(block_size, length - start), 2), dtype=np.float32)
+            for part, gain in zip(parts, gains):
+                chunk = part[start:start + block_size]
+                block[:len(chunk)] += chunk * gain
+            output.write_samples(block)
+        output.close()
+        result.duration = max(
+            part_result.duration for part_result in part_results)
+    except Exception as e:  # pylint: disable=broad-except
+        result.error = str(e) or type(e).__name__
+    finally:
+        for part_result in part_results:
+            if os.path.exists(part_result.output_path):
+                os.remove(part_result.output_path)
+
+    # Parts are rendered concurrently, so only the slowest one adds to the
+    # time taken
+    result.wall_time = max(part_result.wall_time for part_result in part_results) + \
+        time.perf_counter() - start_time
+    return result
+
+
+def render_mixed_batch(input_paths, output_dir, gains=(1.0, 1.0), workers=None, output_rate=44100,
+                       sample_format='s16', cache=None):
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        pending = set()
+        parts = {}
+        for (input_path, name) in zip(input_paths, get_output_names(input_paths)):
+            output_path = get_output_path(name, output_dir)
+            parts[output_path] = {}
+            for chip_type in mix_chip_types:
+                future = executor.submit(render_file, input_path, f'{output_path}.{chip_type}.tmp', chip_type,
+                                         output_rate=output_rate, sample_format='f32', raw=True, cache=cache)
+                future.mix_part = (output_path, chip_type)
+                pending.add(future)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not hasattr(future, 'mix_part'):
+                    yield future.result()
+                    continue
+                (output_path, chip_type) = future.mix_part
+                parts[output_path][chip_type] = future.result()
+                if len(parts[output_path]) == len(mix_chip_types):
+                    part_results = [parts[output_path][chip_type]
+                                    for chip_type in mix_chip_types]
+                    del parts[output_path]
+                    pending.add(executor.submit(mix_renders, part_results, gains, output_path, output_rate,
+                                                sample_format))
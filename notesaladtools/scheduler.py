@@ -0,0 +1,57 @@
+from array import array
+import time
+
+
+class PlaybackScheduler:
+    def __init__(self, spin_time=0.002, max_lateness=0.05):
+        self.spin_time_ns = round(spin_time * 1000000000)
+        self.max_lateness_ns = round(max_lateness * 1000000000)
+        self.lateness = array('q')
+        self._origin = None
+        self._time = 0
+
+    def wait(self, wait_time, cancel=None):
+        # Returns False if the cancel event was set before the deadline
+        now = time.perf_counter_ns()
+        if self._origin is None:
+            self._origin = now
+        self._time = self._time + round(wait_time * 1000000000)
+        deadline = self._origin + self._time
+
+        # Sleep until shortly before the deadline, then spin for the rest, as
+        # sleeps alone can overshoot by more than the OS timer granularity
+        remaining = deadline - now
+        if remaining > self.spin_time_ns:
+            sleep_time = (remaining - self.spin_time_ns) / 1000000000
+            if cancel is None:
+                time.sleep(sleep_time)
+            elif cancel.wait(sleep_time):
+                return False
+        now = time.perf_counter_ns()
+        while now < deadline:
+            now = time.perf_counter_ns()
+
+        lateness = now - deadline
+        self.lateness.append(lateness)
+        if lateness > self.max_lateness_ns:
+            # Too late to catch up without audibly rushing the following
+            # events, so move the timeline instead
+            self._origin = self._origin + lateness
+        return True
+
+    def restart(self):
+        # Start a new timeline from the next wait
+        self._origin = None
+        self._time = 0
+
+    def get_stats(self):
+        count = len(self.lateness)
+        if count == 0:
+            return {'count': 0, 'mean': 0, 'p99': 0, 'max': 0}
+        ordered = sorted(self.lateness)
+        return {
+            'count': count,
+            'mean': sum(ordered) / count / 1000000000,
+            'p99': ordered[min(count - 1, (count * 99) // 100)] / 1000000000,
+            'max': ordered[-1] / 1000000000
+        }
@@ -0,0 +1,134 @@
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+from .events import OPLWriteEvent, OPMWriteEvent
+
+telemetry_fields = ('time', 'position', 'writes', 'write_rate', 'late_events', 'lateness_mean', 'lateness_max',
+                    'buffer_fill', 'buffered_ms', 'underruns', 'queue_depth', 'bytes_per_second', 'total_stall')
+
+
+class TelemetryLog:
+    # Writes samples as CSV or JSON Lines, chosen by the file extension
+    def __init__(self, path):
+        self.output_file = open(path, 'w', encoding='utf-8', newline='')
+        self.jsonl = os.path.splitext(path)[1].lower() in ('.jsonl', '.json')
+        self.csv_writer = None
+        if not self.jsonl:
+            self.csv_writer = csv.DictWriter(self.output_file, telemetry_fields, lineterminator='\n')
+            self.csv_writer.writeheader()
+
+    def write(self, sample):
+        if self.jsonl:
+            self.output_file.write(json.dumps(sample, separators=(',', ':')) + '\n')
+        else:
+            self.csv_writer.writerow(sample)
+
+    def close(self):
+        self.output_file.close()
+
+
+class PlaybackTelemetry:
+    # Samples playback from a separate thread, so nothing is added to the
+    # output path beyond counting the events handed to the player. Lateness
+    # comes from the chip's scheduler; buffer and queue figures come from the
+    # chip's get_stats.
+    def __init__(self, chip, time_base, interval=0.1, log_path=None, status=False, late_threshold=0.001):
+        self.chip = chip
+        self.time_base = time_base
+        self.interval = interval
+        self.status = status
+        self.late_threshold_ns = late_threshold * 1000000000
+        self.log = None if log_path is None else TelemetryLog(log_path)
+        self.position = 0
+        self.writes = 0
+        self._scheduler = getattr(chip, 'scheduler', None)
+        self._get_stats = getattr(chip, 'get_stats', None)
+        self._lateness_index = 0
+        self._last_writes = 0
+        self._last_bytes = 0
+        self._last_time = None
+        self._start_time = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def track(self, events):
+        for event in events:
+            self.position = event.time
+            if type(event) in (OPLWriteEvent, OPMWriteEvent):
+                self.writes += 1
+            yield event
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._last_time = self._start_time
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._take_sample()
+
+    def _take_sample(self):
+        now = time.perf_counter()
+        elapsed = now - self._last_time
+        self._last_time = now
+        writes = self.writes
+        sample = {'time': round(now - self._start_time, 3), 'position': round(self.position / self.time_base, 3),
+                  'writes': writes,
+                  'write_rate': round((writes - self._last_writes) / elapsed) if elapsed > 0 else 0}
+        self._last_writes = writes
+
+        if self._scheduler is not None:
+            # Lateness of each group of writes output since the last sample
+            lateness = self._scheduler.lateness
+            end = len(lateness)
+            recent = lateness[self._lateness_index:end]
+            self._lateness_index = end
+            if len(recent) > 0:
+                sample['late_events'] = sum(1 for value in recent if value > self.late_threshold_ns)
+                sample['lateness_mean'] = round(sum(recent) / len(recent) / 1000000, 3)
+                sample['lateness_max'] = round(max(recent) / 1000000, 3)
+
+        stats = self._get_stats() if self._get_stats is not None else {}
+        if 'buffered_samples' in stats:
+            sample['buffer_fill'] = round(stats['buffered_samples'] * 100 / stats['buffer_samples'], 1)
+            sample['buffered_ms'] = round(stats['buffered_samples'] * 1000 / stats['sample_rate'], 1)
+            sample['underruns'] = stats['underruns']
+        if 'queue_depth' in stats:
+            sample['queue_depth'] = stats['queue_depth']
+            sample['bytes_per_second'] = round((stats['bytes_sent'] - self._last_bytes) / elapsed) \
+                if elapsed > 0 else 0
+            sample['total_stall'] = round(stats['total_stall'] * 1000, 1)
+            self._last_bytes = stats['bytes_sent']
+
+        if self.log is not None:
+            self.log.write(sample)
+        if self.status:
+            print('\r' + format_status(sample), end='', file=sys.stderr, flush=True)
+        return sample
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+            self._take_sample()
+        if self.status:
+            print(file=sys.stderr)
+        if self.log is not None:
+            self.log.close()
+
+
+def format_status(sample):
+    parts = [f'{sample["position"]:8.2f}s', f'{sample["write_rate"]:6d} writes/s']
+    if 'lateness_max' in sample:
+        parts.append(f'late max {sample["lateness_max"]:6.2f} ms')
+    if 'buffer_fill' in sample:
+        parts.append(f'buffer {sample["buffer_fill"]:5.1f}%')
+        parts.append(f'underruns {sample["underruns"]}')
+    if 'queue_depth' in sample:
+        parts.append(f'queue {sample["queue_depth"]:3d}')
+        parts.append(f'{sample["bytes_per_second"]:6d} B/s')
+    return '  '.join(parts)
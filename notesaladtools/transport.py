@@ -0,0 +1,250 @@
+from collections import deque
+from copy import copy
+import queue
+import sys
+import threading
+import time
+
+from .events import EndEvent, OPLWriteEvent, OPMWriteEvent
+from .scheduler import PlaybackScheduler
+
+
+class LinkModel:
+    def __init__(self, baud=115200, write_size=3, bits_per_byte=10):
+        self.baud = baud
+        self.write_size = write_size
+        self.bytes_per_second = baud / bits_per_byte
+
+    def get_send_time(self, writes):
+        return (writes * self.write_size) / self.bytes_per_second
+
+
+def is_key_write(event):
+    if isinstance(event, OPLWriteEvent):
+        return 0xb0 <= (event.reg & 0xff) <= 0xb8 or event.reg == 0xbd
+    if isinstance(event, OPMWriteEvent):
+        return event.reg == 0x08
+    return False
+
+
+def group_events(events):
+    group = []
+    for event in events:
+        if len(group) > 0 and event.time != group[0].time:
+            yield group
+            group = []
+        group.append(event)
+    if len(group) > 0:
+        yield group
+
+
+def get_collapse_key(event):
+    # Writes with the same key replace each other. OPM register 0x19 holds
+    # both AMD and PMD, selected by bit 7, and writes to 0x01 pulse the LFO
+    # reset, so none of those are replaced.
+    if isinstance(event, OPMWriteEvent):
+        if event.reg == 0x01:
+            return None
+        if event.reg == 0x19:
+            return (OPMWriteEvent, event.reg, event.value & 0x80)
+    return (type(event), getattr(event, 'chip', 0), event.reg)
+
+
+def collapse_writes(group):
+    # Only the last write to a register in a group reaches the chip in time
+    # to matter, except around key on writes, which retrigger notes using the
+    # values written so far
+    keep = [True] * len(group)
+    latest = {}
+    for i, event in enumerate(group):
+        if not isinstance(event, (OPLWriteEvent, OPMWriteEvent)):
+            continue
+        if is_key_write(event):
+            latest.clear()
+            continue
+        key = get_collapse_key(event)
+        if key is None:
+            continue
+        if key in latest:
+            keep[latest[key]] = False
+        latest[key] = i
+    return [event for (event, kept) in zip(group, keep) if kept]
+
+
+class LinkGroup:
+    def __init__(self, time, events, send_time):
+        self.time = time
+        self.events = events
+        self.send_time = send_time
+
+
+class LinkScheduler:
+    def __init__(self, link, time_base, lookahead=0.1, max_lead=0.02, tolerance=0.001, collapse=True,
+                 warn=True):
+        self.link = link
+        self.time_base = time_base
+        self.lookahead = lookahead
+        self.max_lead = max_lead
+        self.tolerance = tolerance
+        self.collapse = collapse
+        self.warn = warn
+        self.groups = 0
+        self.late_groups = []
+        self.collapsed_writes = 0
+        self._registers = {}
+        self._link_free = None
+        self._last_warning = None
+
+    def _count_writes(self, events):
+        # Writes that do not change a register are dropped by the controller
+        # and never reach the link
+        writes = 0
+        for event in events:
+            if isinstance(event, (OPLWriteEvent, OPMWriteEvent)):
+                key = (type(event), getattr(event, 'chip', 0), event.reg)
+                if self._registers.get(key) != event.value:
+                    self._registers[key] = event.value
+                    writes += 1
+        return writes
+
+    def _add_group(self, window, events):
+        if self.collapse:
+            collapsed = collapse_writes(events)
+            self.collapsed_writes += len(events) - len(collapsed)
+            events = collapsed
+        time = events[0].time / self.time_base
+        window.append(LinkGroup(time, events,
+                      self.link.get_send_time(self._count_writes(events))))
+
+    def _schedule_group(self, window):
+        # The latest each group can start sending and still finish on time,
+        # given the groups after it in the window
+        latest_start = float('inf')
+        for group in reversed(window):
+            latest_start = min(group.time, latest_start) - group.send_time
+
+        group = window.popleft()
+        self.groups += 1
+        # Nothing can be sent before the start of the stream
+        start = max(latest_start, group.time - self.max_lead, 0)
+        if self._link_free is not None:
+            start = max(start, self._link_free)
+        end = start + group.send_time
+        self._link_free = end
+
+        lateness = end - group.time
+        if lateness > self.tolerance:
+            self.late_groups.append((group.time, len(group.events), lateness))
+            if self.warn and (self._last_warning is None or group.time - self._last_warning >= 1):
+                self._last_warning = group.time
+                print(f'Link saturated at {group.time:.3f}s: writes {lateness * 1000:.1f} ms late',
+                      file=sys.stderr)
+
+        start_time = min(
+            round(start * self.time_base), group.events[0].time)
+        for event in group.events:
+            if not isinstance(event, EndEvent) and event.time != start_time:
+                event = copy(event)
+                event.time = start_time
+            yield event
+
+    def schedule(self, events):
+        window = deque()
+        for events_group in group_events(events):
+            self._add_group(window, events_group)
+            while window[-1].time - window[0].time > self.lookahead:
+                yield from self._schedule_group(window)
+        while len(window) > 0:
+            yield from self._schedule_group(window)
+
+
+class SerialWriter:
+    # Sends packets to a serial device from a dedicated thread, which owns
+    # output timing. Callers queue packets stamped with their playback time
+    # and only block when the queue is full.
+    def __init__(self, device, queue_size=256):
+        self.device = device
+        self.scheduler = PlaybackScheduler()
+        self.queue = queue.Queue(queue_size)
+        self.max_queue_depth = 0
+        self.max_stall = 0
+        self.total_stall = 0
+        self.bytes_sent = 0
+        self._time = 0
+        self._cleared = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def send(self, data):
+        item = (self._time, data)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            start_time = time.perf_counter()
+            self.queue.put(item)
+            stall = time.perf_counter() - start_time
+            self.total_stall += stall
+            self.max_stall = max(self.max_stall, stall)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def send_now(self, data):
+        # Sent as soon as possible rather than at its place in the timeline,
+        # for resets that must not wait behind the packets queued before them
+        self.queue.put((None, data))
+
+    def advance(self, wait_time):
+        self._time += wait_time
+
+    def get_stats(self):
+        return {'queue_depth': self.queue_depth, 'queue_size': self.queue.maxsize, 'bytes_sent': self.bytes_sent,
+                'total_stall': self.total_stall}
+
+    def sync(self):
+        self.queue.join()
+
+    def clear(self):
+        # Also interrupts the wait for a packet taken from the queue already
+        self._cleared.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+
+    def _run(self):
+        last_time = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            (packet_time, data) = item
+            if self._cleared.is_set():
+                # Restart the timeline after a clear, dropping any packet
+                # taken from the queue before it
+                self._cleared.clear()
+                self.scheduler.restart()
+                last_time = None
+                if packet_time is not None:
+                    self.queue.task_done()
+                    continue
+            if packet_time is not None:
+                if last_time is not None and packet_time > last_time:
+                    if not self.scheduler.wait(packet_time - last_time, self._cleared):
+                        # Cleared while waiting, so this packet is out of date
+                        self.queue.task_done()
+                        continue
+                last_time = packet_time
+            self.device.write(data)
+            self.device.flush()
+            self.bytes_sent += len(data)
+            self.queue.task_done()
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
@@ -41,23 +41,58 @@ def convert_time_base(src_time, src_time_base, dest_time_base):
     return round((seconds * dest_time_base) + (fraction * dest_time_base))
 
 
+def _make_retrowave_7bit_tables(flag_bit):
+    # Each group of 7 input bytes is encoded as 8 output bytes, each holding
+    # 7 bits of data above the flag bit. Output byte k of a group is made of
+    # the low bits of input byte k - 1 and the high bits of input byte k.
+    first = bytes((value | flag_bit) for value in range(256))
+    low = [None] + [bytes((((value << (8 - k)) & 0xff) | flag_bit) for value in range(256))
+                    for k in range(1, 8)]
+    high = [None] + [bytes((value >> k) for value in range(256))
+                     for k in range(1, 7)]
+    return (first, low, high)
+
+
+retrowave_7bit_tables = {
+    False: _make_retrowave_7bit_tables(0x00),
+    True: _make_retrowave_7bit_tables(0x01)
+}
+
+
 def retrowave_7bit_encode(data: bytes, flag: bool) -> bytes:
-    output = bytearray()
+    length = len(data)
+    output = bytearray(length + ((length + 6) // 7))
 
-    if len(data) < 1:
+    if length < 1:
         return output
 
-    flag_bit = 0x01 if flag else 0x00
+    (first, low, high) = retrowave_7bit_tables[bool(flag)]
+    data = bytes(data)
 
-    bit_offset = 0
-    for input_byte in data:
-        if bit_offset == 0:
-            output.append(input_byte | flag_bit)
-            output.append(((input_byte << 7) & 0xff) | flag_bit)
-            bit_offset = 2
-        else:
-            output[-1] |= (input_byte >> (bit_offset - 1)) & 0x7f
-            output.append(((input_byte << (8 - bit_offset)) & 0xff) | flag_bit)
-            bit_offset = (bit_offset + 1) % 8
+    output[0::8] = data[0::7].translate(first)
+    for k in range(1, 8):
+        column = data[k - 1::7].translate(low[k])
+        if k < 7:
+            high_bits = data[k::7].translate(high[k])
+            if len(high_bits) > 0:
+                column = (int.from_bytes(column, 'little') | int.from_bytes(high_bits, 'little')).to_bytes(
+                    len(column), 'little')
+        output[k::8] = column
+
+    return output
 
+
+def retrowave_7bit_decode(data: bytes) -> bytes:
+    # Each encoded byte carries 7 bits of data above the flag bit, most
+    # significant first. Leftover bits at the end are padding.
+    output = bytearray()
+    bits = 0
+    bit_count = 0
+    for value in data:
+        bits = (bits << 7) | (value >> 1)
+        bit_count += 7
+        if bit_count >= 8:
+            bit_count -= 8
+            output.append((bits >> bit_count) & 0xff)
+            bits &= (1 << bit_count) - 1
     return output
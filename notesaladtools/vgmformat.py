@@ -69,77 +69,77 @@ class VGMHeader:
         self.c352_clock = 0
         self.ga20_clock = 0
 
+    @classmethod
+    def unpack(cls, data):
+        # Headers before version 1.51 are shorter, and the command data that
+        # follows them reads as zero
+        header = cls()
+        header_size = vgm_header_struct.size
+        if len(data) >= 0x38:
+            (vgm_data_offset,) = struct.unpack_from('<I', data, 0x34)
+            if vgm_data_offset != 0:
+                header_size = min(header_size, vgm_data_offset + 0x34)
+        data = data[:header_size].ljust(vgm_header_struct.size, b'\x00')
+        values = iter(vgm_header_struct.unpack(data))
+        for name in vgm_header_fields:
+            if name == 'ay_flags':
+                header.ay_flags = next(values) | (next(values) << 8) | (next(values) << 16)
+            else:
+                setattr(header, name, next(values))
+        return header
+
     def pack(self):
-        return struct.pack(
-            '<4sIIIIIIIIIHBBIIIIIIIIIIIIIIIIIIIBBBBBxBBIIIIIBBBxIIIIIIIIIIIIIIIHBxIII28x',
-            self.ident,
-            self.eof_offset,
-            self.version,
-            self.sn76489_clock,
-            self.ym2413_clock,
-            self.gd3_offset,
-            self.total_samples,
-            self.loop_offset,
-            self.loop_samples,
-            self.rate,
-            self.sn_fb,
-            self.snw,
-            self.sf,
-            self.ym2612_clock,
-            self.ym2151_clock,
-            self.vgm_data_offset,
-            self.sega_pcm_clock,
-            self.spcm_interface,
-            self.rf5c68_clock,
-            self.ym2203_clock,
-            self.ym2608_clock,
-            self.ym2610_b_clock,
-            self.ym3812_clock,
-            self.ym3526_clock,
-            self.y8950_clock,
-            self.ymf262_clock,
-            self.ymf278b_clock,
-            self.ymf271_clock,
-            self.ymz280b_clock,
-            self.rf5c164_clock,
-            self.pwm_clock,
-            self.ay8910_clock,
-            self.ayt,
-            self.ay_flags & 0xff,
-            (self.ay_flags >> 8) & 0xff,
-            (self.ay_flags >> 16) & 0xff,
-            self.vm,
-            self.lb,
-            self.lm,
-            self.gb_dmg_clock,
-            self.nes_apu_clock,
-            self.multipcm_clock,
-            self.upd7759_clock,
-            self.okim6258_clock,
-            self.of,
-            self.kf,
-            self.cf,
-            self.okim6295_clock,
-            self.k051649_clock,
-            self.k054539_clock,
-            self.huc6280_clock,
-            self.c140_clock,
-            self.k053260_clock,
-            self.pokey_clock,
-            self.qsound_clock,
-            self.scsp_clock,
-            self.extra_hdr_ofs,
-            self.wonderswan_clock,
-            self.vsu_clock,
-            self.saa1099_clock,
-            self.es5503_clock,
-            self.es5506_clock,
-            self.es_chns,
-            self.cd,
-            self.x1_010_clock,
-            self.c352_clock,
-            self.ga20_clock
-        )
+        values = []
+        for name in vgm_header_fields:
+            if name == 'ay_flags':
+                values.extend((self.ay_flags & 0xff, (self.ay_flags >> 8) & 0xff, (self.ay_flags >> 16) & 0xff))
+            else:
+                values.append(getattr(self, name))
+        return vgm_header_struct.pack(*values)
+
+
+# Field order within the header. The AY8910 flags are stored as 3 bytes.
+vgm_header_struct = struct.Struct(
+    '<4sIIIIIIIIIHBBIIIIIIIIIIIIIIIIIIIBBBBBxBBIIIIIBBBxIIIIIIIIIIIIIIIHBxIII28x')
+vgm_header_fields = (
+    'ident', 'eof_offset', 'version', 'sn76489_clock', 'ym2413_clock', 'gd3_offset', 'total_samples', 'loop_offset',
+    'loop_samples', 'rate', 'sn_fb', 'snw', 'sf', 'ym2612_clock', 'ym2151_clock', 'vgm_data_offset',
+    'sega_pcm_clock', 'spcm_interface', 'rf5c68_clock', 'ym2203_clock', 'ym2608_clock', 'ym2610_b_clock',
+    'ym3812_clock', 'ym3526_clock', 'y8950_clock', 'ymf262_clock', 'ymf278b_clock', 'ymf271_clock',
+    'ymz280b_clock', 'rf5c164_clock', 'pwm_clock', 'ay8910_clock', 'ayt', 'ay_flags', 'vm', 'lb', 'lm',
+    'gb_dmg_clock', 'nes_apu_clock', 'multipcm_clock', 'upd7759_clock', 'okim6258_clock', 'of', 'kf', 'cf',
+    'okim6295_clock', 'k051649_clock', 'k054539_clock', 'huc6280_clock', 'c140_clock', 'k053260_clock',
+    'pokey_clock', 'qsound_clock', 'scsp_clock', 'extra_hdr_ofs', 'wonderswan_clock', 'vsu_clock',
+    'saa1099_clock', 'es5503_clock', 'es5506_clock', 'es_chns', 'cd', 'x1_010_clock', 'c352_clock', 'ga20_clock'
+)
+
+# Chip names by clock field. Bit 30 of a clock marks a second chip.
+vgm_chip_clocks = (
+    ('sn76489_clock', 'SN76489'), ('ym2413_clock', 'YM2413'), ('ym2612_clock', 'YM2612'),
+    ('ym2151_clock', 'YM2151'), ('sega_pcm_clock', 'SegaPCM'), ('rf5c68_clock', 'RF5C68'),
+    ('ym2203_clock', 'YM2203'), ('ym2608_clock', 'YM2608'), ('ym2610_b_clock', 'YM2610'),
+    ('ym3812_clock', 'YM3812'), ('ym3526_clock', 'YM3526'), ('y8950_clock', 'Y8950'), ('ymf262_clock', 'YMF262'),
+    ('ymf278b_clock', 'YMF278B'), ('ymf271_clock', 'YMF271'), ('ymz280b_clock', 'YMZ280B'),
+    ('rf5c164_clock', 'RF5C164'), ('pwm_clock', 'PWM'), ('ay8910_clock', 'AY8910'), ('gb_dmg_clock', 'GB DMG'),
+    ('nes_apu_clock', 'NES APU'), ('multipcm_clock', 'MultiPCM'), ('upd7759_clock', 'uPD7759'),
+    ('okim6258_clock', 'OKIM6258'), ('okim6295_clock', 'OKIM6295'), ('k051649_clock', 'K051649'),
+    ('k054539_clock', 'K054539'), ('huc6280_clock', 'HuC6280'), ('c140_clock', 'C140'),
+    ('k053260_clock', 'K053260'), ('pokey_clock', 'Pokey'), ('qsound_clock', 'QSound'), ('scsp_clock', 'SCSP'),
+    ('wonderswan_clock', 'WonderSwan'), ('vsu_clock', 'VSU'), ('saa1099_clock', 'SAA1099'),
+    ('es5503_clock', 'ES5503'), ('es5506_clock', 'ES5506'), ('x1_010_clock', 'X1-010'), ('c352_clock', 'C352'),
+    ('ga20_clock', 'GA20')
+)
+
+
+def get_vgm_chips(header):
+    chips = []
+    for (field, name) in vgm_chip_clocks:
+        clock = getattr(header, field)
+        if clock & 0x3fffffff != 0:
+            chips.append(name)
+            if clock & 0x40000000:
+                chips.append(name)
+    return chips
 
 
 class GD3Tag:
@@ -177,8 +177,35 @@ class GD3Tag:
         gd3 = b'Gd3 \x00\x01\x00\x00' + struct.pack('<I', len(gd3)) + gd3
         return gd3
 
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < 12 or data[:4] != b'Gd3 ':
+            return None
+        (length,) = struct.unpack_from('<I', data, 8)
+        fields = data[12:12 + length].decode('utf-16_le', errors='replace').split('\x00')
+        gd3_tag = cls()
+        for (name, field) in zip(gd3_field_names, fields):
+            setattr(gd3_tag, name, field)
+        return gd3_tag
+
     def is_empty(self):
         for field in self.get_fields():
             if field != '':
                 return False
-            return True
+        return True
+
+
+gd3_field_names = ('track_name_en', 'track_name_jp', 'game_name_en', 'game_name_jp', 'system_name_en',
+                   'system_name_jp', 'track_author_en', 'track_author_jp', 'release_date', 'vgm_author', 'notes')
+
+
+def read_gd3_tag(input_file, header):
+    # The GD3 offset is relative to its own position in the header
+    if header.gd3_offset == 0:
+        return None
+    input_file.seek(header.gd3_offset + 0x14)
+    data = input_file.read(12)
+    if len(data) < 12 or data[:4] != b'Gd3 ':
+        return None
+    (length,) = struct.unpack_from('<I', data, 8)
+    return GD3Tag.unpack(data + input_file.read(length))
@@ -0,0 +1,129 @@
+import os
+import select
+import threading
+import time
+
+from .utils import retrowave_7bit_decode
+
+protocols = ('oplser', 'opmser', 'rwave')
+
+
+class FrameDecoder:
+    # 3 byte port, register, value frames, as sent to the OPL and OPM serial
+    # interfaces. A port of 0xFF resets the chip.
+    def __init__(self):
+        self.frame = bytearray()
+
+    def feed(self, value):
+        self.frame.append(value)
+        if len(self.frame) < 3:
+            return []
+        (port, reg, value) = self.frame
+        self.frame = bytearray()
+        if port == 0xff:
+            return [(None, None)]
+        return [(((port & 0x01) << 8) | reg, value)]
+
+
+class RetroWaveDecoder:
+    # Packets of 7-bit encoded SPI data between 0x00 and 0x02. Encoded bytes
+    # always have their flag bit set, so neither delimiter can appear inside
+    # a packet.
+    def __init__(self):
+        self.packet = None
+
+    def feed(self, value):
+        if value == 0x00:
+            self.packet = bytearray()
+        elif value == 0x02:
+            if self.packet is None:
+                return []
+            data = retrowave_7bit_decode(self.packet)
+            self.packet = None
+            return self.decode_spi(data)
+        elif self.packet is not None:
+            self.packet.append(value)
+        return []
+
+    @staticmethod
+    def decode_spi(data):
+        # After the expander address and register, bytes alternate between
+        # the control lines on GPIOA and the data bus on GPIOB
+        if len(data) < 3 or data[0] != 0x42 or data[1] != 0x12:
+            return []
+        writes = []
+        port = 0
+        reg = 0
+        for i in range(2, len(data), 2):
+            control = data[i]
+            if control == 0xfe:
+                writes.append((None, None))
+            elif i + 1 >= len(data):
+                break
+            elif control in (0xe1, 0xe5):
+                port = 1 if control == 0xe5 else 0
+                reg = data[i + 1]
+            elif control in (0xe3, 0xe7):
+                writes.append(((port << 8) | reg, data[i + 1]))
+        return writes
+
+
+class VirtualSerialDevice:
+    # Serves a pseudo-terminal that stands in for a serial chip interface,
+    # decoding and timestamping the writes sent to it. If a baud rate is given,
+    # timestamps include the time the bytes would take to cross a real link.
+    def __init__(self, protocol='oplser', baud=None):
+        if protocol not in protocols:
+            raise ValueError('Invalid protocol')
+        self.protocol = protocol
+        self.baud = baud
+        self.decoder = RetroWaveDecoder() if protocol == 'rwave' else FrameDecoder()
+        self.writes = []
+        self.resets = []
+        self.bytes_received = 0
+
+        import tty
+        (self.master_fd, self.slave_fd) = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.path = os.ttyname(self.slave_fd)
+
+        self._link_time = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _receive(self, data, receive_time):
+        byte_time = 0 if not self.baud else 10 / self.baud
+        link_time = max(self._link_time, receive_time)
+        for value in data:
+            link_time += byte_time
+            for (reg, reg_value) in self.decoder.feed(value):
+                if reg is None:
+                    self.resets.append(link_time)
+                else:
+                    self.writes.append((link_time, reg, reg_value))
+        self._link_time = link_time
+        self.bytes_received += len(data)
+
+    def _run(self):
+        while self._running:
+            (readable, _, _) = select.select([self.master_fd], [], [], 0.1)
+            if len(readable) == 0:
+                continue
+            try:
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                break
+            self._receive(data, time.perf_counter())
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
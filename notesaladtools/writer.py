@@ -1,4 +1,3 @@
-import gzip
 import io
 import os
 import struct
@@ -29,6 +28,7 @@ class VGMWriter(Writer):
         self.ym3812_clock = 0
         self.ymf262_clock = 0
         self.ym2151_clock = 0
+        self.dual_opl = False
         self.duration = 0
         self.events = []
         self.gd3_tag = None
@@ -41,6 +41,10 @@ class VGMWriter(Writer):
 
         self.events.append(event)
         if isinstance(event, OPLWriteEvent):
+            if event.chip > 1:
+                raise ValueError('VGM files support at most two OPL chips')
+            if event.chip == 1:
+                self.dual_opl = True
             if event.reg & 0x100 and self.ymf262_clock == 0:
                 self.ymf262_clock = 14318180
                 self.ym3812_clock = 0
@@ -60,16 +64,18 @@ class VGMWriter(Writer):
             self._write_delay(time)
 
             if isinstance(event, OPLWriteEvent):
+                # The second chip has its own set of commands
+                (opl2_cmd, opl3_cmds) = (0xaa, (0xae, 0xaf)) if event.chip == 1 else (0x5a, (0x5e, 0x5f))
                 if self.ymf262_clock != 0:
                     if event.reg & 0x100:
                         self.output_file.write(struct.pack(
-                            '<BBB', 0x5f, event.reg & 0xff, event.value))
+                            '<BBB', opl3_cmds[1], event.reg & 0xff, event.value))
                     else:
                         self.output_file.write(struct.pack(
-                            '<BBB', 0x5e, event.reg, event.value))
+                            '<BBB', opl3_cmds[0], event.reg, event.value))
                 elif self.ym3812_clock != 0 and not event.reg & 0x100:
                     self.output_file.write(struct.pack(
-                        '<BBB', 0x5a, event.reg, event.value))
+                        '<BBB', opl2_cmd, event.reg, event.value))
             elif isinstance(event, OPMWriteEvent):
                 if self.ym2151_clock != 0:
                     self.output_file.write(struct.pack(
@@ -78,7 +84,7 @@ class VGMWriter(Writer):
                 markers[event.index] = {
                     'pos': self.output_file.tell(), 'time': time}
             elif isinstance(event, JumpToMarkerEvent):
-                if loop_start_marker is not None:
+                if loop_start_marker is None:
                     loop_start_marker = markers[event.index]
                     loop_end_time = time
 
@@ -97,6 +103,12 @@ class VGMWriter(Writer):
         header.vgm_data_offset = 0xcc
         header.ym3812_clock = self.ym3812_clock
         header.ymf262_clock = self.ymf262_clock
+        if self.dual_opl:
+            # Bit 30 of the clock marks a second chip of the same type
+            if self.ymf262_clock != 0:
+                header.ymf262_clock |= 0x40000000
+            else:
+                header.ym3812_clock |= 0x40000000
         header.gd3_offset = gd3_offset
 
         if loop_end_time is not None and loop_start_marker is not None:
@@ -179,5 +191,6 @@ def open_writer(path):
     if ext == '.vgm':
         return VGMWriter(open(path, 'wb'))
     if ext == '.vgz':
+        import gzip
         return VGMWriter(BufferedStream(gzip.open(path, 'wb')))
     return None
@@ -9,7 +9,10 @@ setup(name='notesaladtools',
               'nsdump=notesaladtools.nsdump:main',
               'nsplay=notesaladtools.nsplay:main',
               'nsconvert=notesaladtools.nsconvert:main',
-              'nsmidi=notesaladtools.nsmidi:main'
+              'nsmidi=notesaladtools.nsmidi:main',
+              'nsrender=notesaladtools.nsrender:main',
+              'nslinkbench=notesaladtools.nslinkbench:main',
+              'nsindex=notesaladtools.nsindex:main'
           ]
       }
       )
@@ -0,0 +1,9 @@
+from notesaladtools.catalogue import Catalogue, update_catalogue
+
+
+def test_failed_files_are_analysed_again(tmp_path):
+    (tmp_path / 'bad.vgm').write_bytes(b'not a VGM file')
+    with Catalogue(str(tmp_path / 'catalogue.db')) as catalogue:
+        for _ in range(2):
+            statuses = [status for (status, _, _) in update_catalogue(catalogue, [str(tmp_path)], workers=1)]
+            assert statuses == ['failed']
@@ -0,0 +1,43 @@
+from notesaladtools.events import OPLWriteEvent
+from notesaladtools.nslinkbench import match_writes, record_writes
+
+
+class EventList:
+    time_base = 44100
+
+    def __init__(self, events):
+        self.events = events
+        self.duration = events[-1].time
+
+    def read_events(self):
+        return iter(self.events)
+
+
+def get_bursts():
+    # Each burst rewrites a frequency register before keying the note on,
+    # so the first write of each pair is superseded
+    events = []
+    for i in range(0, 20):
+        time = i * 4410
+        events.extend([OPLWriteEvent(time, 0xa0, i), OPLWriteEvent(time, 0xa0, i + 100),
+                       OPLWriteEvent(time, 0xb0, 0x20 | (i & 1))])
+    return events
+
+
+def test_expected_writes_are_collapsed_like_nsplay():
+    expected = record_writes(EventList(get_bursts()), 'oplser', lookahead=0.2)
+    assert [(reg, value) for (_, reg, value) in expected[:2]] == [(0xa0, 100), (0xb0, 0x20)]
+
+
+def test_match_collapsed_stream():
+    expected = record_writes(EventList(get_bursts()), 'oplser', lookahead=0.2)
+    actual = [(write_time + 5, reg, value) for (write_time, reg, value) in expected]
+    pairs = match_writes(expected, actual)
+    assert len(pairs) == len(expected)
+    assert all(actual_time - expected_time == 5 for (expected_time, actual_time) in pairs)
+
+
+def test_match_does_not_skip_far_ahead():
+    expected = [(0.0, 0xa0, 1), (0.1, 0xa0, 2), (2.0, 0xa0, 3), (2.1, 0xa0, 1)]
+    actual = [(10.0, 0xa0, 1), (10.1, 0xa0, 2), (10.15, 0xa0, 1)]
+    assert match_writes(expected, actual) == [(0.0, 10.0), (0.1, 10.1)]
@@ -0,0 +1,12 @@
+import os
+
+from notesaladtools.render import get_output_names
+
+
+def test_output_names_keep_subdirectories():
+    names = get_output_names(['library/a/song.vgz', 'library/b/song.vgz', 'library/intro.vgz'])
+    assert names == [os.path.join('a', 'song'), os.path.join('b', 'song'), 'intro']
+
+
+def test_output_names_keep_extension_of_clashing_inputs():
+    assert get_output_names(['song.vgm', 'song.vgz', 'other.vgz']) == ['song_vgm', 'song_vgz', 'other']
@@ -0,0 +1,41 @@
+from notesaladtools.events import OPLWriteEvent, OPMWriteEvent
+from notesaladtools.transport import LinkModel, LinkScheduler, collapse_writes
+
+
+def get_writes(group):
+    return [(event.reg, event.value) for event in group]
+
+
+def test_collapse_keeps_last_write_to_register():
+    group = [OPLWriteEvent(0, 0xa0, 0x11), OPLWriteEvent(0, 0xa0, 0x22)]
+    assert get_writes(collapse_writes(group)) == [(0xa0, 0x22)]
+
+
+def test_collapse_keeps_opm_amd_and_pmd():
+    group = [OPMWriteEvent(0, 0x19, 0x40), OPMWriteEvent(0, 0x19, 0x85)]
+    assert get_writes(collapse_writes(group)) == [(0x19, 0x40), (0x19, 0x85)]
+
+    group = [OPMWriteEvent(0, 0x19, 0x40), OPMWriteEvent(0, 0x19, 0x85), OPMWriteEvent(0, 0x19, 0x30)]
+    assert get_writes(collapse_writes(group)) == [(0x19, 0x85), (0x19, 0x30)]
+
+
+def test_collapse_keeps_opm_lfo_reset():
+    group = [OPMWriteEvent(0, 0x01, 0x02), OPMWriteEvent(0, 0x01, 0x00)]
+    assert get_writes(collapse_writes(group)) == [(0x01, 0x02), (0x01, 0x00)]
+
+
+def test_collapse_keeps_writes_to_each_chip():
+    group = [OPLWriteEvent(0, 0xa0, 0x11, 0), OPLWriteEvent(0, 0xa0, 0x22, 1)]
+    assert [(event.chip, event.value) for event in collapse_writes(group)] == [(0, 0x11), (1, 0x22)]
+
+
+def test_link_scheduler_counts_writes_to_each_chip():
+    scheduler = LinkScheduler(LinkModel(), 44100)
+    group = [OPLWriteEvent(0, 0xa0, 0x11, 0), OPLWriteEvent(0, 0xa0, 0x11, 1)]
+    assert scheduler._count_writes(group) == 2
+
+
+def test_link_scheduler_does_not_schedule_before_start():
+    scheduler = LinkScheduler(LinkModel(), 44100, warn=False)
+    events = [OPLWriteEvent(0, 0xa0, 0x11), OPLWriteEvent(0, 0xb0, 0x20), OPLWriteEvent(4410, 0xa0, 0x22)]
+    assert min(event.time for event in scheduler.schedule(events)) == 0
@@ -0,0 +1,21 @@
+from notesaladtools.events import JumpToMarkerEvent, MarkerEvent, OPLWriteEvent
+from notesaladtools.vgmformat import VGMHeader
+from notesaladtools.writer import VGMWriter
+
+
+def test_vgm_writer_sets_loop(tmp_path):
+    path = tmp_path / 'loop.vgm'
+    writer = VGMWriter(open(path, 'wb'))
+    writer.write_event(OPLWriteEvent(0, 0xa0, 0x11))
+    writer.write_event(MarkerEvent(4410, 0))
+    writer.write_event(OPLWriteEvent(4410, 0xa0, 0x22))
+    writer.write_event(JumpToMarkerEvent(44100, 0))
+    writer.close()
+
+    data = path.read_bytes()
+    header = VGMHeader.unpack(data)
+    # The loop starts at the write after the marker, following a 4410 sample
+    # wait and the first write
+    assert header.loop_offset == 0x100 + 3 + 3 - 0x1c
+    assert header.loop_samples == 44100 - 4410
+    assert data[header.loop_offset + 0x1c:][:3] == bytes((0x5a, 0xa0, 0x22))